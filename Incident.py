@@ -1,42 +1,80 @@
 # Время на решение убрал
-import datetime
 import asyncio
-import re
+import collections
+import copy
+import datetime
 import os
-import json
 import logging
+import re
+import signal
+import socket
+import time
 from dotenv import load_dotenv
 from telegram import Update, Bot
-from telegram.ext import ApplicationBuilder, MessageHandler, filters, ContextTypes
-from apscheduler.schedulers.background import BackgroundScheduler
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
 from zoneinfo import ZoneInfo
-from telegram.error import ChatMigrated, Forbidden
-
+from incbot import parser
+from incbot.analytics import Analytics
+from incbot.catchup import CatchUp, DedupCache, drain, message_key
+from incbot.concurrency import KeyedUpdateProcessor
+from incbot.digest import ReminderCoalescer
+from incbot.escalation import load_policy
+from incbot.fanout import Broadcaster
+from incbot.journal import MAX_INCIDENT_MESSAGES
+from incbot.leader import Lease
+from incbot.logs import setup_logging
+from incbot.metrics import BYTES_BUCKETS, LAG_BUCKETS, MetricsServer, Registry
+from incbot.outbox import Outbox
+from incbot.parser import extract_jira_key, extract_key
+from incbot.timers import TimerEngine
+from incbot.transport import PooledRequest
+from incbot.storage import StoreWriter, open_store
+
+# Импорт модуля только читает настройки (.env и переменные окружения) и определяет обработчики:
+# логи, хранилище, outbox, политика напоминаний и HTTP-клиенты поднимаются в build_runtime().
+# Разбор сообщений без бота — incbot.parser (и пакетно: python -m incbot.batch).
 load_dotenv()
 
-os.environ.pop("HTTP_PROXY", None)
-os.environ.pop("HTTPS_PROXY", None)
-os.environ.pop("http_proxy", None)
-os.environ.pop("https_proxy", None)
-
-# Настройка логирования в файл (только наши логи, без токенов от библиотек)
-LOG_DIR = os.path.dirname(os.path.abspath(__file__))
-LOG_FILE = os.path.join(LOG_DIR, "incident.log")
+# Горячий резерв: экземпляры с общим HA_LEASE_DB, работает только держатель аренды (см. incbot/leader.py).
+# Не задан — один экземпляр, как раньше
+HA_LEASE_DB = os.getenv("HA_LEASE_DB")
+HA_LEASE_TTL = float(os.getenv("HA_LEASE_TTL", "10"))
+HA_INSTANCE = os.getenv("HA_INSTANCE") or f"{socket.gethostname()}:{os.getpid()}"
+
+# Настройка логирования в файл (только наши логи, без токенов от библиотек).
+# Запись идёт в фоновом потоке через очередь, см. incbot/logs.py.
+# В горячем резерве у каждого экземпляра свой файл (incident.<HA_INSTANCE>.log), иначе оба ротируют один;
+# чтобы имя не менялось между перезапусками, задайте HA_INSTANCE явно
+LOG_DIR = os.getenv("LOG_DIR") or os.path.dirname(os.path.abspath(__file__))
+LOG_FILE = os.getenv("LOG_FILE") or os.path.join(
+    LOG_DIR, "incident." + re.sub(r"[^\w.-]", "_", HA_INSTANCE) + ".log" if HA_LEASE_DB else "incident.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" или "json" (JSON Lines со структурными полями)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "14"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "1") == "1"
+# из текста сообщения в лог попадает только начало
+LOG_TEXT_LIMIT = 80
 
 logger = logging.getLogger("incident_bot")
-logger.setLevel(logging.INFO)
-
-_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
-
-_fh = logging.FileHandler(LOG_FILE, encoding="utf-8")
-_fh.setFormatter(_formatter)
-logger.addHandler(_fh)
-
-_sh = logging.StreamHandler()
-_sh.setFormatter(_formatter)
-logger.addHandler(_sh)
+log_listener = None
 
 INCIDENTS_FILE = "incidents.json"
+INCIDENTS_DB = "incidents.db"
+# очередь исходящих сообщений, см. incbot/outbox.py
+OUTBOX_DB = "outbox.db"
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+# Карточка статуса инцидента: одно сообщение на чат, дальше оно редактируется
+CARD_TEXT_LIMIT = 3500  # исходный текст длиннее обрезается (лимит Telegram — 4096)
+JIRA_URL = "https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/"
+# Как часто открытая карточка правится ради «Прошло с выявления», если других правок не было; 0 — не править.
+# Давние карточки правятся реже: шаг не меньше 1/CARD_REFRESH_AGE_SHARE прошедшего времени (сутки — раз в 4 ч)
+CARD_REFRESH_MINUTES = float(os.getenv("CARD_REFRESH_MINUTES", "10"))
+CARD_REFRESH_AGE_SHARE = 6
+# "sqlite" — индексированное хранилище с историей, "json" — журнал + incidents.json
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+# Сколько обновлений обрабатывается одновременно; по одному инциденту — всё равно по порядку
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "32"))
 
 BROADCAST_GROUPS = [
     {"chat_id": -1002631818202},  # test1
@@ -52,503 +90,881 @@ ALLOWED_USERS = [
     190887814,  # Elturan
 ]
 
+# Лимиты отправки (см. incbot/fanout.py): сообщений в секунду на бота и в минуту на группу.
+# По умолчанию — лимиты Telegram; для нагрузочного прогона на заглушке (bench/load.py) их поднимают
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", "30"))
+RATE_LIMIT_CHAT = float(os.getenv("RATE_LIMIT_CHAT", "20"))
+
+# Приём обновлений: "polling" (getUpdates) или "webhook" (встроенный сервер, см. incbot/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес, без пути
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Адрес Bot API; для тестов можно указать локальную заглушку, например http://127.0.0.1:8081/bot
+TG_API_URL = os.getenv("TG_API_URL", "https://api.telegram.org/bot")
+
+# HTTP-транспорты Bot API (см. incbot/transport.py): getUpdates и отправки идут через разные пулы соединений.
+# SEND_POOL_SIZE — сколько отправок одновременно в полёте; keep-alive — секунд простоя до закрытия соединения
+SEND_POOL_SIZE = int(os.getenv("SEND_POOL_SIZE", "32"))
+SEND_KEEPALIVE = float(os.getenv("SEND_KEEPALIVE_SECONDS", "30"))
+SEND_TIMEOUT = float(os.getenv("SEND_TIMEOUT", "10"))  # чтение и запись
+SEND_CONNECT_TIMEOUT = float(os.getenv("SEND_CONNECT_TIMEOUT", "5"))
+SEND_POOL_TIMEOUT = float(os.getenv("SEND_POOL_TIMEOUT", "10"))  # ожидание свободного соединения
+SEND_HTTP2 = os.getenv("SEND_HTTP2", "0") == "1"
+UPDATES_POOL_SIZE = int(os.getenv("UPDATES_POOL_SIZE", "2"))
+UPDATES_KEEPALIVE = float(os.getenv("UPDATES_KEEPALIVE_SECONDS", "60"))
+UPDATES_TIMEOUT = float(os.getenv("UPDATES_TIMEOUT", "5"))  # сверх времени long polling
+UPDATES_CONNECT_TIMEOUT = float(os.getenv("UPDATES_CONNECT_TIMEOUT", "5"))
+UPDATES_POOL_TIMEOUT = float(os.getenv("UPDATES_POOL_TIMEOUT", "5"))
+UPDATES_HTTP2 = os.getenv("UPDATES_HTTP2", "0") == "1"
+
+# Метрики Prometheus: без METRICS_PORT HTTP-сервер не поднимается, команда /metrics работает всегда
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) or None
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+
 TZ = ZoneInfo("Asia/Bishkek")
 BOT_START_TIME = datetime.datetime.now(tz=TZ)
 
+# Догон: при старте обработать сообщения, пришедшие пока бот не работал (см. incbot/catchup.py).
+# Сообщения старше CATCHUP_MAX_AGE (или все до старта, если CATCHUP=0) пропускаются.
+CATCHUP = os.getenv("CATCHUP", "1") == "1"
+CATCHUP_MAX_AGE = datetime.timedelta(hours=float(os.getenv("CATCHUP_MAX_AGE_HOURS", "24"))) if CATCHUP \
+    else datetime.timedelta(0)
+OFFSET_SAVE_INTERVAL = 5  # секунд между сохранениями last_update_id в обычном режиме
+
 # Режим тестирования: True — секунды вместо минут, False — боевой режим
 TEST_MODE = False
 
+# Лестница напоминаний по приоритетам, см. incbot/escalation.py
+ESCALATION_CONFIG = os.getenv("ESCALATION_CONFIG", "escalation.json")
+ESCALATION_TIME_SCALE = 1 / 60 if TEST_MODE else 1.0
+# Склейка напоминаний в дайджест: окно в секундах растёт с нагрузкой на чат (см. incbot/digest.py)
+DIGEST_MIN_WINDOW = float(os.getenv("DIGEST_MIN_WINDOW", "2"))
+DIGEST_MAX_WINDOW = float(os.getenv("DIGEST_MAX_WINDOW", "60"))
 
-def load_incidents():
-    if os.path.exists(INCIDENTS_FILE):
-        with open(INCIDENTS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            for incident_id, incident in data.items():
-                if isinstance(incident["time"], str):
-                    # fromisoformat поддерживает смещение, получаем aware datetime
-                    incident["time"] = datetime.datetime.fromisoformat(incident["time"].replace(" ", "T"))
-            return data
-    return {}
 
+registry = Registry()
+HANDLE_SECONDS = registry.histogram("incbot_handle_message_seconds", "Время обработки сообщения по видам", ["kind"])
+MESSAGES_DROPPED = registry.counter("incbot_messages_dropped_total",
+                                    "Сообщения, отброшенные фильтрами BOT_START_TIME и ALLOWED_USERS", ["reason"])
+SEND_SECONDS = registry.histogram("incbot_send_seconds", "Время отправки с учётом лимитов и повторов", ["chat_id"])
+SEND_ERRORS = registry.counter("incbot_send_errors_total", "Неудачные отправки", ["chat_id"])
+SAVE_SECONDS = registry.histogram("incbot_save_seconds", "Время записи события в хранилище", ["op"])
+SAVE_BYTES = registry.histogram("incbot_save_bytes", "Байты, записанные хранилищем за событие", ["op"],
+                                buckets=BYTES_BUCKETS)
+POOL_WAIT_SECONDS = registry.histogram("incbot_http_pool_wait_seconds",
+                                       "Ожидание соединения из пула HTTP-транспорта", ["transport"])
+SCHEDULER_LAG = registry.histogram("incbot_scheduler_lag_seconds", "Опоздание срабатывания напоминаний",
+                                   buckets=LAG_BUCKETS)
 
-def save_incidents(incidents):
-    incidents_to_save = {
-        incident_id: {
-            "text": incident["text"],
-            "chat_id": incident["chat_id"],
-            "time": incident["time"].isoformat() if isinstance(incident["time"], datetime.datetime) else incident[
-                "time"],
-            "jobs": incident["jobs"],
-            "priority": incident.get("priority", "средний")
-        }
-        for incident_id, incident in incidents.items()
-    }
-    with open(INCIDENTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(incidents_to_save, f, ensure_ascii=False, indent=2)
+store = None
+lease = None
+lease_lost = False
+lease_task = None
 
 
-incidents = load_incidents()
+writer = None
 
-# asyncio loop & scheduler & bot
-loop = asyncio.new_event_loop()
-asyncio.set_event_loop(loop)
-scheduler = BackgroundScheduler(timezone=TZ)
-scheduler.start()
 
+def observe_save(op, started, future):
+    if future.cancelled():
+        return
+    if future.exception():
+        logger.error(f"Ошибка записи в хранилище ({op}): {future.exception()}")
+        return
+    # время — от постановки в очередь до коммита: столько обработчик ждёт диск
+    SAVE_SECONDS.observe(time.perf_counter() - started, op)
+    SAVE_BYTES.observe(future.result(), op)
 
-def extract_key(text):
-    match = re.search(r'Инцидент:\s*(.+?)(\n|$)', text)
-    return match.group(1).strip() if match else None
 
+def persist(op, method, *args, **kwargs):
+    """Ставит store.<method>(...) в поток записи; await результата нужен, только чтобы дождаться диска."""
+    def write():
+        written = store.bytes_written
+        getattr(store, method)(*args, **kwargs)
+        return store.bytes_written - written
 
-def extract_jira_key(text):
-    match = re.search(r'(ITSMJIRA-\d+)', text)
-    return match.group(1) if match else None
+    started = time.perf_counter()
+    future = writer.submit(write)
+    future.add_done_callback(lambda f: observe_save(op, started, f))
+    return future
 
 
-def extract_resolution_time(text, message_time):
-    match = re.search(r'\b(?:в\s*)?(\d{1,2}:\d{2})\b', text)
-    if not match:
-        return message_time
-    time_str = match.group(1)
-    try:
-        hour, minute = map(int, time_str.split(':'))
-        extracted_time = message_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if extracted_time > message_time:
-            extracted_time -= datetime.timedelta(days=1)
-        return extracted_time
-    except (ValueError, IndexError):
-        return message_time
-
-
-def get_priority(text):
-    """Определяет приоритет по ключевым словам или цифрам."""
-    priority_words = {
-        "высокий": "высокий",
-        "критичный": "критичный",
-        "средний": "средний",
-        "низкий": "низкий"
-    }
-
-    for word, priority in priority_words.items():
-        if word in text.lower():
-            return priority
-
-    # Ищем цифру приоритета: "Приоритет: 3", "поднят до 3", "понижен до 3 (Средний)" и т.д.
-    match = re.search(r'(?:Приоритет[:\s]\s*|до\s+)(\d+)', text)
-    if match:
-        priority_number = match.group(1)
-        if priority_number == '1':
-            return "критичный"
-        elif priority_number == '2':
-            return "высокий"
-        elif priority_number == '3':
-            return "средний"
-        elif priority_number in ['4', '5']:
-            return "низкий"
-
-    return None
-
-
-async def safe_send(bot, chat_info, text):
-    chat_id = chat_info["chat_id"]
-    thread_id = chat_info.get("thread_id")
-    try:
-        await bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread_id)
-    except ChatMigrated as e:
-        new_id = e.new_chat_id
-        await bot.send_message(chat_id=new_id, text=text)
-    except Exception as e:
-        logger.warning(f"Не удалось отправить сообщение в {chat_id}: {e}")
+def save_incident(op, incident_id, closed_at=None):
+    """Сохраняет событие по инциденту (create/update/resolve/reject)."""
+    # в поток записи уходит копия: пока она пишется, обработчики меняют сам инцидент
+    snapshot = copy.deepcopy(incidents.get(incident_id))
+    return persist(op, "append", op, incident_id, snapshot, closed_at=closed_at)
 
 
-def schedule_reminders(app, chat_id, incident_id, start_time, priority):
-    incident = incidents.get(incident_id)
-    if incident:
-        for job_id in incident.get("jobs", []):
-            try:
-                scheduler.remove_job(job_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить задание {job_id}: {e}")
-            incident["jobs"] = []
-
-    if "средний" in priority.lower() or "низкий" in priority.lower():
-        logger.info(f"Приоритет инцидента {incident_id} не требует напоминаний.")
-        return []
+def mark_fired(incident_id, step_id):
+    return persist("fired", "mark_fired", incident_id, step_id)
 
-    jobs = []
 
-    if TEST_MODE:
-        delay_50 = datetime.timedelta(seconds=50)
-        delay_60 = datetime.timedelta(seconds=60)
-        delay_3h = datetime.timedelta(seconds=180)
-    else:
-        delay_50 = datetime.timedelta(minutes=50)
-        delay_60 = datetime.timedelta(minutes=60)
-        delay_3h = datetime.timedelta(hours=3)
-
-    job_50 = scheduler.add_job(
-        notify_50_minutes, 'date',
-        run_date=start_time + delay_50,
-        args=[app, chat_id, incident_id, loop],
-        id=f"{incident_id}_50",
-        misfire_grace_time=3600
-    )
-    jobs.append(job_50.id)
-
-    job_60 = scheduler.add_job(
-        notify_60_minutes, 'date',
-        run_date=start_time + delay_60,
-        args=[app, chat_id, incident_id, loop],
-        id=f"{incident_id}_60",
-        misfire_grace_time=3600
-    )
-    jobs.append(job_60.id)
-
-    job_3h = scheduler.add_job(
-        notify_3_hours_later, 'date',
-        run_date=start_time + delay_3h,
-        args=[app, chat_id, incident_id, loop],
-        id=f"{incident_id}_3h",
-        misfire_grace_time=3600
-    )
-    jobs.append(job_3h.id)
+incidents = {}
 
-    logger.info(f"Поставлены напоминания для {incident_id}: {jobs}")
-    return jobs
 
+def load_analytics():
+    """Счётчики для /stats: из meta хранилища, при первом запуске — одним проходом по истории."""
+    saved = store.get_meta("analytics")
+    if saved:
+        try:
+            return Analytics.loads(saved, TZ)
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Сохранённая статистика повреждена ({e}), пересчитываю по истории")
+    started = time.perf_counter()
+    result = Analytics.from_history(store.history(), TZ)
+    logger.info(f"Статистика собрана по истории за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return result
 
-def notify_50_minutes(app, chat_id, incident_id, loop):
-    if incident_id not in incidents:
-        return
-    asyncio.run_coroutine_threadsafe(
-        app.bot.send_message(chat_id=chat_id,
-                             text="Прошло 50 минут. Через 10 минут необходимо оповестить! @monitoring_cbk, @lord312, @WikiKarpenko"),
-        loop
-    )
 
+def save_analytics():
+    return persist("meta", "set_meta", "analytics", analytics.dumps())
 
-def notify_60_minutes(app, chat_id, incident_id, loop):
-    if incident_id not in incidents:
-        return
-    asyncio.run_coroutine_threadsafe(
-        app.bot.send_message(chat_id=chat_id, text="Прошло 60 минут! @monitoring_cbk, @lord312, @WikiKarpenko"), loop
-    )
 
+analytics = None
 
-def notify_3_hours_later(app, chat_id, incident_id, loop):
-    if incident_id not in incidents:
-        return
-    asyncio.run_coroutine_threadsafe(
-        app.bot.send_message(chat_id=chat_id,
-                             text="Прошло 3 часа! Проверьте статус. @monitoring_cbk, @lord312, @WikiKarpenko"), loop
-    )
 
+def index_messages(incidents):
+    """(chat_id, message_id) -> incident_id: исходные сообщения, копии рассылки и напоминания."""
+    return {(chat, message): incident_id for incident_id, incident in incidents.items()
+            for chat, message in incident.get("messages", ())}
 
-def extract_time_from_text(text, message_time):
-    """Извлекает время из текста сообщения."""
-    match = re.search(r'\b(?:в\s*)?(\d{1,2}:\d{2})\b', text)
-    if not match:
-        return None  # Возвращаем None, если время не найдено
-    time_str = match.group(1)
-    try:
-        hour, minute = map(int, time_str.split(':'))
-        extracted_time = message_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
-        if extracted_time > message_time:
-            extracted_time -= datetime.timedelta(days=1)
-        return extracted_time
-    except (ValueError, IndexError):
+
+message_index = {}
+
+
+def remember_messages(incident_id, messages):
+    """Запоминает сообщения инцидента (Message или None), чтобы ответ на любое из них находил инцидент."""
+    incident = incidents.get(incident_id)
+    pairs = [(m.chat_id, m.message_id) for m in messages if m is not None]
+    if incident is None or not pairs:
+        return
+    known = incident.setdefault("messages", [])
+    for pair in pairs:
+        message_index[pair] = incident_id
+        known.append(list(pair))
+    # индекс ограничен: на инцидент помним только последние MAX_INCIDENT_MESSAGES
+    for chat, message in known[:-MAX_INCIDENT_MESSAGES]:
+        message_index.pop((chat, message), None)
+    del known[:-MAX_INCIDENT_MESSAGES]
+    persist("messages", "add_messages", incident_id, pairs)
+
+
+def forget_messages(incident_id):
+    for chat, message in incidents[incident_id].get("messages", ()):
+        message_index.pop((chat, message), None)
+
+
+def find_incident(reply_to):
+    """Инцидент, к которому относится сообщение reply_to: по индексу, иначе по JIRA-ключу в тексте."""
+    incident_id = message_index.get((reply_to.chat_id, reply_to.message_id))
+    if incident_id is None:
+        incident_id = extract_jira_key(reply_to.text or "")
+    return incident_id
+
+
+def update_key(update):
+    """Ключ порядка обработки: инцидент, к которому относится сообщение; None — порядок не важен."""
+    message = update.message if isinstance(update, Update) else None
+    if message is None or not message.text:
         return None
+    if message.reply_to_message:
+        return find_incident(message.reply_to_message)
+    return extract_jira_key(message.text)
 
 
-def extract_detection_time(text, message_time):
-    """Извлекает время выявления из текста инцидента."""
-    # Ищем паттерн "Время выявления: ДД.ММ.ГГГГ ЧЧ:ММ"
-    match = re.search(r'Время выявления:\s*(\d{2}\.\d{2}\.\d{4})\s+(\d{1,2}:\d{2})', text)
-    if match:
-        date_str = match.group(1)  # ДД.ММ.ГГГГ
-        time_str = match.group(2)  # ЧЧ:ММ
-        try:
-            day, month, year = map(int, date_str.split('.'))
-            hour, minute = map(int, time_str.split(':'))
-            detection_time = datetime.datetime(year, month, day, hour, minute, 0, 0, tzinfo=TZ)
-            return detection_time
-        except (ValueError, IndexError):
-            pass
-
-    # Если не нашли полный формат, ищем просто время "Время выявления: ЧЧ:ММ"
-    match = re.search(r'Время выявления:\s*(\d{1,2}:\d{2})', text)
-    if match:
-        time_str = match.group(1)
-        try:
-            hour, minute = map(int, time_str.split(':'))
-            detection_time = message_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
-            if detection_time > message_time:
-                detection_time -= datetime.timedelta(days=1)
-            return detection_time
-        except (ValueError, IndexError):
-            pass
+update_processor = KeyedUpdateProcessor(update_key, CONCURRENT_UPDATES)
+registry.gauge("incbot_updates_in_flight", "Обновления в обработке (в том числе ждущие своей очереди)",
+               collect=lambda: {(): update_processor.in_flight})
 
-    # Если не нашли время выявления, возвращаем время сообщения
-    return message_time
+registry.gauge("incbot_open_incidents", "Открытые инциденты по приоритетам", ["priority"],
+               collect=lambda: collections.Counter(i.get("priority") or "" for i in incidents.values()))
 
+# напоминания работают в event loop бота, запускаются в on_startup
+timers = TimerEngine()
+policy = None
+timers.lag_observers.append(SCHEDULER_LAG.observe)
 
-def restore_jobs(incidents):
-    now = datetime.datetime.now(tz=TZ)
-    restored_count = 0
-    for incident_id, incident in incidents.items():
-        if incident.get("jobs"):
-            continue
 
-        # Проверяем приоритет - не восстанавливаем для средних/низких
-        priority = incident.get("priority", "средний")
-        if priority.lower() in ["средний", "низкий"]:
-            logger.info(f"Пропускаем восстановление для {incident_id} - приоритет {priority}")
-            continue
+def now():
+    """Текущее время по часам планировщика (в бенчмарке они виртуальные)."""
+    return datetime.datetime.fromtimestamp(timers.time_func(), tz=TZ)
 
-        time = incident["time"]
-        elapsed = now - time
 
-        remain_50 = max(datetime.timedelta(minutes=50) - elapsed, datetime.timedelta())
-        remain_60 = max(datetime.timedelta(minutes=60) - elapsed, datetime.timedelta())
-        remain_3h = max(datetime.timedelta(hours=3) - elapsed, datetime.timedelta())
+broadcaster = Broadcaster(global_rate=RATE_LIMIT_GLOBAL, global_burst=RATE_LIMIT_GLOBAL,
+                          chat_rate=RATE_LIMIT_CHAT / 60, chat_burst=RATE_LIMIT_CHAT)
 
-        if remain_50.total_seconds() > 0 or remain_60.total_seconds() > 0 or remain_3h.total_seconds() > 0:
-            # восстанавливаем только те, что еще не наступили
-            jobs = []
-            if remain_50.total_seconds() > 0:
-                jobs.append(scheduler.add_job(notify_50_minutes, 'date', run_date=now + remain_50,
-                                              args=[application, incident["chat_id"], incident_id, loop],
-                                              id=f"{incident_id}_50",
-                                              misfire_grace_time=3600).id)
-            if remain_60.total_seconds() > 0:
-                jobs.append(scheduler.add_job(notify_60_minutes, 'date', run_date=now + remain_60,
-                                              args=[application, incident["chat_id"], incident_id, loop],
-                                              id=f"{incident_id}_60",
-                                              misfire_grace_time=3600).id)
-            if remain_3h.total_seconds() > 0:
-                jobs.append(scheduler.add_job(notify_3_hours_later, 'date', run_date=now + remain_3h,
-                                              args=[application, incident["chat_id"], incident_id, loop],
-                                              id=f"{incident_id}_3h",
-                                              misfire_grace_time=3600).id)
 
-            incident["jobs"] = jobs
-            restored_count += 1
-            logger.info(f"Восстановлены напоминания для {incident_id}")
+def observe_send(chat_id, elapsed, ok):
+    SEND_SECONDS.observe(elapsed, chat_id)
+    if not ok:
+        SEND_ERRORS.inc(chat_id)
 
-    if restored_count > 0:
-        save_incidents(incidents)
-    logger.info(f"Восстановлено задач по {restored_count} инцидентам. Пересылок не делалось.")
 
+broadcaster.send_observers.append(observe_send)
 
-JIRA_PATTERN = re.compile(r'ITSMJIRA-\d+')
+outbox = None
 
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    msg = update.effective_message
-    text = msg.text
-    chat_id = msg.chat_id
-    if not update.message:
+def on_outbox_sent(entry, message):
+    # копии рассылок и напоминания тоже попадают в индекс ответов
+    if entry.incident_id:
+        remember_messages(entry.incident_id, [message])
+
+
+# резерв открывает outbox, только став лидером (см. open_outbox)
+registry.gauge("incbot_outbox_pending", "Сообщения в очереди на отправку",
+               collect=lambda: {(): len(outbox) if outbox else 0})
+registry.gauge("incbot_outbox_messages", "Итоги outbox с запуска: sent, failed, retried, deduplicated",
+               ["result"], collect=lambda: {k: v for k, v in (outbox.stats if outbox else {}).items() if ":" not in k})
+
+# HTTP-клиенты Bot API (отправки, getUpdates), создаются в build_runtime()
+transports = ()
+registry.gauge("incbot_http_requests",
+               "Запросы HTTP-транспортов с запуска: requests, new_connections, reused, pool_waits, pool_timeouts",
+               ["transport", "result"],
+               collect=lambda: {(t.name, k): v for t in transports for k, v in t.stats.items()})
+registry.gauge("incbot_http_in_flight", "Запросы HTTP-транспортов в полёте", ["transport"],
+               collect=lambda: {t.name: t.in_flight for t in transports})
+
+# повторно доставленные обновления (update_id) и, во время догона, сообщения (чат, message_id)
+processed = DedupCache()
+# пока идёт догон — CatchUp, куда откладываются рассылки; иначе None
+catchup = None
+last_update_id = None
+offset_saved_at = 0.0
+metrics_server = None
+# PTB Application, собирается в create_application()
+application = None
+
+
+def broadcast(destinations, text, incident_id=None, event=None, key=None, kind="broadcast", card=None,
+              edit_only=False):
+    """Ставит text в outbox для всех destinations; отправка — параллельно по чатам.
+
+    key — ключ события для защиты от повторной отправки (например, update_id),
+    card — ключ карточки статуса: где она уже есть, сообщение редактируется.
+    Во время догона рассылка по инциденту не ставится, а откладывается
+    в catchup вместе с описанием события (event) для итоговой сводки.
+    """
+    if catchup is not None and incident_id:
+        incident = incidents.get(incident_id)
+        name = extract_key(incident["text"]) if incident else None
+        catchup.defer(incident_id, name, event, destinations, text, new=event == "создан", key=key)
+        return 0
+    return outbox.enqueue(destinations, text, kind=kind, incident_id=incident_id, key=key, card=card,
+                          edit_only=edit_only)
+
+
+def format_duration(delta):
+    total_seconds = max(delta.total_seconds(), 0)
+    hours = int(total_seconds // 3600)
+    minutes = int((total_seconds % 3600) // 60)
+    return f"{hours} ч {minutes} мин" if hours > 0 else f"{minutes} мин"
+
+
+def render_card(incident_id, incident, status=None):
+    """Карточка статуса: исходный текст инцидента и блок статуса (status — для закрытых, со ссылкой на JIRA)."""
+    text = incident["text"]
+    if len(text) > CARD_TEXT_LIMIT:
+        text = text[:CARD_TEXT_LIMIT] + "…"
+    if status is None:
+        current = now()
+        status = (f"Статус: открыт, приоритет {incident.get('priority', 'средний')}\n"
+                  f"Прошло с выявления: {format_duration(current - incident['time'])} "
+                  f"(на {current.strftime('%H:%M')})")
+    else:
+        status += f"\nJIRA: {JIRA_URL}{incident_id}"
+    return f"{text}\n\n{status}"
+
+
+def update_cards(incident_id, destinations, status=None, event=None, key=None, edit_only=False):
+    """Отправляет или обновляет карточку инцидента в каждом из destinations."""
+    incident = incidents[incident_id]
+    if status is None:
+        arm_card_refresh(incident_id)
+    else:
+        timers.cancel(f"card:{incident_id}")
+    return broadcast(destinations, render_card(incident_id, incident, status), incident_id, event, key=key,
+                     kind="card", card=incident_id, edit_only=edit_only)
+
+
+def arm_card_refresh(incident_id):
+    """Ставит (переставляет) правку карточки через CARD_REFRESH_MINUTES после последней отрисовки.
+
+    Напоминания правят карточку только на шагах лестницы, а у средних и
+    низких приоритетов шагов нет — без этого прошедшее время застыло бы.
+    """
+    if CARD_REFRESH_MINUTES <= 0:
+        return
+    age = (now() - incidents[incident_id]["time"]).total_seconds()
+    interval = max(CARD_REFRESH_MINUTES * 60, age / CARD_REFRESH_AGE_SHARE)
+    timers.schedule(f"card:{incident_id}", timers.time_func() + interval, refresh_card, incident_id)
+
+
+async def refresh_card(incident_id):
+    incident = incidents.get(incident_id)
+    if incident:
+        update_cards(incident_id, [{"chat_id": incident["chat_id"]}] + BROADCAST_GROUPS, edit_only=True)
+
+
+def note_update(update_id, force=False):
+    """Запоминает последний обработанный update_id и время от времени сохраняет его."""
+    global last_update_id, offset_saved_at
+    if update_id is not None and (last_update_id is None or update_id > last_update_id):
+        last_update_id = update_id
+    current = time.monotonic()
+    if last_update_id is not None and (force or current - offset_saved_at >= OFFSET_SAVE_INTERVAL):
+        persist("meta", "set_meta", "last_update_id", last_update_id)
+        offset_saved_at = current
+
+
+def plan_reminders(incident_id, start_time, keep_fired=False):
+    """Пересчитывает индекс сроков инцидента (incident["reminders"]) по текущей политике.
+
+    keep_fired=True (перезагрузка политики, старые инциденты без индекса)
+    сохраняет отметки об отправке и не шлёт шаги, срок которых уже прошёл.
+    Иначе (новый инцидент, смена приоритета) опоздавшие шаги уходят сразу,
+    кроме опоздавших больше чем на misfire_grace.
+    """
+    incident = incidents[incident_id]
+    current = now()
+    old_steps = (incident.get("reminders") or {}).get("steps", {}) if keep_fired else {}
+    cutoff = current if keep_fired else current - datetime.timedelta(seconds=timers.misfire_grace)
+    steps = {}
+    for _, due, step in policy.plan(incident_id, start_time, incident.get("priority")):
+        fired = old_steps.get(step.id, {}).get("fired", False) or due <= cutoff
+        steps[step.id] = {"due": due, "fired": fired}
+    incident["reminders"] = {"start": start_time, "steps": steps} if steps else None
+
+
+def arm_reminders(app, incident_ids):
+    """Ставит таймеры на неотправленные шаги из индекса сроков; возвращает число таймеров.
+
+    Шаг, срок которого прошёл, пока бот не работал, ставится на «сейчас» и
+    уходит один раз: после отправки он отмечается в хранилище как fired.
+    """
+    current = now()
+    armed = 0
+    for incident_id in incident_ids:
+        timers.cancel_tag(incident_id)
+        incident = incidents[incident_id]
+        jobs = []
+        for step_id, step in ((incident.get("reminders") or {}).get("steps") or {}).items():
+            if not step["fired"]:
+                jobs.append(timers.schedule(f"{incident_id}_{step_id}", max(step["due"], current), notify,
+                                            app, incident_id, step_id, tag=incident_id))
+        incident["jobs"] = jobs
+        armed += len(jobs)
+    return armed
+
+
+def schedule_reminders(app, incident_id, start_time):
+    plan_reminders(incident_id, start_time)
+    arm_reminders(app, [incident_id])
+    jobs = incidents[incident_id]["jobs"]
+    if jobs:
+        logger.info(f"Поставлены напоминания для {incident_id}: {jobs}")
+    else:
+        logger.info(f"Приоритет инцидента {incident_id} не требует напоминаний.")
+    return jobs
+
+
+def restore_reminders(app):
+    """При старте ставит таймеры по сохранённому индексу сроков, ничего не пересчитывая."""
+    current = now()
+    for incident_id, incident in incidents.items():
+        # инциденты из старого incidents.json — без индекса, прошедшие шаги не шлём
+        if "reminders" not in incident:
+            plan_reminders(incident_id, incident["time"], keep_fired=True)
+            if incident["reminders"]:
+                save_incident("update", incident_id)
+    armed = arm_reminders(app, incidents)
+    for incident_id in incidents:
+        arm_card_refresh(incident_id)
+    misfired = sum(1 for incident in incidents.values()
+                   for step in ((incident.get("reminders") or {}).get("steps") or {}).values()
+                   if not step["fired"] and step["due"] <= current)
+    logger.info(f"Восстановлено {armed} напоминаний по {len(incidents)} инцидентам, "
+                f"из них пропущенных во время простоя: {misfired}")
+    return armed
+
+
+def reschedule_all(app):
+    """Перестраивает напоминания всех открытых инцидентов одной пачкой (после смены политики)."""
+    for incident_id, incident in incidents.items():
+        start_time = (incident.get("reminders") or {}).get("start") or incident["time"]
+        plan_reminders(incident_id, start_time, keep_fired=True)
+        save_incident("update", incident_id)
+    armed = arm_reminders(app, incidents)
+    logger.info(f"Напоминания пересобраны: {armed} таймеров по {len(incidents)} инцидентам. Пересылок не делалось.")
+    return armed
+
+
+async def notify(app, incident_id, step_id):
+    incident = incidents.get(incident_id)
+    if not incident or not incident.get("reminders"):
         return
+    await coalescer.add(incident["chat_id"], (incident_id, step_id))
+
 
-    message_time = update.message.date.astimezone(TZ)
-    if message_time < BOT_START_TIME:
-        logger.info(f"Пропускаем старое сообщение ({message_time}) — бот стартовал в {BOT_START_TIME}")
+def render_digest(reminders):
+    """Одно сообщение вместо нескольких напоминаний в чат: по строке на инцидент — прошедшее время и текст шага.
+
+    reminders — по одному (incident_id, incident, step, state) на инцидент.
+    """
+    current = now()
+    targets = []
+    lines = []
+    for incident_id, incident, step, _ in sorted(reminders, key=lambda r: r[1]["time"]):
+        targets.extend(t for t in step.targets if t not in targets)
+        name = extract_key(incident["text"]) or incident_id
+        lines.append(f"• {incident_id} «{name}» ({incident.get('priority', 'средний')}): "
+                     f"прошло {format_duration(current - incident['time'])}. "
+                     f"{step.render(incident_id, incident, targets=()).strip()}")
+    return (f"Напоминание по {len(reminders)} открытым инцидентам:\n" + "\n".join(lines)
+            + f"\nПроверьте статус. {', '.join(targets)}")
+
+
+def reminder_key(incident_id, step, state):
+    return f"reminder:{incident_id}:{step.id}:{state['due'].timestamp():.0f}"
+
+
+async def send_reminders(chat_id, items):
+    """Отправляет пачку напоминаний из coalescer: одно — как есть, несколько — дайджестом."""
+    reminders = []
+    for incident_id, step_id in items:
+        incident = incidents.get(incident_id)
+        if not incident or not incident.get("reminders"):
+            continue
+        step = policy.step(incident.get("priority"), step_id)
+        state = incident["reminders"]["steps"].get(step_id)
+        # пока пачка собиралась, инцидент могли закрыть или сменить ему приоритет
+        if step and state and not state["fired"]:
+            reminders.append((incident_id, incident, step, state))
+    if not reminders:
         return
+    # после простоя или для инцидента, выявленного давно, в пачке бывает несколько шагов одного инцидента:
+    # в сообщение он попадает один раз, с самым поздним из них
+    latest = {}
+    for reminder in reminders:
+        incident_id, _, step, _ = reminder
+        if incident_id not in latest or step.after > latest[incident_id][2].after:
+            latest[incident_id] = reminder
+    # после постановки в outbox напоминание считается отправленным: доставку с повторами берёт на себя очередь
+    if len(latest) == 1:
+        incident_id, incident, step, state = next(iter(latest.values()))
+        outbox.enqueue([{"chat_id": chat_id}], step.render(incident_id, incident), kind="reminder",
+                       incident_id=incident_id, key=reminder_key(incident_id, step, state))
+    else:
+        keys = [reminder_key(incident_id, step, state) for incident_id, _, step, state in reminders]
+        outbox.enqueue([{"chat_id": chat_id}], render_digest(list(latest.values())), kind="digest",
+                       key="digest:" + ",".join(keys))
+    for incident_id, incident, step, state in reminders:
+        state["fired"] = True
+        mark_fired(incident_id, step.id)
+    for incident_id, incident, _, _ in latest.values():
+        # новым сообщением — только сам пинг, в карточках просто обновляется прошедшее время
+        update_cards(incident_id, [{"chat_id": incident["chat_id"]}] + BROADCAST_GROUPS, edit_only=True)
+
+
+coalescer = None
+
+
+def open_outbox():
+    """Открывает outbox.db и склейку напоминаний. Резерв делает это только после захвата аренды:
+    при открытии outbox чистит старые строки, а база до этого момента принадлежит лидеру."""
+    global outbox, coalescer
+    outbox = Outbox(OUTBOX_DB, broadcaster, OUTBOX_WORKERS)
+    outbox.sent_observers.append(on_outbox_sent)
+    coalescer = ReminderCoalescer(timers, send_reminders, outbox.rate, DIGEST_MIN_WINDOW, DIGEST_MAX_WINDOW)
+
+
+def load_state():
+    """Открытые инциденты и статистика из хранилища. Пишет в хранилище только лидер, поэтому
+    резерв вызывает это после захвата аренды — до этого всё состояние ему не нужно."""
+    global incidents, analytics, message_index
+    incidents = store.load()
+    analytics = load_analytics()
+    message_index = index_messages(incidents)
+
+
+def build_runtime():
+    """Поднимает то, что бот держит открытым: логи, хранилище с потоком записи, outbox, политику
+    напоминаний, HTTP-транспорты и сервер метрик. Повторный вызов ничего не делает.
+
+    Таймеры при этом не запускаются — это делает on_startup в event loop бота. В горячем
+    резерве состояние и outbox открываются позже, в wait_for_leadership().
+    """
+    global log_listener, store, lease, writer, policy
+    global transports, metrics_server, BOT_START_TIME
+    if store is not None:
+        return
+    logger.setLevel(logging.INFO)
+    log_listener = setup_logging(logger, LOG_FILE, json_lines=LOG_FORMAT == "json", max_bytes=LOG_MAX_BYTES,
+                                 interval=LOG_ROTATE_HOURS * 3600, backups=LOG_BACKUPS, compress=LOG_COMPRESS)
+    BOT_START_TIME = datetime.datetime.now(tz=TZ)
+
+    store = open_store(STORAGE_BACKEND, INCIDENTS_FILE, INCIDENTS_DB)
+    lease = Lease(HA_LEASE_DB, HA_INSTANCE, HA_LEASE_TTL) if HA_LEASE_DB else None
+    writer = StoreWriter(store)
+    policy = load_policy(ESCALATION_CONFIG, ESCALATION_TIME_SCALE)
+
+    if not lease:
+        load_state()
+        open_outbox()
+
+    for name in ("HTTP_PROXY", "HTTPS_PROXY", "http_proxy", "https_proxy"):
+        os.environ.pop(name, None)
+    transports = (
+        PooledRequest("send", SEND_POOL_SIZE, SEND_KEEPALIVE, read_timeout=SEND_TIMEOUT, write_timeout=SEND_TIMEOUT,
+                      connect_timeout=SEND_CONNECT_TIMEOUT, pool_timeout=SEND_POOL_TIMEOUT, http2=SEND_HTTP2),
+        PooledRequest("updates", UPDATES_POOL_SIZE, UPDATES_KEEPALIVE, read_timeout=UPDATES_TIMEOUT,
+                      write_timeout=UPDATES_TIMEOUT, connect_timeout=UPDATES_CONNECT_TIMEOUT,
+                      pool_timeout=UPDATES_POOL_TIMEOUT, http2=UPDATES_HTTP2),
+    )
+    for transport in transports:
+        transport.wait_observers.append(lambda name, seconds, reused: POOL_WAIT_SECONDS.observe(seconds, name))
+    metrics_server = MetricsServer(registry, METRICS_LISTEN, METRICS_PORT) if METRICS_PORT else None
 
-    user_id = update.effective_user.id
-    if user_id not in ALLOWED_USERS:
-        logger.warning(f"Пользователь с ID {user_id} не авторизован.")
+
+async def reload_escalation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reload_escalation — перечитать escalation.json и пересобрать напоминания."""
+    if update.effective_user.id not in ALLOWED_USERS:
         return
+    global policy
+    try:
+        policy = load_policy(ESCALATION_CONFIG, ESCALATION_TIME_SCALE)
+    except (ValueError, OSError) as e:
+        logger.warning(f"Не удалось перечитать политику эскалации: {e}")
+        await update.effective_message.reply_text(f"Ошибка в {ESCALATION_CONFIG}: {e}")
+        return
+    armed = reschedule_all(context.application)
+    await update.effective_message.reply_text(f"Политика эскалации обновлена, напоминаний: {armed}")
+
 
-    if not update.message.text:
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/metrics — сводка метрик (полный набор — на METRICS_PORT для Prometheus)."""
+    if update.effective_user.id not in ALLOWED_USERS:
         return
+    await update.effective_message.reply_text(registry.summary()[:4000])
+
 
-    text = update.message.text
-    chat_id = update.effective_chat.id
-    reply_to = update.message.reply_to_message
-
-    resolution_words = ["заработал", "устранено", "устранен", "решено","решён", "локализован", "восстановлен", "включили в", "решен","устранен","устранён", "стабилизировалось"]
-    rejection_words = ["отклонен", "отклонён", "инцидент отклонен", "инцидент отклонён"]
-    priority_words = ["поднят до", "повышен до", "понижен до", "снижен до", "поднят на",
-                      "Приоритет инцидента поднят до", "Приоритет инцидента повышен до",
-                      "Приоритет инцидента понижен до", "Приоритет инцидента снижен до",
-                      "Приоритет инцидент понижен до", "Приоритет:"]
-    jira_pattern = re.compile(r'ITSMJIRA-\d+')
-
-    is_new_incident = "Инцидент:" in text and "Приоритет:" in text and bool(JIRA_PATTERN.search(text))
-    is_resolution_message = reply_to and any(word in text.lower() for word in resolution_words)
-    is_rejection_message = reply_to and any(word in text.lower() for word in rejection_words)
-    is_priority_update = any(word in text for word in priority_words)
-    is_jira_update = bool(jira_pattern.search(text))
-
-    if not (is_new_incident or is_resolution_message or is_rejection_message or is_jira_update or is_priority_update):
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/stats — MTTR по приоритетам, отметки эскалации, отклонённые и счётчики по дням."""
+    if update.effective_user.id not in ALLOWED_USERS:
         return
+    open_incidents = [(i.get("priority"), i["time"]) for i in incidents.values()]
+    await update.effective_message.reply_text(analytics.report(open_incidents, now())[:4000])
 
-    logger.info(f"Получено LIVE-сообщение: '{text}' в чате {chat_id} (в {message_time})")
 
-    if is_new_incident:
-        key = extract_key(text)
-        jira_key = JIRA_PATTERN.search(text)
-        if not jira_key:
-            logger.warning("Не удалось извлечь JIRA ID из инцидента.")
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    started = time.perf_counter()
+    kind = "ignored"
+    incident_id = None
+    try:
+        msg = update.effective_message
+        text = msg.text
+        chat_id = msg.chat_id
+        if not update.message:
             return
+        if processed.seen(update.update_id):
+            kind = "duplicate"
+            return
+        note_update(update.update_id)
 
-        incident_id = jira_key.group(0)
-        if incident_id in incidents:
-            logger.info(f"Инцидент '{incident_id}' уже существует. Вероятно, дублирующее сообщение — пропускаем.")
+        message_time = update.message.date.astimezone(TZ)
+        if message_time < BOT_START_TIME - CATCHUP_MAX_AGE:
+            kind = "dropped"
+            MESSAGES_DROPPED.inc("stale")
+            logger.info(f"Пропускаем старое сообщение ({message_time}) — бот стартовал в {BOT_START_TIME}")
             return
 
-        # Извлекаем время выявления из текста сообщения
-        detection_time = extract_detection_time(text, message_time)
-        priority = get_priority(text) or "средний"
-        incidents[incident_id] = {"text": text, "chat_id": chat_id, "time": detection_time, "jobs": [], "priority": priority}
-        logger.info(f"Обнаружен новый инцидент: {incident_id} с приоритетом {priority}, время выявления: {detection_time}")
+        user_id = update.effective_user.id
+        if user_id not in ALLOWED_USERS:
+            kind = "dropped"
+            MESSAGES_DROPPED.inc("unauthorized")
+            logger.warning(f"Пользователь с ID {user_id} не авторизован.")
+            return
 
-        for group in BROADCAST_GROUPS:
-            await safe_send(context.bot, group, text)
+        if not update.message.text:
+            return
 
-        if priority:
-            incidents[incident_id]["jobs"] = schedule_reminders(application, chat_id, incident_id, detection_time, priority)
-        save_incidents(incidents)
-        return
+        text = update.message.text
+        chat_id = update.effective_chat.id
+        reply_to = update.message.reply_to_message
 
-    if is_resolution_message:
-        replied_text = reply_to.text
-        incident_id = extract_jira_key(replied_text)
-        if not incident_id or incident_id not in incidents:
-            logger.warning("Не удалось найти связанный инцидент.")
+        parsed = parser.parse_message(text, message_time, is_reply=bool(reply_to))
+        kind = parsed.kind
+        if parsed.kind == parser.NOISE:
+            return
+        if catchup is not None and processed.seen(message_key(update.message)):
+            logger.info(f"Повтор сообщения {update.message.message_id} в чате {chat_id} — пропускаем")
+            kind = "duplicate"
             return
 
-        incident = incidents.get(incident_id)
-        if incident:
-            logger.info(f"Инцидент '{incident_id}' закрыт. Отменяю напоминания.")
-            for job_id in incident.get("jobs", []):
-                try:
-                    scheduler.remove_job(job_id)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить задание {job_id}: {e}")
-
-            resolution_time = extract_resolution_time(text, message_time)
-
-            # Подсчитываем время на решение
-            incident_start_time = incident["time"]
-            time_to_resolve = resolution_time - incident_start_time
-            total_seconds = max(time_to_resolve.total_seconds(), 0)
-            hours = int(total_seconds // 3600)
-            minutes = int((total_seconds % 3600) // 60)
-            time_str = f"{hours} ч {minutes} мин" if hours > 0 else f"{minutes} мин"
-
-            jira_link = f"\nJIRA: https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/{extract_jira_key(replied_text)}" if extract_jira_key(
-                replied_text) else ""
-
-            msg = (f"Инцидент '{incident_id}' решён.{jira_link}\n"
-                   f"Время решения: {resolution_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                   f"Время на устранение: {time_str}")
-
-            await safe_send(context.bot, {"chat_id": chat_id}, msg)
-            for group in BROADCAST_GROUPS:
-                await safe_send(context.bot, group, msg)
-
-            del incidents[incident_id]
-            save_incidents(incidents)
-        return
-
-    if is_rejection_message:
-        replied_text = reply_to.text
-        incident_id = extract_jira_key(replied_text)
-        if not incident_id or incident_id not in incidents:
-            logger.warning("Не удалось найти связанный инцидент.")
+        preview = text.split("\n", 1)[0][:LOG_TEXT_LIMIT]
+        logger.info(f"Получено сообщение ({kind}): '{preview}' в чате {chat_id} (в {message_time})",
+                    extra={"kind": kind, "chat_id": chat_id})
+
+        if parsed.kind == parser.NEW:
+            incident_id = parsed.jira_key
+            if incident_id in incidents:
+                logger.info(f"Инцидент '{incident_id}' уже существует. Вероятно, дублирующее сообщение — пропускаем.")
+                return
+
+            detection_time = parsed.detection_time
+            priority = parsed.priority or "средний"
+            incidents[incident_id] = {"text": text, "chat_id": chat_id, "time": detection_time, "jobs": [], "priority": priority}
+            logger.info(f"Обнаружен новый инцидент: {incident_id} с приоритетом {priority}, время выявления: {detection_time}",
+                        extra={"incident_id": incident_id, "kind": kind, "chat_id": chat_id})
+
+            schedule_reminders(application, incident_id, detection_time)
+            saving = save_incident("create", incident_id)
+            analytics.record_created(detection_time)
+            save_analytics()
+            remember_messages(incident_id, [msg])
+
+            update_cards(incident_id, BROADCAST_GROUPS, event="создан", key=f"update:{update.update_id}")
+            await saving
             return
 
-        incident = incidents.get(incident_id)
-        if incident:
-            logger.info(f"Инцидент '{incident_id}' отклонен. Отменяю напоминания.")
-            for job_id in incident.get("jobs", []):
-                try:
-                    scheduler.remove_job(job_id)
-                except Exception as e:
-                    logger.warning(f"Не удалось удалить задание {job_id}: {e}")
+        if parsed.kind == parser.RESOLUTION:
+            incident_id = find_incident(reply_to)
+            if not incident_id or incident_id not in incidents:
+                logger.warning("Не удалось найти связанный инцидент.")
+                return
 
-            incident_name = extract_key(incident["text"])
-            jira_link = f"\nJIRA: https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/{incident_id}"
+            incident = incidents.get(incident_id)
+            if incident:
+                logger.info(f"Инцидент '{incident_id}' закрыт. Отменяю напоминания.",
+                            extra={"incident_id": incident_id, "kind": kind, "chat_id": chat_id})
+                timers.cancel_tag(incident_id)
 
-            msg = f"Инцидент '{incident_name}' отклонен.{jira_link}\n{incident_id}"
+                resolution_time = parsed.event_time or message_time
 
-            await safe_send(context.bot, {"chat_id": chat_id}, msg)
-            for group in BROADCAST_GROUPS:
-                await safe_send(context.bot, group, msg)
+                # Подсчитываем время на решение
+                time_str = format_duration(resolution_time - incident["time"])
 
-            del incidents[incident_id]
-            save_incidents(incidents)
-        return
+                status = (f"Статус: решён {resolution_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+                          f"Время на устранение: {time_str}")
 
-    if is_priority_update:
-        if not reply_to:
-            logger.warning("Сообщение не является ответом на инцидент.")
+                update_cards(incident_id, [{"chat_id": chat_id}] + BROADCAST_GROUPS, status, f"решён за {time_str}",
+                             key=f"update:{update.update_id}")
+
+                saving = save_incident("resolve", incident_id, closed_at=resolution_time)
+                analytics.record_closed(incident.get("priority"), "resolved", incident["time"], resolution_time)
+                save_analytics()
+                forget_messages(incident_id)
+                del incidents[incident_id]
+                await saving
             return
 
-        incident_id = extract_jira_key(reply_to.text)
-        if not incident_id or incident_id not in incidents:
-            logger.warning("Не удалось найти связанный инцидент.")
+        if parsed.kind == parser.REJECTION:
+            incident_id = find_incident(reply_to)
+            if not incident_id or incident_id not in incidents:
+                logger.warning("Не удалось найти связанный инцидент.")
+                return
+
+            incident = incidents.get(incident_id)
+            if incident:
+                logger.info(f"Инцидент '{incident_id}' отклонен. Отменяю напоминания.",
+                            extra={"incident_id": incident_id, "kind": kind, "chat_id": chat_id})
+                timers.cancel_tag(incident_id)
+
+                update_cards(incident_id, [{"chat_id": chat_id}] + BROADCAST_GROUPS,
+                             f"Статус: отклонён {message_time.strftime('%Y-%m-%d %H:%M:%S')}", "отклонён",
+                             key=f"update:{update.update_id}")
+
+                saving = save_incident("reject", incident_id, closed_at=message_time)
+                analytics.record_closed(incident.get("priority"), "rejected", incident["time"], message_time)
+                save_analytics()
+                forget_messages(incident_id)
+                del incidents[incident_id]
+                await saving
             return
 
-        incident = incidents[incident_id]
-        priority = get_priority(text)
+        if parsed.kind == parser.PRIORITY:
+            if not reply_to:
+                logger.warning("Сообщение не является ответом на инцидент.")
+                return
 
-        if not priority:
-            logger.warning(f"Не удалось определить приоритет из сообщения.")
-            return
+            incident_id = find_incident(reply_to)
+            if not incident_id or incident_id not in incidents:
+                logger.warning("Не удалось найти связанный инцидент.")
+                return
 
-        incident_name = extract_key(incident["text"])
-        old_priority = incident.get("priority", "средний")
-
-        # Определяем тип изменения: повышение или понижение
-        if "поднят" in text or "повышен" in text:
-            action = "повышен"
-        elif "понижен" in text or "снижен" in text:
-            action = "понижен"
-        else:
-            action = "изменён"
-
-        logger.info(f"Приоритет инцидента '{incident_id}' {action} с {old_priority} до {priority}.")
-
-        # Рассылка по группам — при любом изменении приоритета
-        msg = f"Приоритет инцидента '{incident_name}' {action} до {priority}.\n{incident_id}"
-        await safe_send(context.bot, {"chat_id": chat_id}, msg)
-        for group in BROADCAST_GROUPS:
-            await safe_send(context.bot, group, msg)
-
-        # Удаляем старые напоминания в любом случае
-        for job_id in incident.get("jobs", []):
-            try:
-                scheduler.remove_job(job_id)
-            except Exception as e:
-                logger.warning(f"Не удалось удалить задание {job_id}: {e}")
-        incident["jobs"] = []
-
-        # Напоминания — только для высокий/критичный
-        if priority in ["высокий", "критичный"]:
-            start_time_text = extract_time_from_text(text, message_time)
-
-            if start_time_text:
-                start_time = start_time_text
+            incident = incidents[incident_id]
+            priority = parsed.priority
+
+            if not priority:
+                logger.warning(f"Не удалось определить приоритет из сообщения.")
+                return
+
+            old_priority = incident.get("priority", "средний")
+
+            action = parsed.action
+
+            logger.info(f"Приоритет инцидента '{incident_id}' {action} с {old_priority} до {priority}.",
+                        extra={"incident_id": incident_id, "kind": kind, "chat_id": chat_id})
+
+            # Карточки по группам обновляются при любом изменении приоритета
+            incident["priority"] = priority
+            update_cards(incident_id, [{"chat_id": chat_id}] + BROADCAST_GROUPS,
+                         event=f"приоритет {action} до {priority}", key=f"update:{update.update_id}")
+
+            # Напоминания — по лестнице нового приоритета (для средних/низких просто снимаются)
+            if parsed.event_time:
+                start_time = parsed.event_time
             elif incident.get("time"):
                 start_time = incident["time"]
             else:
-                start_time = datetime.datetime.now(tz=TZ)
+                start_time = now()
                 incident["time"] = start_time
+            schedule_reminders(application, incident_id, start_time)
 
-            incident["jobs"] = schedule_reminders(application, chat_id, incident_id, start_time, priority)
+            saving = save_incident("update", incident_id)
+            remember_messages(incident_id, [update.message])
+            await saving
 
-        incident["priority"] = priority
-        save_incidents(incidents)
+            return
 
+        if parsed.kind == parser.JIRA_UPDATE and parsed.jira_key in incidents:
+            # обсуждение инцидента: ответ на это сообщение тоже должен находить инцидент
+            remember_messages(parsed.jira_key, [update.message])
+            return
+    finally:
+        elapsed = time.perf_counter() - started
+        HANDLE_SECONDS.observe(elapsed, kind)
+        if incident_id is not None:
+            logger.info(f"Сообщение ({kind}) по {incident_id} обработано за {elapsed * 1000:.1f} мс",
+                        extra={"incident_id": incident_id, "kind": kind, "chat_id": chat_id,
+                               "latency_ms": round(elapsed * 1000, 3)})
+
+
+async def catch_up(app):
+    """Догоняет обновления с сохранённого last_update_id; рассылки — одной сводкой в конце."""
+    global catchup
+    saved = store.get_meta("last_update_id")
+    if BOT_MODE == "webhook":
+        # пока webhook установлен, getUpdates недоступен; serve_webhook поставит его заново
+        await app.bot.delete_webhook()
+    catchup = CatchUp()
+    started = time.monotonic()
+    try:
+        total, last = await drain(app.bot, app.process_update, int(saved) + 1 if saved else None,
+                                  on_batch=lambda last: note_update(last, force=True))
+    finally:
+        report, catchup = catchup, None
+    if not total:
         return
+    for incident_id, destinations, _, key in report.new_open(incidents):
+        # карточка — по состоянию на конец догона, а не на момент создания
+        update_cards(incident_id, destinations, key=key)
+    for incident_id, destinations, text in report.last_states(incidents):
+        # уже разосланные карточки молча правятся до итогового состояния
+        broadcast(destinations, text, incident_id, kind="card", card=incident_id, edit_only=True)
+    summary = report.summary(incidents, total)
+    if summary:
+        broadcast(list(report.destinations.values()), summary, key=f"catchup:{last}", kind="summary")
+    logger.info(f"Догон завершён: {total} обновлений, {len(report.incidents)} инцидентов затронуто, "
+                f"{(time.monotonic() - started) * 1000:.0f} мс")
+
+
+def wait_for_leadership():
+    """Держит экземпляр в резерве, пока аренда у другого; возвращается, когда он стал лидером."""
+    holder = lease.holder_info()
+    logger.info(f"Экземпляр {HA_INSTANCE}: жду аренду {HA_LEASE_DB} (сейчас у {holder[0] if holder else 'никого'})")
+    lease.wait()
+    # состояние читается один раз, уже после захвата: отметки об отправленных напоминаниях, статистика, очередь
+    load_state()
+    open_outbox()
+    logger.info(f"Экземпляр {HA_INSTANCE} стал лидером: {len(incidents)} открытых инцидентов, "
+                f"{len(outbox)} сообщений в очереди")
+
+
+async def on_lease_lost():
+    """Аренду забрал другой экземпляр: больше ничего не шлём и не пишем, завершаемся."""
+    global lease_lost
+    lease_lost = True
+    await timers.stop()
+    await outbox.stop(timeout=0)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
+async def on_startup(app):
+    global lease_task
+    if lease:
+        lease_task = asyncio.create_task(lease.hold(on_lease_lost))
+    outbox.start(app.bot)
+    if CATCHUP:
+        await catch_up(app)
+    timers.start()
+    if metrics_server:
+        await metrics_server.start()
+
+
+async def on_shutdown(app):
+    if lease_task and not lease_task.done():
+        lease_task.cancel()
+    if metrics_server:
+        await metrics_server.stop()
+    if lease_lost:
+        # несобранные дайджесты не отмечены как отправленные — их пошлёт новый лидер
+        return
+    note_update(None, force=True)
+    await timers.stop()
+    await coalescer.flush_all()
+    await outbox.stop()
+    await writer.drain()
+    if lease:
+        lease.release()
+    lag = timers.lag
+    if lag["count"]:
+        logger.info(f"Задержка планировщика: средняя {lag['total'] / lag['count'] * 1000:.1f} мс, "
+                    f"максимальная {lag['max'] * 1000:.1f} мс ({lag['count']} срабатываний)")
+
+
+def create_application(token=None):
+    """Собирает бота: build_runtime(), PTB Application с нашими транспортами и обработчиками."""
+    global application
+    build_runtime()
+    send_request, updates_request = transports
+    builder = (ApplicationBuilder().token(token or os.getenv("tg")).base_url(TG_API_URL)
+               .request(send_request).get_updates_request(updates_request)
+               .concurrent_updates(update_processor).post_init(on_startup).post_shutdown(on_shutdown))
+    if BOT_MODE == "webhook":
+        # обновления приходят в наш сервер, getUpdates не нужен
+        builder = builder.updater(None)
+    application = builder.build()
+    application.add_handler(CommandHandler("reload_escalation", reload_escalation))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
+    return application
+
 
 if __name__ == '__main__':
-    application = ApplicationBuilder().token(os.getenv("tg")).proxy(None).build()
-    restore_jobs(incidents)
-    application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message))
-    logger.info(f"Запускаем бота... START={BOT_START_TIME}")
-    application.run_polling()
+    application = create_application()
+    if lease:
+        wait_for_leadership()
+    restore_reminders(application)
+    logger.info(f"Запускаем бота ({BOT_MODE})... START={BOT_START_TIME}")
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL or not WEBHOOK_SECRET:
+            raise SystemExit("Для BOT_MODE=webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+        from incbot.webhook import run_webhook
+        run_webhook(application, WEBHOOK_URL, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                    secret_token=WEBHOOK_SECRET, queue_size=WEBHOOK_QUEUE_SIZE, workers=CONCURRENT_UPDATES)
+    else:
+        application.run_polling()
+    writer.close()
+    store.close()
+    outbox.close()
+    if lease:
+        lease.close()
+    log_listener.stop()
@@ -0,0 +1,126 @@
+"""Микробенчмарк разбора сообщений: incbot.parser против старых поисков в handle_message.
+
+Запуск из корня репозитория:
+    python bench/bench_parser.py [--corpus bench/data/messages.jsonl] [--repeat 2000]
+
+Перед замером проверяет, что на корпусе новый разбор даёт те же вид
+сообщения, JIRA-ключ, название и приоритет, что и прежняя логика.
+"""
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import time
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from incbot import parser  # noqa: E402
+
+TZ = ZoneInfo("Asia/Bishkek")
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "messages.jsonl")
+
+
+# --- прежняя логика handle_message, как она была до incbot.parser ---
+
+def legacy_extract_key(text):
+    match = re.search(r'Инцидент:\s*(.+?)(\n|$)', text)
+    return match.group(1).strip() if match else None
+
+
+def legacy_get_priority(text):
+    priority_words = {"высокий": "высокий", "критичный": "критичный", "средний": "средний", "низкий": "низкий"}
+    for word, priority in priority_words.items():
+        if word in text.lower():
+            return priority
+    match = re.search(r'(?:Приоритет[:\s]\s*|до\s+)(\d+)', text)
+    if match:
+        return parser.PRIORITY_NUMBERS.get(match.group(1))
+    return None
+
+
+def legacy_classify(text, is_reply):
+    resolution_words = ["заработал", "устранено", "устранен", "решено", "решён", "локализован", "восстановлен",
+                        "включили в", "решен", "устранен", "устранён", "стабилизировалось"]
+    rejection_words = ["отклонен", "отклонён", "инцидент отклонен", "инцидент отклонён"]
+    priority_words = ["поднят до", "повышен до", "понижен до", "снижен до", "поднят на",
+                      "Приоритет инцидента поднят до", "Приоритет инцидента повышен до",
+                      "Приоритет инцидента понижен до", "Приоритет инцидента снижен до",
+                      "Приоритет инцидент понижен до", "Приоритет:"]
+    jira_pattern = re.compile(r'ITSMJIRA-\d+')
+    is_new = "Инцидент:" in text and "Приоритет:" in text and bool(jira_pattern.search(text))
+    if is_new:
+        # время выявления: сначала полный формат, потом только ЧЧ:ММ
+        re.search(r'Время выявления:\s*(\d{2}\.\d{2}\.\d{4})\s+(\d{1,2}:\d{2})', text) or \
+            re.search(r'Время выявления:\s*(\d{1,2}:\d{2})', text)
+        return parser.NEW, jira_pattern.search(text).group(0), legacy_extract_key(text), legacy_get_priority(text)
+    if is_reply and any(word in text.lower() for word in resolution_words):
+        # extract_resolution_time
+        re.search(r'\b(?:в\s*)?(\d{1,2}:\d{2})\b', text)
+        return parser.RESOLUTION, None, None, None
+    if is_reply and any(word in text.lower() for word in rejection_words):
+        return parser.REJECTION, None, None, None
+    if any(word in text for word in priority_words):
+        # extract_time_from_text
+        re.search(r'\b(?:в\s*)?(\d{1,2}:\d{2})\b', text)
+        return parser.PRIORITY, None, None, legacy_get_priority(text)
+    if jira_pattern.search(text):
+        return parser.JIRA_UPDATE, None, None, None
+    return parser.NOISE, None, None, None
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def check_parity(corpus, now):
+    mismatches = 0
+    for item in corpus:
+        expected = legacy_classify(item["text"], item["reply"])
+        got = parser.parse_message(item["text"], now, item["reply"])
+        actual = (got.kind,
+                  got.jira_key if got.kind == parser.NEW else None,
+                  got.incident_name if got.kind == parser.NEW else None,
+                  got.priority if got.kind in (parser.NEW, parser.PRIORITY) else None)
+        if actual != expected:
+            mismatches += 1
+            print(f"РАСХОЖДЕНИЕ: {item['text'][:60]!r}\n  было:  {expected}\n  стало: {actual}")
+    return mismatches
+
+
+def time_per_message(fn, items, repeat):
+    started = time.perf_counter_ns()
+    for _ in range(repeat):
+        for item in items:
+            fn(item)
+    return (time.perf_counter_ns() - started) / (repeat * len(items))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--corpus", default=DEFAULT_CORPUS)
+    ap.add_argument("--repeat", type=int, default=2000)
+    args = ap.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    now = datetime.datetime.now(tz=TZ)
+    if check_parity(corpus, now):
+        sys.exit(1)
+
+    by_kind = {}
+    for item in corpus:
+        by_kind.setdefault(parser.parse_message(item["text"], now, item["reply"]).kind, []).append(item)
+
+    print(f"Корпус: {len(corpus)} сообщений, повторов: {args.repeat}")
+    print(f"{'вид':<12} {'шт':>4} {'было, мкс':>10} {'стало, мкс':>11} {'ускорение':>10}")
+    for kind, items in sorted(by_kind.items()):
+        old = time_per_message(lambda m: legacy_classify(m["text"], m["reply"]), items, args.repeat)
+        new = time_per_message(lambda m: parser.parse_message(m["text"], now, m["reply"]), items, args.repeat)
+        print(f"{kind:<12} {len(items):>4} {old / 1000:>10.2f} {new / 1000:>11.2f} {old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Замер времени импорта и холодного старта.
+
+Каждый замер — в новом процессе интерпретатора (--runs раз, отчёт — минимум
+и медиана), в пустом временном каталоге:
+- import incbot.parser — то, что платит инструмент, которому нужен только разбор;
+- import Incident — настройки и обработчики; заодно проверяется, что импорт
+  не создал ни одного файла и не запустил ни одного потока;
+- Incident.build_runtime() — логи, хранилище, outbox, политика, HTTP-клиенты;
+- python -m incbot.batch по корпусу bench/data/messages.jsonl — весь процесс;
+- холодный старт бота: от запуска Incident.py до первого getUpdates к
+  заглушке bench/fakeapi.py.
+
+Запуск из корня репозитория:
+    python bench/coldstart.py [--runs 5] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(ROOT, "bench", "data", "messages.jsonl")
+
+# печатает время в мс, новые файлы в текущем каталоге и число потоков после шага
+PROBE = """
+import os, sys, threading, time
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+{code}
+elapsed = (time.perf_counter() - started) * 1000
+print(elapsed, len(os.listdir(".")), threading.active_count())
+"""
+
+STEPS = {
+    "import_parser": "import incbot.parser",
+    "import_incident": "import Incident",
+    "build_runtime": "import Incident\nIncident.build_runtime()",
+}
+
+
+def probe(code, workdir):
+    env = dict(os.environ, LOG_DIR=workdir, STORAGE_BACKEND="sqlite")
+    out = subprocess.run([sys.executable, "-c", PROBE.format(root=ROOT, code=code)], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[-3]), int(out[-2]), int(out[-1])
+
+
+def batch_run(workdir):
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "incbot.batch", CORPUS], cwd=workdir, check=True,
+                   env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+async def bot_start(workdir):
+    sys.path.insert(0, os.path.join(ROOT, "bench"))
+    from fakeapi import FakeTelegram
+    from load import free_port, spawn_bot
+
+    server = FakeTelegram()
+    port = free_port()
+    await server.start("127.0.0.1", port)
+    started = time.perf_counter()
+    bot = spawn_bot(workdir, port, SimpleNamespace(mode="polling", rate_limit=0))
+    try:
+        while not server.ready.is_set():
+            if bot.poll() is not None:
+                raise SystemExit("Бот завершился при запуске, см. bot.out")
+            await asyncio.sleep(0.005)
+        return (time.perf_counter() - started) * 1000
+    finally:
+        bot.terminate()
+        await asyncio.to_thread(bot.wait, 30)
+        await server.stop()
+
+
+def summary(values):
+    return {"min_ms": round(min(values), 1), "median_ms": round(statistics.median(values), 1)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = ap.parse_args()
+
+    report = {}
+    side_effects = {}
+    for step, code in STEPS.items():
+        times = []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory(prefix="incbot-coldstart-") as workdir:
+                elapsed, files, threads = probe(code, workdir)
+            times.append(elapsed)
+            side_effects[step] = {"files": files, "threads": threads}
+        report[step] = summary(times)
+    times = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="incbot-coldstart-") as workdir:
+            times.append(batch_run(workdir))
+    report["batch_cli"] = summary(times)
+    times = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix="incbot-coldstart-") as workdir:
+            times.append(asyncio.run(bot_start(workdir)))
+    report["bot_first_poll"] = summary(times)
+    report["side_effects"] = side_effects
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    titles = {"import_parser": "import incbot.parser", "import_incident": "import Incident",
+              "build_runtime": "import Incident + build_runtime()", "batch_cli": "python -m incbot.batch (процесс)",
+              "bot_first_poll": "Incident.py до первого getUpdates"}
+    for step, title in titles.items():
+        print(f"{title:<36} мин {report[step]['min_ms']:>7} мс, медиана {report[step]['median_ms']:>7} мс")
+    for step, effects in side_effects.items():
+        print(f"  после {titles[step]}: файлов {effects['files']}, потоков {effects['threads']}")
+
+
+if __name__ == "__main__":
+    main()
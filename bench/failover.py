@@ -0,0 +1,210 @@
+"""Замер переключения на горячий резерв: лидера убивают SIGKILL.
+
+Запускает два экземпляра Incident.py с общим каталогом хранилища и общим
+HA_LEASE_DB. Вместо Telegram у них FakeBot, который печатает отправки в
+stdout. В хранилище заранее лежит критичный инцидент: напоминание «50 минут»
+по нему уже ушло (отмечено fired), «60 минут» наступает через несколько
+секунд после убийства лидера. Сценарий:
+
+1. стартует A и становится лидером;
+2. стартует B и ждёт в резерве, подтягивая состояние;
+3. A получает SIGKILL;
+4. замеряется, через сколько B берёт аренду (время переключения), и
+   проверяется, что B отправил «60 минут» ровно один раз, а «50 минут» не
+   повторил.
+
+Запуск из корня репозитория:
+    python bench/failover.py [--runs 3] [--ttl 3]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import queue
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+INCIDENT_CHAT = -1002054350266
+INCIDENT_ID = "ITSMJIRA-40000"
+REMINDER_DELAY = 12.0  # через сколько секунд после старта сценария наступает шаг «60 минут»
+
+
+class PrintingBot:
+    """FakeBot экземпляра: каждая отправка — строка SENT в stdout."""
+
+    def __init__(self):
+        self._message_id = 10 ** 9
+
+    async def send_message(self, chat_id, text, message_thread_id=None, **kwargs):
+        self._message_id += 1
+        print(f"SENT {time.time():.3f} {chat_id} {text.splitlines()[0]}", flush=True)
+        return _Message(self._message_id, chat_id)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return _Message(message_id, chat_id)
+
+
+class _Message:
+    def __init__(self, message_id, chat_id):
+        self.message_id = message_id
+        self.chat_id = chat_id
+
+
+class _Application:
+    def __init__(self, bot):
+        self.bot = bot
+
+
+def run_instance(workdir):
+    """Роль экземпляра: резерв до получения аренды, потом — лидер до SIGKILL/SIGTERM."""
+    os.chdir(workdir)
+    import Incident
+
+    Incident.build_runtime()
+    print(f"STANDBY {time.time():.3f}", flush=True)
+    Incident.wait_for_leadership()
+    print(f"LEADER {time.time():.3f}", flush=True)
+
+    async def lead():
+        app = _Application(PrintingBot())
+        Incident.restore_reminders(app)
+        await Incident.on_startup(app)
+        stop = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+        await stop.wait()
+        await Incident.on_shutdown(app)
+
+    asyncio.run(lead())
+
+
+def seed(workdir):
+    """Открытый критичный инцидент: шаг «50» уже отправлен, «60» — через REMINDER_DELAY секунд."""
+    from incbot.storage import SqliteStore
+
+    tz = datetime.timezone(datetime.timedelta(hours=6))
+    now = datetime.datetime.now(tz)
+    detected = now - datetime.timedelta(minutes=60) + datetime.timedelta(seconds=REMINDER_DELAY)
+    steps = {step: {"due": detected + after, "fired": step == "50"}
+             for step, after in (("50", datetime.timedelta(minutes=50)), ("60", datetime.timedelta(minutes=60)),
+                                 ("3h", datetime.timedelta(hours=3)))}
+    incident = {"text": f"Инцидент: Недоступен интернет-банкинг\nПриоритет: 1\n{INCIDENT_ID}",
+                "chat_id": INCIDENT_CHAT, "time": detected, "jobs": [], "priority": "критичный",
+                "reminders": {"start": detected, "steps": steps}}
+    store = SqliteStore(os.path.join(workdir, "incidents.db"))
+    store.append("create", INCIDENT_ID, incident)
+    store.close()
+
+
+def spawn(workdir, name, ttl):
+    env = dict(os.environ, HA_LEASE_DB=os.path.join(workdir, "leader.db"), HA_LEASE_TTL=str(ttl),
+               HA_INSTANCE=name, LOG_DIR=workdir, STORAGE_BACKEND="sqlite", CATCHUP="0", METRICS_PORT="0",
+               DIGEST_MIN_WINDOW="0.5", PYTHONUNBUFFERED="1")
+    with open(os.path.join(workdir, f"{name}.stderr"), "wb") as stderr:
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--role", "instance",
+                                    "--workdir", workdir], env=env, stdout=subprocess.PIPE, stderr=stderr,
+                                   text=True)
+    lines = queue.Queue()
+
+    def pump():
+        for line in process.stdout:
+            lines.put(line.split())
+        lines.put(None)
+
+    threading.Thread(target=pump, daemon=True).start()
+    return process, lines
+
+
+def expect(lines, tag, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            line = lines.get(timeout=max(deadline - time.time(), 0.01))
+        except queue.Empty:
+            raise SystemExit(f"Не дождались {tag} за {timeout} с")
+        if line is None:
+            raise SystemExit(f"Экземпляр завершился, не выдав {tag}")
+        if line and line[0] == tag:
+            return float(line[1])
+
+
+def collect(lines, seconds):
+    sent = []
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        try:
+            line = lines.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if line is None:
+            break
+        if line and line[0] == "SENT":
+            sent.append(" ".join(line[3:]))
+    return sent
+
+
+def run_once(ttl):
+    with tempfile.TemporaryDirectory(prefix="incbot-failover-") as workdir:
+        seed(workdir)
+        started = time.time()
+        a, a_lines = spawn(workdir, "A", ttl)
+        b = None
+        try:
+            expect(a_lines, "LEADER", 30)
+            b, b_lines = spawn(workdir, "B", ttl)
+            expect(b_lines, "STANDBY", 30)
+            time.sleep(2)  # резерв успевает подтянуть состояние
+            killed = time.time()
+            a.kill()
+            a.wait()
+            took_over = expect(b_lines, "LEADER", ttl * 3 + 10)
+            remaining = started + REMINDER_DELAY - time.time()
+            sent = collect(b_lines, max(remaining, 0) + 5)
+        finally:
+            for process in (a, b):
+                if process and process.poll() is None:
+                    process.terminate()
+                    process.wait(10)
+    return {"failover_s": round(took_over - killed, 3),
+            "reminders_60": sum("60 минут" in text for text in sent),
+            "reminders_50": sum("50 минут" in text for text in sent)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--role", choices=("driver", "instance"), default="driver")
+    ap.add_argument("--workdir")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--ttl", type=float, default=3.0, help="HA_LEASE_TTL экземпляров, секунд")
+    ap.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = ap.parse_args()
+    if args.role == "instance":
+        run_instance(args.workdir)
+        return
+
+    runs = [run_once(args.ttl) for _ in range(args.runs)]
+    failovers = [run["failover_s"] for run in runs]
+    report = {"ttl_s": args.ttl, "runs": runs, "failover_min_s": min(failovers),
+              "failover_mean_s": round(statistics.mean(failovers), 3), "failover_max_s": max(failovers),
+              "ok": all(run["reminders_60"] == 1 and run["reminders_50"] == 0 for run in runs)}
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    for i, run in enumerate(runs, 1):
+        print(f"Прогон {i}: переключение {run['failover_s']} с, напоминаний «60 минут»: {run['reminders_60']}, "
+              f"повторов «50 минут»: {run['reminders_50']}")
+    print(f"Переключение при HA_LEASE_TTL={args.ttl} с: мин {report['failover_min_s']} с, "
+          f"среднее {report['failover_mean_s']} с, макс {report['failover_max_s']} с")
+    print("Напоминания без повторов и потерь" if report["ok"] else "ОШИБКА: напоминания повторились или потерялись")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных прогонов.
+
+Отвечает на методы, которыми пользуется бот: getMe, getUpdates (long
+polling с offset/limit/timeout), sendMessage, editMessageText, setWebhook,
+deleteWebhook, getWebhookInfo. Пока webhook установлен, getUpdates отвечает
+409, как настоящий Telegram, а обновления доставляются POST-запросами на
+адрес webhook с заголовком X-Telegram-Bot-Api-Secret-Token (до
+max_connections одновременно, неудачные — повторно через секунду).
+
+Сбои, которые впрыскиваются в отправки и правки:
+- latency ± jitter — задержка каждого ответа;
+- retry_after_rate — доля запросов, получающих 429 с retry_after секунд
+  (RetryAfter в PTB);
+- migrate — чаты, которые «переезжают» в супергруппу при первой отправке:
+  этот и все следующие запросы в старый chat_id получают 400 с
+  migrate_to_chat_id (ChatMigrated в PTB).
+
+Синтетический поток (Traffic) — сообщения в формате, который разбирает
+handle_message: «Инцидент: … / Приоритет: … / ITSMJIRA-…» и ответы на них о
+решении, плюс болтовня в чате.
+
+Отдельно (бот запускается вручную с TG_API_URL=http://127.0.0.1:8081/bot):
+    python bench/fakeapi.py [--port 8081] [--incidents 100] [--rate 5] [--latency 50]
+Нагрузочный прогон с замером задержек — bench/load.py.
+"""
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import random
+import time
+
+import aiohttp
+from aiohttp import web
+
+from replay import ALLOWED_USER, CHATTER, INCIDENT_CHAT, NAMES, RESOLUTIONS
+
+TZ = datetime.timezone(datetime.timedelta(hours=6))
+INT_PARAMS = ("chat_id", "message_id", "message_thread_id", "offset", "limit", "timeout", "max_connections")
+WEBHOOK_MAX_CONNECTIONS = 40
+WEBHOOK_RETRY = 1.0  # секунд до повторной доставки после ошибки
+MIGRATION_OFFSET = 10 ** 9  # новый chat_id переехавшей группы = старый - MIGRATION_OFFSET
+
+
+def _params(raw):
+    """Параметры PTB приходят формой: вложенные объекты — строками JSON, числа — строками."""
+    params = {}
+    for key, value in raw.items():
+        if key in INT_PARAMS:
+            params[key] = int(value)
+        elif isinstance(value, str) and value[:1] in "[{" and key != "text":
+            params[key] = json.loads(value)
+        else:
+            params[key] = value
+    return params
+
+
+def _error(code, description, **parameters):
+    body = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        body["parameters"] = parameters
+    return web.json_response(body, status=code)
+
+
+class FakeTelegram:
+    def __init__(self, latency=0.0, jitter=0.0, retry_after_rate=0.0, retry_after=1, migrate=(), seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.to_migrate = set(migrate)
+        self.migrated = {}  # старый chat_id -> новый
+        self.pending = collections.deque()  # неподтверждённые обновления (getUpdates)
+        self.next_update_id = 1
+        self.last_message_id = {}  # chat_id -> последний message_id
+        self.texts = {}  # (chat_id, message_id) -> текст сообщения
+        self.webhook = None  # {"url", "secret", "max_connections"}
+        self.stats = collections.Counter()
+        # вызываются как observer(method, chat_id, message_id, text, at) после успешной отправки или правки
+        self.observers = []
+        self.ready = asyncio.Event()  # бот начал забирать обновления
+        self._arrived = asyncio.Event()
+        self._webhook_queue = asyncio.Queue()
+        self._webhook_tasks = []
+        self._session = None
+        self._runner = None
+
+    # --- обновления ---
+
+    def _message(self, chat_id, text, user_id=ALLOWED_USER, reply_to=None):
+        message_id = self.last_message_id.get(chat_id, 0) + 1
+        self.last_message_id[chat_id] = message_id
+        self.texts[(chat_id, message_id)] = text
+        message = {"message_id": message_id, "date": int(time.time()), "text": text,
+                   "chat": {"id": chat_id, "type": "supergroup"},
+                   "from": {"id": user_id, "is_bot": False, "first_name": "Load"}}
+        if reply_to:
+            message["reply_to_message"] = reply_to
+        return message
+
+    def push(self, text, chat_id=INCIDENT_CHAT, user_id=ALLOWED_USER, reply_to=None):
+        """Кладёт сообщение пользователя в очередь обновлений; возвращает message-dict."""
+        message = self._message(chat_id, text, user_id, reply_to)
+        update = {"update_id": self.next_update_id, "message": message}
+        self.next_update_id += 1
+        self.stats["updates"] += 1
+        if self.webhook:
+            self._webhook_queue.put_nowait(update)
+        else:
+            self.pending.append(update)
+            self._arrived.set()
+        return message
+
+    async def _get_updates(self, params):
+        if self.webhook:
+            return _error(409, "Conflict: can't use getUpdates method while webhook is active; "
+                               "use deleteWebhook to delete the webhook first")
+        offset = params.get("offset")
+        while offset and self.pending and self.pending[0]["update_id"] < offset:
+            self.pending.popleft()
+        self.ready.set()
+        if not self.pending and params.get("timeout"):
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), params["timeout"])
+            except asyncio.TimeoutError:
+                pass
+        updates = list(self.pending)[:params.get("limit", 100)]
+        self.stats["updates_polled"] += len(updates)
+        return web.json_response({"ok": True, "result": updates})
+
+    async def _deliver(self):
+        while True:
+            update = await self._webhook_queue.get()
+            webhook = self.webhook
+            if webhook is None:
+                # webhook сняли — обновление снова ждёт getUpdates
+                self.pending.append(update)
+                self._arrived.set()
+                continue
+            try:
+                async with self._session.post(webhook["url"], json=update, headers={
+                        "X-Telegram-Bot-Api-Secret-Token": webhook["secret"] or ""}) as response:
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+            if ok:
+                self.stats["updates_delivered"] += 1
+                continue
+            self.stats["webhook_errors"] += 1
+            await asyncio.sleep(WEBHOOK_RETRY)
+            self._webhook_queue.put_nowait(update)
+
+    def _set_webhook(self, params):
+        if params.get("drop_pending_updates") in (True, "true", "True"):
+            self.pending.clear()
+        self.webhook = {"url": params["url"], "secret": params.get("secret_token"),
+                        "max_connections": params.get("max_connections", WEBHOOK_MAX_CONNECTIONS)}
+        # накопленное до установки webhook уходит туда же, по порядку
+        while self.pending:
+            self._webhook_queue.put_nowait(self.pending.popleft())
+        for task in self._webhook_tasks:
+            task.cancel()
+        self._webhook_tasks = [asyncio.create_task(self._deliver())
+                               for _ in range(self.webhook["max_connections"])]
+        self.ready.set()
+
+    def _delete_webhook(self, params):
+        self.webhook = None
+        for task in self._webhook_tasks:
+            task.cancel()
+        self._webhook_tasks = []
+        while not self._webhook_queue.empty():
+            self.pending.append(self._webhook_queue.get_nowait())
+        if params.get("drop_pending_updates") in (True, "true", "True"):
+            self.pending.clear()
+
+    # --- отправки ---
+
+    async def _inject(self, chat_id):
+        """Задержка и сбои перед отправкой; возвращает ответ с ошибкой или None."""
+        delay = self.latency + self.rnd.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if chat_id in self.to_migrate or chat_id in self.migrated:
+            new_chat_id = self.migrated.setdefault(chat_id, chat_id - MIGRATION_OFFSET)
+            self.to_migrate.discard(chat_id)
+            self.stats["chat_migrated"] += 1
+            return _error(400, "Bad Request: group chat was upgraded to a supergroup chat",
+                          migrate_to_chat_id=new_chat_id)
+        if self.retry_after_rate and self.rnd.random() < self.retry_after_rate:
+            self.stats["retry_after"] += 1
+            return _error(429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after)
+        return None
+
+    def _result(self, chat_id, message_id, text, thread_id=None):
+        result = {"message_id": message_id, "date": int(time.time()), "text": text,
+                  "chat": {"id": chat_id, "type": "supergroup"},
+                  "from": {"id": 1, "is_bot": True, "first_name": "IncidentBot"}}
+        if thread_id:
+            result["message_thread_id"] = thread_id
+        return web.json_response({"ok": True, "result": result})
+
+    async def _send_message(self, params):
+        chat_id = params["chat_id"]
+        failure = await self._inject(chat_id)
+        if failure is not None:
+            return failure
+        message_id = self.last_message_id.get(chat_id, 0) + 1
+        self.last_message_id[chat_id] = message_id
+        self.texts[(chat_id, message_id)] = params["text"]
+        for observer in self.observers:
+            observer("sendMessage", chat_id, message_id, params["text"], time.monotonic())
+        return self._result(chat_id, message_id, params["text"], params.get("message_thread_id"))
+
+    async def _edit_message_text(self, params):
+        chat_id, message_id = params["chat_id"], params["message_id"]
+        failure = await self._inject(chat_id)
+        if failure is not None:
+            return failure
+        old = self.texts.get((chat_id, message_id))
+        if old is None:
+            return _error(400, "Bad Request: message to edit not found")
+        if old == params["text"]:
+            return _error(400, "Bad Request: message is not modified: specified new message content and reply "
+                               "markup are exactly the same as a current content and reply markup of the message")
+        self.texts[(chat_id, message_id)] = params["text"]
+        for observer in self.observers:
+            observer("editMessageText", chat_id, message_id, params["text"], time.monotonic())
+        return self._result(chat_id, message_id, params["text"])
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            raw = await request.json()
+        else:
+            raw = dict(await request.post())
+        params = _params(raw)
+        self.stats[method] += 1
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": {
+                "id": 1, "is_bot": True, "first_name": "IncidentBot", "username": "incident_load_bot"}})
+        if method == "getUpdates":
+            return await self._get_updates(params)
+        if method == "sendMessage":
+            return await self._send_message(params)
+        if method == "editMessageText":
+            return await self._edit_message_text(params)
+        if method == "setWebhook":
+            self._set_webhook(params)
+            return web.json_response({"ok": True, "result": True, "description": "Webhook was set"})
+        if method == "deleteWebhook":
+            self._delete_webhook(params)
+            return web.json_response({"ok": True, "result": True, "description": "Webhook was deleted"})
+        if method == "getWebhookInfo":
+            return web.json_response({"ok": True, "result": {
+                "url": self.webhook["url"] if self.webhook else "", "has_custom_certificate": False,
+                "pending_update_count": len(self.pending) + self._webhook_queue.qsize()}})
+        return _error(404, "Not Found")
+
+    async def start(self, host="127.0.0.1", port=8081):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._session = aiohttp.ClientSession()
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        for task in self._webhook_tasks:
+            task.cancel()
+        if self._runner:
+            await self._runner.cleanup()
+        if self._session:
+            await self._session.close()
+
+
+class Traffic:
+    """Синтетические инциденты и ответы на них в формате, который разбирает handle_message."""
+
+    def __init__(self, server, seed=1, first_key=50000):
+        self.server = server
+        self.rnd = random.Random(seed)
+        self.next_key = first_key
+
+    def incident(self):
+        """Новый инцидент; возвращает (JIRA-ключ, message-dict)."""
+        jira = f"ITSMJIRA-{self.next_key}"
+        self.next_key += 1
+        detected = datetime.datetime.now(TZ) - datetime.timedelta(minutes=self.rnd.randint(0, 10))
+        text = (f"Добрый день!\n\nИнцидент: {self.rnd.choice(NAMES)}\nПриоритет: {self.rnd.choice('11223334')}\n"
+                f"Время выявления: {detected.strftime('%d.%m.%Y %H:%M')}\n\nОписание: нагрузочный прогон\n\n"
+                f"Ссылка на инцидент в JIRA:\nhttps://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/{jira}")
+        return jira, self.server.push(text)
+
+    def resolution(self, message):
+        hm = datetime.datetime.now(TZ).strftime("%H:%M")
+        return self.server.push(self.rnd.choice(RESOLUTIONS).format(hm=hm), reply_to=message)
+
+    def chatter(self):
+        return self.server.push(self.rnd.choice(CHATTER))
+
+    async def run(self, incidents, rate, resolve_after=0.0, chatter=0.0, on_incident=None, on_resolution=None):
+        """incidents инцидентов с темпом rate в секунду; через resolve_after секунд — ответ о решении.
+
+        chatter — вероятность сообщения болтовни после инцидента; on_incident(jira) и
+        on_resolution(jira, text) вызываются в момент постановки сообщения.
+        """
+        replies = []
+
+        async def resolve(jira, message):
+            await asyncio.sleep(resolve_after)
+            reply = self.resolution(message)
+            if on_resolution:
+                on_resolution(jira, reply["text"])
+
+        started = time.monotonic()
+        for n in range(incidents):
+            # темп держится по общему расписанию, а не по сумме пауз
+            await asyncio.sleep(max(started + n / rate - time.monotonic(), 0))
+            jira, message = self.incident()
+            if on_incident:
+                on_incident(jira)
+            if resolve_after is not None:
+                replies.append(asyncio.create_task(resolve(jira, message)))
+            if self.rnd.random() < chatter:
+                self.chatter()
+        await asyncio.gather(*replies)
+
+
+async def serve(args):
+    server = FakeTelegram(args.latency / 1000, args.jitter / 1000, args.retry_after_rate, args.retry_after,
+                          args.migrate, args.seed)
+    await server.start(args.host, args.port)
+    print(f"Bot API: http://{args.host}:{args.port}/bot (TG_API_URL)", flush=True)
+    try:
+        if args.incidents:
+            await server.ready.wait()
+            await Traffic(server, args.seed).run(args.incidents, args.rate, args.resolve_after, args.chatter)
+            print(f"Отправлено {args.incidents} инцидентов", flush=True)
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(dict(server.stats), ensure_ascii=False), flush=True)
+        await server.stop()
+
+
+def add_fault_arguments(ap):
+    ap.add_argument("--latency", type=float, default=0.0, help="задержка ответа на отправку, мс")
+    ap.add_argument("--jitter", type=float, default=0.0, help="разброс задержки ±, мс")
+    ap.add_argument("--retry-after-rate", type=float, default=0.0, help="доля отправок с 429 RetryAfter")
+    ap.add_argument("--retry-after", type=int, default=1, help="retry_after в ответе 429, секунд")
+    ap.add_argument("--migrate", type=int, nargs="*", default=[], help="chat_id, которые переезжают (ChatMigrated)")
+    ap.add_argument("--seed", type=int, default=1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--incidents", type=int, default=0, help="сколько инцидентов отправить, когда бот подключится")
+    ap.add_argument("--rate", type=float, default=5.0, help="инцидентов в секунду")
+    ap.add_argument("--resolve-after", type=float, default=5.0, help="через сколько секунд ответить о решении")
+    ap.add_argument("--chatter", type=float, default=0.5, help="вероятность сообщения болтовни после инцидента")
+    add_fault_arguments(ap)
+    args = ap.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Нагрузочный прогон настоящего процесса бота против заглушки Bot API.
+
+Поднимает bench/fakeapi.py в этом процессе и запускает Incident.py
+отдельным процессом с TG_API_URL на заглушку (polling или webhook), с
+хранилищем и логами во временном каталоге. Затем с темпом --rate ставит
+--incidents новых инцидентов и через --resolve-after секунд — ответ о
+решении на каждый, и ждёт, пока всё дойдёт (не дольше --drain-timeout).
+
+Замеряется сквозная задержка от появления сообщения в Bot API до того, как
+заглушка приняла:
+- notify — карточку нового инцидента (sendMessage) в каждой группе
+  BROADCAST_GROUPS;
+- resolve — карточку со статусом «решён» (правка или новое сообщение) в
+  группах и в чате инцидента.
+Не дошедшие за отведённое время пары (инцидент, чат) считаются потерянными.
+Впрыскиваемые сбои (задержка, 429 RetryAfter, ChatMigrated) — те же ключи,
+что у fakeapi.py; сообщения в переехавшую группу засчитываются ей.
+
+Лимиты отправки бота поднимаются через RATE_LIMIT_GLOBAL/RATE_LIMIT_CHAT
+(--rate-limit 0 оставляет лимиты Telegram).
+
+Запуск из корня репозитория:
+    python bench/load.py [--incidents 2000] [--rate 50] [--mode polling|webhook]
+    python bench/load.py --latency 30 --jitter 20 --retry-after-rate 0.01 --migrate -1002631818202
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fakeapi import TZ, FakeTelegram, Traffic, add_fault_arguments
+from incbot import parser
+from replay import INCIDENT_CHAT, percentile
+
+JIRA_KEY = re.compile(r"ITSMJIRA-\d+")
+TOKEN = "123456:LOAD"
+WEBHOOK_SECRET = "load-secret"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def spawn_bot(workdir, api_port, args):
+    env = dict(os.environ, tg=TOKEN, TG_API_URL=f"http://127.0.0.1:{api_port}/bot", LOG_DIR=workdir,
+               STORAGE_BACKEND="sqlite", METRICS_PORT="0", BOT_MODE=args.mode,
+               ESCALATION_CONFIG=os.path.join(ROOT, "escalation.json"), PYTHONUNBUFFERED="1")
+    if args.rate_limit:
+        env.update(RATE_LIMIT_GLOBAL=str(args.rate_limit), RATE_LIMIT_CHAT=str(args.rate_limit * 60))
+    if args.mode == "webhook":
+        port = free_port()
+        env.update(WEBHOOK_URL=f"http://127.0.0.1:{port}", WEBHOOK_LISTEN="127.0.0.1", WEBHOOK_PORT=str(port),
+                   WEBHOOK_SECRET=WEBHOOK_SECRET)
+    output = open(os.path.join(workdir, "bot.out"), "wb")
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, "Incident.py")], cwd=workdir, env=env,
+                            stdout=output, stderr=subprocess.STDOUT)
+
+
+class Tracker:
+    """Ждёт по каждому инциденту карточки во всех чатах и считает задержки."""
+
+    def __init__(self, server, groups):
+        self.server = server
+        self.groups = set(groups)
+        self.pushed = {"notify": {}, "resolve": {}}  # фаза -> {JIRA-ключ: момент появления в Bot API}
+        self.delivered = {"notify": {}, "resolve": {}}  # фаза -> {(ключ, чат): задержка}
+        self.not_closing = 0  # ответы, которые бот не должен принять за решение
+        server.observers.append(self.on_message)
+
+    def on_incident(self, jira):
+        self.pushed["notify"][jira] = time.monotonic()
+
+    def on_resolution(self, jira, text):
+        if parser.parse_message(text, datetime.datetime.now(TZ), is_reply=True).kind == parser.RESOLUTION:
+            self.pushed["resolve"][jira] = time.monotonic()
+        else:
+            self.not_closing += 1
+
+    def expected(self, phase):
+        chats = self.groups if phase == "notify" else self.groups | {INCIDENT_CHAT}
+        return len(self.pushed[phase]) * len(chats)
+
+    def on_message(self, method, chat_id, message_id, text, at):
+        original = {new: old for old, new in self.server.migrated.items()}
+        chat_id = original.get(chat_id, chat_id)
+        match = JIRA_KEY.search(text)
+        if not match:
+            return
+        if "Статус: решён" in text:
+            phase = "resolve"
+        elif method == "sendMessage" and "Статус: открыт" in text:
+            phase = "notify"
+        else:
+            return
+        if phase == "notify" and chat_id not in self.groups:
+            return
+        pushed = self.pushed[phase].get(match.group())
+        if pushed is not None:
+            self.delivered[phase].setdefault((match.group(), chat_id), at - pushed)
+
+    def done(self):
+        return all(len(self.delivered[phase]) >= self.expected(phase) for phase in self.pushed)
+
+
+async def run(args, workdir):
+    from Incident import BROADCAST_GROUPS  # импорт без побочных эффектов, см. build_runtime()
+
+    groups = [group["chat_id"] for group in BROADCAST_GROUPS]
+    server = FakeTelegram(args.latency / 1000, args.jitter / 1000, args.retry_after_rate, args.retry_after,
+                          args.migrate, args.seed)
+    api_port = free_port()
+    await server.start("127.0.0.1", api_port)
+    tracker = Tracker(server, groups)
+    bot = spawn_bot(workdir, api_port, args)
+    try:
+        started = time.monotonic()
+        while not server.ready.is_set():
+            if bot.poll() is not None:
+                raise SystemExit("Бот завершился при запуске:\n" + _tail(workdir))
+            if time.monotonic() - started > 60:
+                raise SystemExit("Бот не подключился к заглушке за 60 с:\n" + _tail(workdir))
+            await asyncio.sleep(0.1)
+        # в режиме webhook бот готов, когда установил webhook
+        while args.mode == "webhook" and server.webhook is None:
+            await asyncio.sleep(0.1)
+        startup = time.monotonic() - started
+
+        started = time.monotonic()
+        await Traffic(server, args.seed).run(args.incidents, args.rate, args.resolve_after, args.chatter,
+                                             on_incident=tracker.on_incident, on_resolution=tracker.on_resolution)
+        pushed_in = time.monotonic() - started
+        deadline = time.monotonic() + args.drain_timeout
+        while not tracker.done() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        elapsed = time.monotonic() - started
+        complete = tracker.done()
+    finally:
+        bot.send_signal(signal.SIGTERM)
+        try:
+            # заглушка должна отвечать, пока бот завершается
+            await asyncio.to_thread(bot.wait, 30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        await server.stop()
+
+    report = {"mode": args.mode, "incidents": args.incidents, "updates": server.stats["updates"],
+              "startup_s": round(startup, 3), "push_s": round(pushed_in, 3), "elapsed_s": round(elapsed, 3),
+              "complete": complete, "not_closing_replies": tracker.not_closing, "bot_exit_code": bot.returncode}
+    for phase in ("notify", "resolve"):
+        latencies = list(tracker.delivered[phase].values())
+        report[phase] = {"expected": tracker.expected(phase), "delivered": len(latencies),
+                         "dropped": tracker.expected(phase) - len(latencies)}
+        if latencies:
+            report[phase].update({f"{name}_ms": round(percentile(latencies, q) * 1000, 1)
+                                  for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))})
+    report["api"] = {key: server.stats[key] for key in sorted(server.stats)}
+    return report
+
+
+def _tail(workdir, lines=20):
+    with open(os.path.join(workdir, "bot.out"), encoding="utf-8", errors="replace") as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--incidents", type=int, default=2000)
+    ap.add_argument("--rate", type=float, default=50.0, help="новых инцидентов в секунду")
+    ap.add_argument("--resolve-after", type=float, default=2.0, help="через сколько секунд ответить о решении")
+    ap.add_argument("--chatter", type=float, default=0.5, help="вероятность сообщения болтовни после инцидента")
+    ap.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    ap.add_argument("--rate-limit", type=float, default=1000.0,
+                    help="RATE_LIMIT_GLOBAL бота, сообщений в секунду (0 — лимиты Telegram)")
+    ap.add_argument("--drain-timeout", type=float, default=60.0, help="сколько ждать доставки после потока, с")
+    ap.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    add_fault_arguments(ap)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="incbot-load-") as workdir:
+        report = asyncio.run(run(args, workdir))
+        if report["notify"]["dropped"] or report["resolve"]["dropped"] or report["bot_exit_code"]:
+            print(_tail(workdir), file=sys.stderr)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    finish = "всё дошло" if report["complete"] else "ждали доставки"
+    print(f"Режим {report['mode']}: {report['incidents']} инцидентов, {report['updates']} обновлений "
+          f"за {report['push_s']} с, {finish} за {report['elapsed_s']} с (старт бота {report['startup_s']} с)")
+    for phase, title in (("notify", "Карточки новых инцидентов"), ("resolve", "Карточки решения")):
+        stats = report[phase]
+        print(f"{title}: дошло {stats['delivered']} из {stats['expected']}, потеряно {stats['dropped']}")
+        if phase == "resolve" and report["not_closing_replies"]:
+            print(f"  ответов, не закрывающих инцидент (не ждём): {report['not_closing_replies']}")
+        if stats["delivered"]:
+            print(f"  задержка, мс: p50={stats['p50_ms']} p90={stats['p90_ms']} p99={stats['p99_ms']} "
+                  f"max={stats['max_ms']}")
+    print("Bot API: " + ", ".join(f"{key}={value}" for key, value in report["api"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""Офлайн-прогон потока обновлений Telegram через handle_message.
+
+Обновления берутся из JSONL-файла (--input, по строке на обновление:
+{"at": секунды от начала, "update": {...}}) или генерируются с фиксированным
+seed: новые инциденты, ответы о решении/отклонении, смены приоритета и
+болтовня в чате. Вместо Telegram — FakeBot в процессе, вместо реального
+времени — виртуальные часы: перед каждым обновлением планировщик
+напоминаний «проматывается» до его времени, поэтому 50 мин / 60 мин / 3 ч
+срабатывают так же, как в бою, но без ожидания.
+
+Запуск из корня репозитория:
+    python bench/replay.py [--incidents 500] [--seed 1] [--backend sqlite|json]
+    python bench/replay.py --dump stream.jsonl      # только сохранить поток
+    python bench/replay.py --input stream.jsonl --json
+    python bench/replay.py --concurrency 32 --commit-latency 2   # параллельно, медленный диск
+
+Отчёт: сообщений в секунду, p50/p99 времени handle_message по видам,
+число отправок через outbox (рассылки, напоминания и дайджесты), байты, записанные
+хранилищем, и задержка планировщика. Хранилище создаётся во временном каталоге.
+Без --concurrency после каждого обновления и срока таймера прогон дожидается записей и outbox,
+поэтому одинаковый поток даёт одинаковые отправки, правки и байты.
+С --concurrency N обновления идут через KeyedUpdateProcessor бота, как в бою:
+время обработки включает ожидание очереди своего инцидента.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ALLOWED_USER = 771714551
+INCIDENT_CHAT = -1002054350266
+START = datetime.datetime(2026, 1, 12, 9, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=6)))
+
+NAMES = ["Недоступен интернет-банкинг", "Задержки платежей через Элкарт", "Ошибки при выгрузке отчётов",
+         "Не работает SMS-информирование", "Медленная работа АБС", "Сбой обмена с ГНС",
+         "Недоступен мобильный банк", "Ошибки авторизации в CRM"]
+CHATTER = ["Доброе утро!", "Кто сегодня дежурит?", "Спасибо", "Принято", "+", "Ок, смотрим",
+           "Скиньте, пожалуйста, логи за ночь", "Перезапустили сервис, наблюдаем", "Вендор ответил, ждём патч",
+           "Можете уточнить, какие именно клиенты пострадали?", "Отправил заявку в поддержку провайдера"]
+RESOLUTIONS = ["Устранено", "Сервис заработал в {hm}", "Инцидент устранён", "Работа восстановлена",
+               "Решено", "Ситуация стабилизировалась"]
+PRIORITY_CHANGES = ["Приоритет инцидента поднят до 1 (Критичный)", "Приоритет инцидента повышен до 2",
+                    "Приоритет инцидента понижен до 3 (Средний)", "Приоритет инцидента снижен до 4"]
+
+
+def generate(incidents, seed):
+    """Синтетический поток: [(секунды от START, update-dict), ...] по возрастанию времени."""
+    rnd = random.Random(seed)
+    events = []
+    t = 0.0
+    for n in range(incidents):
+        t += rnd.expovariate(1 / 240)  # в среднем инцидент раз в 4 минуты
+        detected = START + datetime.timedelta(seconds=t - rnd.uniform(0, 600))
+        jira = f"ITSMJIRA-{30000 + n}"
+        text = (f"Добрый день!\n\nИнцидент: {rnd.choice(NAMES)} #{n}\nПриоритет: {rnd.choice('11223334')}\n"
+                f"Время выявления: {detected.strftime('%d.%m.%Y %H:%M')}\n\nОписание: тест\n\n"
+                f"Ссылка на инцидент в JIRA:\nhttps://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/{jira}")
+        events.append((t, text, None))
+        if rnd.random() < 0.3:
+            events.append((t + rnd.uniform(60, 1800), rnd.choice(PRIORITY_CHANGES), text))
+        end = t + rnd.expovariate(1 / 3600)  # решают в среднем за час
+        if rnd.random() < 0.1:
+            events.append((end, "Инцидент отклонен", text))
+        else:
+            hm = (START + datetime.timedelta(seconds=end)).strftime("%H:%M")
+            events.append((end, rnd.choice(RESOLUTIONS).format(hm=hm), text))
+        for _ in range(rnd.randint(2, 8)):
+            events.append((t + rnd.uniform(0, 3600), rnd.choice(CHATTER), None))
+    events.sort(key=lambda e: e[0])
+
+    stream = []
+    message_ids = {}  # текст исходного сообщения -> его message_id, чтобы ответы ссылались на него
+    for update_id, (at, text, reply_to) in enumerate(events, 1):
+        message_ids.setdefault(text, update_id)
+        date = int((START + datetime.timedelta(seconds=at)).timestamp())
+        message = {"message_id": update_id, "date": date, "text": text,
+                   "chat": {"id": INCIDENT_CHAT, "type": "supergroup"},
+                   "from": {"id": ALLOWED_USER, "is_bot": False, "first_name": "Replay"}}
+        if reply_to:
+            message["reply_to_message"] = {"message_id": message_ids[reply_to], "date": date, "text": reply_to,
+                                           "chat": {"id": INCIDENT_CHAT, "type": "supergroup"}}
+        stream.append({"at": at, "update": {"update_id": update_id, "message": message}})
+    return stream
+
+
+class VirtualClock:
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+
+class FakeMessage:
+    def __init__(self, message_id, chat_id, text):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.text = text
+
+
+class FakeBot:
+    """Отвечает на send_message и edit_message_text мгновенно (или с задержкой latency секунд) и считает их."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = 0
+        self.edited = 0
+        self.by_chat = {}
+        # id сообщений бота не должны совпадать с id сообщений из потока в том же чате
+        self._message_id = 10 ** 9
+
+    async def send_message(self, chat_id, text, message_thread_id=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self._message_id += 1
+        self.sent += 1
+        self.by_chat[chat_id] = self.by_chat.get(chat_id, 0) + 1
+        return FakeMessage(self._message_id, chat_id, text)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.edited += 1
+        return FakeMessage(message_id, chat_id, text)
+
+
+class FakeApplication:
+    def __init__(self, bot):
+        self.bot = bot
+
+
+class FakeContext:
+    def __init__(self, application):
+        self.application = application
+        self.bot = application.bot
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def load_bot(workdir, backend, rate_limits):
+    """Импортирует Incident.py с хранилищем в workdir и без вывода логов."""
+    os.environ["STORAGE_BACKEND"] = backend
+    os.environ["LOG_DIR"] = workdir
+    os.chdir(workdir)
+    import Incident
+    from incbot.fanout import Broadcaster
+    from incbot.timers import TimerEngine
+
+    Incident.build_runtime()
+
+    logger = logging.getLogger("incident_bot")
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    Incident.log_listener.stop()
+
+    clock = VirtualClock(START.timestamp())
+    Incident.timers = TimerEngine(time_func=clock.time)
+    Incident.coalescer.timers = Incident.timers
+    # окно дайджеста зависит от темпа отправок в чат — считаем его тоже по виртуальным часам
+    Incident.outbox.time_func = clock.time
+    Incident.BOT_START_TIME = START - datetime.timedelta(days=1)
+    if not rate_limits:
+        unlimited = float("inf")
+        Incident.broadcaster = Broadcaster(global_rate=unlimited, global_burst=unlimited,
+                                           chat_rate=unlimited, chat_burst=unlimited)
+        Incident.outbox.broadcaster = Incident.broadcaster
+    return Incident, clock
+
+
+async def run_timers_until(engine, clock, until, settle=None):
+    """Проматывает виртуальные часы по срокам таймеров до until, запуская каждый вовремя.
+
+    settle — корутина, которую ждут после каждого срока (см. replay).
+    """
+    while True:
+        due = engine.next_due()
+        if due is None or due > until:
+            break
+        clock.now = max(clock.now, due)
+        await engine.advance(clock.now)
+        if settle:
+            await settle()
+    clock.now = max(clock.now, until)
+
+
+def slow_commits(store, latency):
+    """Добавляет задержку latency секунд к каждому коммиту хранилища (медленный диск)."""
+    batch = store.batch
+
+    @contextlib.contextmanager
+    def slow():
+        with batch():
+            yield
+        time.sleep(latency)
+
+    store.batch = slow
+
+
+async def replay(stream, bot_module, clock, bot, concurrency=1):
+    from telegram import Update
+    from incbot import parser
+    from incbot.concurrency import KeyedUpdateProcessor
+
+    I = bot_module
+    app = FakeApplication(bot)
+    I.application = app
+    context = FakeContext(app)
+    latencies = {}
+    I.outbox.start(bot)
+    processor = KeyedUpdateProcessor(I.update_key, concurrency) if concurrency > 1 else None
+    pending = set()
+
+    async def process(update, kind):
+        t0 = time.perf_counter()
+        if processor:
+            await processor.process_update(update, I.handle_message(update, context))
+        else:
+            await I.handle_message(update, context)
+        latencies.setdefault(kind, []).append(time.perf_counter() - t0)
+
+    async def settle():
+        # записи идут в фоновых потоках (StoreWriter); без ожидания их скорость решала бы,
+        # какие правки карточек успеют слиться, и прогоны отличались бы друг от друга
+        await I.writer.drain()
+        await I.outbox.join()
+        await I.outbox.writer.drain()
+
+    started = time.perf_counter()
+    for item in stream:
+        at = START.timestamp() + item["at"]
+        if pending:
+            # начатые обработчики успевают поставить свои таймеры до того, как часы уйдут вперёд
+            await asyncio.sleep(0)
+            due = I.timers.next_due()
+            if len(pending) >= concurrency or (due is not None and due <= at):
+                # очередь полна или пора напоминанию, которое должно видеть всё, что пришло до его срока
+                await asyncio.gather(*pending)
+        await run_timers_until(I.timers, clock, at, None if processor else settle)
+
+        update = Update.de_json(item["update"], None)
+        message = update.message
+        kind = parser.parse_message(message.text or "", message.date,
+                                    is_reply=bool(message.reply_to_message)).kind
+        if processor:
+            task = asyncio.create_task(process(update, kind))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+        else:
+            await process(update, kind)
+            await settle()
+
+    await asyncio.gather(*pending)
+    # доигрываем напоминания по инцидентам, оставшимся открытыми, и дожидаемся outbox
+    await run_timers_until(I.timers, clock, clock.now + 24 * 3600, None if processor else settle)
+    await I.outbox.stop(timeout=None)
+    elapsed = time.perf_counter() - started
+    return latencies, I.outbox.stats["sent:reminder"], I.outbox.stats["sent:digest"], elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--input", help="записанный поток обновлений (JSONL)")
+    ap.add_argument("--incidents", type=int, default=500, help="размер синтетического потока")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--dump", help="сохранить синтетический поток в файл и выйти")
+    ap.add_argument("--backend", default="sqlite", choices=("sqlite", "json"))
+    ap.add_argument("--send-latency", type=float, default=0.0, help="задержка FakeBot.send_message, мс")
+    ap.add_argument("--commit-latency", type=float, default=0.0, help="задержка каждого коммита хранилища, мс")
+    ap.add_argument("--concurrency", type=int, default=1, help="обновлений одновременно (KeyedUpdateProcessor)")
+    ap.add_argument("--rate-limits", action="store_true", help="оставить лимиты Telegram в Broadcaster")
+    ap.add_argument("--json", action="store_true", help="вывести отчёт в JSON")
+    args = ap.parse_args()
+
+    if args.input:
+        with open(args.input, encoding="utf-8") as f:
+            stream = [json.loads(line) for line in f if line.strip()]
+    else:
+        stream = generate(args.incidents, args.seed)
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            for item in stream:
+                f.write(json.dumps(item, ensure_ascii=False) + "\n")
+        return
+
+    with tempfile.TemporaryDirectory(prefix="incbot-replay-") as workdir:
+        bot_module, clock = load_bot(workdir, args.backend, args.rate_limits)
+        if args.commit_latency:
+            slow_commits(bot_module.store, args.commit_latency / 1000)
+        bot = FakeBot(latency=args.send_latency / 1000)
+        latencies, reminder_sends, digest_sends, elapsed = asyncio.run(
+            replay(stream, bot_module, clock, bot, args.concurrency))
+        bot_module.writer.close()
+        bot_module.store.close()
+        bot_module.outbox.close()
+        bytes_written = bot_module.store.bytes_written
+        lag = bot_module.timers.lag
+
+    all_latencies = [v for values in latencies.values() for v in values]
+    report = {
+        "messages": len(stream),
+        "elapsed_s": round(elapsed, 3),
+        "messages_per_s": round(len(stream) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            kind: {"count": len(values),
+                   "p50": round(percentile(values, 0.50) * 1000, 3),
+                   "p99": round(percentile(values, 0.99) * 1000, 3)}
+            for kind, values in sorted(latencies.items())
+        },
+        "latency_all_ms": {"p50": round(percentile(all_latencies, 0.50) * 1000, 3),
+                           "p99": round(percentile(all_latencies, 0.99) * 1000, 3)},
+        "sends": bot.sent,
+        "edits": bot.edited,
+        "reminder_sends": reminder_sends,
+        "digest_sends": digest_sends,
+        "persistence_bytes": bytes_written,
+        "timer_lag_max_s": round(lag["max"], 3),
+    }
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"Сообщений: {report['messages']} за {report['elapsed_s']} с — {report['messages_per_s']} msg/s")
+    print(f"handle_message, мс: p50={report['latency_all_ms']['p50']} p99={report['latency_all_ms']['p99']}")
+    for kind, stats in report["latency_ms"].items():
+        print(f"  {kind:<12} {stats['count']:>6} шт  p50={stats['p50']:<8} p99={stats['p99']}")
+    print(f"Отправок: {report['sends']} (из них напоминаний: {report['reminder_sends']}, "
+          f"дайджестов: {report['digest_sends']}), "
+          f"правок карточек: {report['edits']}")
+    print(f"Записано хранилищем ({args.backend}): {report['persistence_bytes']} байт")
+    print(f"Максимальная задержка планировщика (виртуальные часы): {report['timer_lag_max_s']} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Вспомогательные модули бота инцидентов (Incident.py)."""
@@ -0,0 +1,190 @@
+"""Сводная статистика по инцидентам для команды /stats.
+
+Бот не хранит и не перечитывает всю историю при каждом запросе: Analytics —
+набор счётчиков, которые обновляются на каждом событии (создание,
+решение, отклонение), поэтому ответ строится за миллисекунды и через год
+работы. Память постоянная:
+- время на устранение (MTTR) по приоритетам — разреженная гистограмма с
+  логарифмическими корзинами (шаг 10%), квантили оцениваются по ней сверху;
+- счётчики по дням — только за последние DAYS_KEPT дней;
+- дошедшие до отметок ESCALATION_MARKS (60 мин, 3 ч) и отклонённые — по
+  приоритетам.
+
+Состояние сохраняется в meta хранилища (ключ "analytics"). При первом
+запуске оно собирается одним потоковым проходом по истории SqliteStore
+(store.history()); журнал (STORAGE_BACKEND=json) истории закрытых
+инцидентов не хранит, там счёт начинается с момента запуска.
+"""
+import datetime
+import json
+import math
+
+DAYS_KEPT = 90
+DAYS_SHOWN = 7
+ESCALATION_MARKS = (("60 мин", 3600), ("3 ч", 3 * 3600))
+QUANTILES = (0.5, 0.9, 0.99)
+# корзины MTTR: до минуты, дальше каждая следующая на 10% шире предыдущей
+BUCKET_BASE = 60.0
+BUCKET_GROWTH = 1.1
+
+
+def _bucket(seconds):
+    if seconds <= BUCKET_BASE:
+        return 0
+    return math.ceil(math.log(seconds / BUCKET_BASE) / math.log(BUCKET_GROWTH))
+
+
+def _bound(index):
+    return BUCKET_BASE * BUCKET_GROWTH ** index
+
+
+def format_seconds(seconds):
+    seconds = max(seconds, 0)
+    days = int(seconds // 86400)
+    hours = int((seconds % 86400) // 3600)
+    minutes = int((seconds % 3600) // 60)
+    if days:
+        return f"{days} д {hours} ч"
+    return f"{hours} ч {minutes} мин" if hours else f"{minutes} мин"
+
+
+class _PriorityStats:
+    __slots__ = ("closed", "rejected", "marks", "buckets", "resolved", "total")
+
+    def __init__(self):
+        self.closed = 0
+        self.rejected = 0
+        self.marks = [0] * len(ESCALATION_MARKS)
+        self.buckets = {}  # индекс корзины -> число решённых
+        self.resolved = 0
+        self.total = 0.0  # сумма времени на устранение, секунд
+
+    def quantile(self, q):
+        if not self.resolved:
+            return None
+        rank = q * self.resolved
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return _bound(index)
+        return _bound(max(self.buckets))
+
+    def to_dict(self):
+        return {"closed": self.closed, "rejected": self.rejected, "marks": self.marks,
+                "buckets": {str(k): v for k, v in self.buckets.items()}, "resolved": self.resolved,
+                "total": self.total}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.closed = data["closed"]
+        stats.rejected = data["rejected"]
+        stats.marks = (list(data["marks"]) + [0] * len(ESCALATION_MARKS))[:len(ESCALATION_MARKS)]
+        stats.buckets = {int(k): v for k, v in data["buckets"].items()}
+        stats.resolved = data["resolved"]
+        stats.total = data["total"]
+        return stats
+
+
+class Analytics:
+    def __init__(self, tz=datetime.timezone.utc, days_kept=DAYS_KEPT):
+        self.tz = tz
+        self.days_kept = days_kept
+        self.since = None  # дата самого раннего учтённого инцидента
+        self.priorities = {}  # приоритет -> _PriorityStats
+        self.days = {}  # "ГГГГ-ММ-ДД" -> [создано, решено, отклонено]
+
+    def _day(self, when):
+        day = when.astimezone(self.tz).date()
+        if self.since is None or day < self.since:
+            self.since = day
+        key = day.isoformat()
+        counts = self.days.get(key)
+        if counts is None:
+            counts = self.days[key] = [0, 0, 0]
+            if len(self.days) > self.days_kept:
+                # ключи ISO-дат сортируются как даты
+                for old in sorted(self.days)[:len(self.days) - self.days_kept]:
+                    del self.days[old]
+        return counts
+
+    def record_created(self, detected_at):
+        self._day(detected_at)[0] += 1
+
+    def record_closed(self, priority, status, detected_at, closed_at):
+        """status — "resolved" или "rejected"; время на устранение считается от выявления."""
+        stats = self.priorities.get(priority or "")
+        if stats is None:
+            stats = self.priorities[priority or ""] = _PriorityStats()
+        duration = max((closed_at - detected_at).total_seconds(), 0)
+        stats.closed += 1
+        for i, (_, mark) in enumerate(ESCALATION_MARKS):
+            if duration >= mark:
+                stats.marks[i] += 1
+        if status == "rejected":
+            stats.rejected += 1
+            self._day(closed_at)[2] += 1
+            return
+        stats.resolved += 1
+        stats.total += duration
+        index = _bucket(duration)
+        stats.buckets[index] = stats.buckets.get(index, 0) + 1
+        self._day(closed_at)[1] += 1
+
+    @classmethod
+    def from_history(cls, rows, tz=datetime.timezone.utc, days_kept=DAYS_KEPT):
+        """Один проход по [(priority, status, detected_at, closed_at), ...] — строки читаются по одной."""
+        analytics = cls(tz, days_kept)
+        for priority, status, detected_at, closed_at in rows:
+            analytics.record_created(detected_at)
+            if status != "open" and closed_at is not None:
+                analytics.record_closed(priority, status, detected_at, closed_at)
+        return analytics
+
+    def dumps(self):
+        return json.dumps({"since": self.since.isoformat() if self.since else None, "days": self.days,
+                           "priorities": {p: s.to_dict() for p, s in self.priorities.items()}},
+                          ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, raw, tz=datetime.timezone.utc, days_kept=DAYS_KEPT):
+        data = json.loads(raw)
+        analytics = cls(tz, days_kept)
+        analytics.since = datetime.date.fromisoformat(data["since"]) if data["since"] else None
+        analytics.days = {day: list(counts) for day, counts in data["days"].items()}
+        analytics.priorities = {p: _PriorityStats.from_dict(s) for p, s in data["priorities"].items()}
+        return analytics
+
+    def report(self, open_incidents=(), now=None):
+        """Текст для /stats; open_incidents — [(priority, detected_at), ...] открытых сейчас."""
+        lines = []
+        closed = sum(s.closed for s in self.priorities.values())
+        since = f" с {self.since.strftime('%d.%m.%Y')}" if self.since else ""
+        lines.append(f"Закрыто инцидентов{since}: {closed}")
+        for priority, stats in sorted(self.priorities.items(), key=lambda item: -item[1].closed):
+            lines.append(f"\n{priority or 'без приоритета'}: закрыто {stats.closed}, "
+                         f"отклонено {stats.rejected} ({_percent(stats.rejected, stats.closed)})")
+            if stats.resolved:
+                quantiles = " / ".join("≤" + format_seconds(stats.quantile(q)) for q in QUANTILES)
+                lines.append(f"  MTTR p50 / p90 / p99: {quantiles}, "
+                             f"среднее {format_seconds(stats.total / stats.resolved)}")
+            marks = ", ".join(f"{name} — {stats.marks[i]} ({_percent(stats.marks[i], stats.closed)})"
+                              for i, (name, _) in enumerate(ESCALATION_MARKS))
+            lines.append(f"  Дошли до отметок: {marks}")
+        if open_incidents:
+            now = now or datetime.datetime.now(self.tz)
+            overdue = ", ".join(
+                f"{name} — {sum(1 for _, detected in open_incidents if (now - detected).total_seconds() >= mark)}"
+                for name, mark in ESCALATION_MARKS)
+            lines.append(f"\nОткрыто сейчас: {len(open_incidents)}, дольше отметок: {overdue}")
+        if self.days:
+            lines.append("\nПо дням (создано / решено / отклонено):")
+            for day in sorted(self.days)[-DAYS_SHOWN:]:
+                created, resolved, rejected = self.days[day]
+                lines.append(f"  {day}: {created} / {resolved} / {rejected}")
+        return "\n".join(lines)
+
+
+def _percent(part, whole):
+    return f"{part * 100 / whole:.0f}%" if whole else "—"
@@ -0,0 +1,104 @@
+"""Пакетный разбор текстов инцидентов без запуска бота.
+
+    python -m incbot.batch messages.jsonl [--time "2026-10-18 09:00"] [--reply] [--summary]
+    python -m incbot.batch incidents.txt > parsed.jsonl
+
+Вход — файл или "-" (stdin):
+- JSONL: по объекту на строку, {"text": ..., "reply": true/false,
+  "date": ISO-время сообщения} — как bench/data/messages.jsonl;
+- обычный текст: сообщения разделены строкой "---".
+Выход — JSON Lines, по строке на сообщение: вид (kind), JIRA-ключ,
+название, приоритет, действие и время выявления/события в ISO.
+
+Время сообщения (от него считаются «ЧЧ:ММ» без даты) — date из записи,
+иначе --time, иначе текущее. Файл читается потоково, память не растёт с
+его размером. Модуль импортирует только incbot.parser: ни .env, ни логов,
+ни хранилища, ни telegram.
+"""
+import argparse
+import collections
+import dataclasses
+import datetime
+import itertools
+import json
+import sys
+from zoneinfo import ZoneInfo
+
+from incbot import parser
+
+TZ = ZoneInfo("Asia/Bishkek")
+SEPARATOR = "---"
+
+
+def read_messages(lines):
+    """(text, is_reply, date) из строк JSONL или текста с разделителями "---"."""
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    lines = itertools.chain([first], lines)
+    if first.lstrip().startswith("{"):
+        for line in lines:
+            if line.strip():
+                record = json.loads(line)
+                date = record.get("date")
+                yield (record["text"], bool(record.get("reply")),
+                       datetime.datetime.fromisoformat(date) if date else None)
+        return
+    chunk = []
+    for line in lines:
+        if line.rstrip("\r\n") == SEPARATOR:
+            if "".join(chunk).strip():
+                yield "".join(chunk).strip("\n"), False, None
+            chunk = []
+        else:
+            chunk.append(line)
+    if "".join(chunk).strip():
+        yield "".join(chunk).strip("\n"), False, None
+
+
+def to_record(parsed):
+    record = {key: value for key, value in dataclasses.asdict(parsed).items() if value is not None}
+    for key in ("detection_time", "event_time"):
+        if key in record:
+            record[key] = record[key].isoformat()
+    return record
+
+
+def parse_file(lines, message_time, reply=False, out=sys.stdout):
+    """Разбирает все сообщения и пишет JSONL в out; возвращает счётчик по видам."""
+    kinds = collections.Counter()
+    for text, is_reply, date in read_messages(lines):
+        if date is None:
+            when = message_time
+        else:
+            when = date.astimezone(TZ) if date.tzinfo else date.replace(tzinfo=TZ)
+        parsed = parser.parse_message(text, when, is_reply=is_reply or reply)
+        kinds[parsed.kind] += 1
+        out.write(json.dumps(to_record(parsed), ensure_ascii=False) + "\n")
+    return kinds
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m incbot.batch", description=__doc__.splitlines()[0])
+    ap.add_argument("input", help='JSONL или текст с разделителями "---"; "-" — stdin')
+    ap.add_argument("--time", help="время сообщений без date, ГГГГ-ММ-ДД ЧЧ:ММ (по умолчанию — сейчас)")
+    ap.add_argument("--reply", action="store_true", help="считать все сообщения ответами (решение, отклонение)")
+    ap.add_argument("--summary", action="store_true", help="итог по видам сообщений в stderr")
+    args = ap.parse_args(argv)
+
+    message_time = (datetime.datetime.fromisoformat(args.time).replace(tzinfo=TZ) if args.time
+                    else datetime.datetime.now(TZ))
+    if args.input == "-":
+        kinds = parse_file(sys.stdin, message_time, args.reply)
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            kinds = parse_file(f, message_time, args.reply)
+    if args.summary:
+        total = sum(kinds.values())
+        print(f"Сообщений: {total}; " + ", ".join(f"{kind}: {n}" for kind, n in kinds.most_common()),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
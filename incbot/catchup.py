@@ -0,0 +1,128 @@
+"""Догон обновлений, накопившихся, пока бот не работал.
+
+При старте бот вычитывает getUpdates пачками, начиная с сохранённого
+last_update_id, и прогоняет их через обычные обработчики. Пока идёт догон,
+рассылки не отправляются, а копятся в CatchUp: в конце новые инциденты,
+которые так и остались открытыми, рассылаются как обычно, а всё остальное
+(решения, отклонения, смены приоритета, в том числе инциденты, созданные и
+закрытые за время простоя) уходит одной сводкой.
+
+DedupCache (LRU с TTL) отсекает повторы по update_id, а во время догона —
+ещё и по ключу сообщения (чат и message_id), поэтому повторный догон того
+же хвоста ничего не ломает. Текст в ключ не входит: одинаковый ответ на
+то же сообщение (например, «поднят до 2» во второй раз) — новое событие.
+"""
+import collections
+import logging
+import time
+
+from telegram import Update
+
+logger = logging.getLogger("incident_bot")
+
+BATCH_SIZE = 100  # максимум getUpdates
+DEDUP_CAPACITY = 10000
+DEDUP_TTL = 24 * 3600  # Telegram хранит неподтверждённые обновления сутки
+SUMMARY_LIMIT = 4000  # лимит Telegram — 4096 символов
+
+
+class DedupCache:
+    """Множество недавно обработанных ключей: не больше capacity, каждый живёт ttl секунд."""
+
+    def __init__(self, capacity=DEDUP_CAPACITY, ttl=DEDUP_TTL, time_func=time.monotonic):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.time_func = time_func
+        self._seen = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def seen(self, key):
+        """True, если key уже встречался; иначе запоминает его и возвращает False."""
+        now = self.time_func()
+        added = self._seen.get(key)
+        if added is not None and now - added < self.ttl:
+            self._seen.move_to_end(key)
+            return True
+        self._seen[key] = now
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        return False
+
+
+def message_key(message):
+    """Ключ сообщения для DedupCache: чат и message_id — одинаковый у повторно доставленных копий."""
+    return message.chat_id, message.message_id
+
+
+class CatchUp:
+    """Отложенные рассылки на время догона: incident_id -> что с ним произошло."""
+
+    def __init__(self):
+        self.incidents = {}
+        self.destinations = {}  # (chat_id, thread_id) -> chat_info, в порядке появления
+
+    def defer(self, incident_id, name, event, destinations, text, new=False, key=None):
+        entry = self.incidents.setdefault(incident_id, {"name": name, "events": [], "new": None, "last": None})
+        entry["name"] = entry["name"] or name
+        entry["events"].append(event)
+        entry["last"] = (destinations, text)
+        if new:
+            entry["new"] = (destinations, text, key)
+        for dest in destinations:
+            self.destinations.setdefault((dest["chat_id"], dest.get("thread_id")), dest)
+
+    def new_open(self, open_incidents):
+        """Созданные за время простоя и всё ещё открытые: [(incident_id, destinations, text, key), ...]."""
+        return [(incident_id, *entry["new"]) for incident_id, entry in self.incidents.items()
+                if entry["new"] and incident_id in open_incidents]
+
+    def last_states(self, open_incidents):
+        """Остальные затронутые инциденты и их последнее состояние: [(incident_id, destinations, text), ...]."""
+        return [(incident_id, *entry["last"]) for incident_id, entry in self.incidents.items()
+                if not (entry["new"] and incident_id in open_incidents)]
+
+    def summary(self, open_incidents, processed):
+        """Текст сводки или None, если кроме новых открытых инцидентов ничего не произошло."""
+        lines = []
+        for incident_id, entry in self.incidents.items():
+            if entry["new"] and incident_id in open_incidents and len(entry["events"]) == 1:
+                continue
+            name = f" «{entry['name']}»" if entry["name"] else ""
+            lines.append(f"• {incident_id}{name}: {' → '.join(entry['events'])}")
+        if not lines:
+            return None
+        text = f"Пока бот был недоступен, обработано {processed} сообщений:\n"
+        for shown, line in enumerate(lines):
+            if len(text) + len(line) + 40 > SUMMARY_LIMIT:
+                return text + f"… и ещё {len(lines) - shown}"
+            text += line + "\n"
+        return text.rstrip("\n")
+
+
+async def drain(bot, process_update, offset=None, batch_size=BATCH_SIZE, on_batch=None):
+    """Вычитывает getUpdates пачками и передаёт обновления в process_update.
+
+    Каждый следующий запрос с offset = последний update_id + 1 подтверждает
+    Telegram предыдущую пачку; после каждой пачки вызывается on_batch(last_id),
+    чтобы сохранить позицию. Возвращает (число обновлений, последний update_id).
+    """
+    total = 0
+    last = None
+    while True:
+        updates = await bot.get_updates(offset=offset, limit=batch_size, timeout=0,
+                                        allowed_updates=Update.ALL_TYPES)
+        if not updates:
+            return total, last
+        started = time.monotonic()
+        for update in updates:
+            await process_update(update)
+        last = updates[-1].update_id
+        offset = last + 1
+        total += len(updates)
+        if on_batch:
+            on_batch(last)
+        logger.info(f"Догон: обработано {len(updates)} обновлений за "
+                    f"{(time.monotonic() - started) * 1000:.0f} мс, последнее {last}")
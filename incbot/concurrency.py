@@ -0,0 +1,90 @@
+"""Параллельная обработка обновлений с порядком внутри инцидента.
+
+По умолчанию PTB обрабатывает обновления по одному: медленная запись или
+ответ в одном чате задерживает все следующие сообщения во всех чатах.
+KeyedUpdateProcessor пускает до max_concurrent_updates обновлений
+одновременно, но обновления с одинаковым ключом (инцидент, к которому
+относится сообщение) выполняются строго по очереди — в порядке поступления.
+Обновления без ключа (болтовня, команды) идут без ожидания.
+
+Ключ считает key_func(update), её даёт бот: JIRA-ключ нового инцидента или
+инцидент, на сообщение которого ответили.
+
+Ограничение: ожидающие своей очереди обновления одного инцидента занимают
+слоты семафора PTB, поэтому max_concurrent_updates стоит держать заметно
+больше типичной пачки сообщений по одному инциденту.
+"""
+import asyncio
+import contextlib
+import logging
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger("incident_bot")
+
+MAX_CONCURRENT_UPDATES = 32
+
+
+class KeyedLocks:
+    """asyncio.Lock на ключ; замок удаляется, когда его никто не держит и не ждёт."""
+
+    def __init__(self):
+        self._locks = {}  # key -> [lock, сколько держат или ждут]
+
+    def __len__(self):
+        return len(self._locks)
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock отдаёт замок ожидающим в порядке очереди — порядок обновлений сохраняется
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def busy(self, key):
+        return key in self._locks
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, key_func, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+        """key_func(update) -> ключ сериализации или None, если порядок не важен."""
+        super().__init__(max_concurrent_updates)
+        self.key_func = key_func
+        self.locks = KeyedLocks()
+        self.in_flight = 0
+        self.stats = {"processed": 0, "keyed": 0, "waited": 0, "max_in_flight": 0}
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            key = self.key_func(update)
+        except Exception as e:
+            logger.error(f"Не удалось определить ключ обновления: {e}")
+            key = None
+        self.in_flight += 1
+        self.stats["max_in_flight"] = max(self.stats["max_in_flight"], self.in_flight)
+        try:
+            if key is None:
+                await coroutine
+                return
+            self.stats["keyed"] += 1
+            if self.locks.busy(key):
+                self.stats["waited"] += 1
+            async with self.locks.hold(key):
+                await coroutine
+        finally:
+            self.in_flight -= 1
+            self.stats["processed"] += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
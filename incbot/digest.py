@@ -0,0 +1,70 @@
+"""Склейка напоминаний в дайджесты при шторме инцидентов.
+
+Напоминание не отправляется сразу, а попадает в пачку своего чата. Пачка
+уходит через window секунд после первого напоминания в ней: одно
+напоминание — как обычно, несколько — одним сообщением со списком
+инцидентов. Окно подстраивается под нагрузку на чат: в тишине оно
+минимальное (min_window, чтобы поймать напоминания с одинаковым сроком),
+а по мере роста числа сообщений в этот чат за последнюю минуту растёт до
+max_window — тогда в шторм вместо десятков пингов уходит несколько дайджестов.
+
+Сроки ставятся через TimerEngine, поэтому в бенчмарке с виртуальными
+часами дайджесты собираются так же, как в бою.
+"""
+import logging
+
+logger = logging.getLogger("incident_bot")
+
+MIN_WINDOW = 2.0  # секунд
+MAX_WINDOW = 60.0
+# сообщений в чат за минуту, при которых окно максимальное (лимит Telegram для группы — 20/мин)
+SATURATION = 10.0
+
+
+class ReminderCoalescer:
+    def __init__(self, timers, flush, rate_func=None, min_window=MIN_WINDOW, max_window=MAX_WINDOW,
+                 saturation=SATURATION):
+        """flush(chat_id, items) — корутина, отправляющая пачку; rate_func(chat_id) — сообщений в минуту."""
+        self.timers = timers
+        self.flush = flush
+        self.rate_func = rate_func
+        self.min_window = min_window
+        self.max_window = max_window
+        self.saturation = saturation
+        self.pending = {}  # chat_id -> [item, ...]
+        self.stats = {"items": 0, "batches": 0, "merged": 0}
+
+    def window(self, chat_id):
+        rate = self.rate_func(chat_id) if self.rate_func else 0.0
+        load = min(rate / self.saturation, 1.0)
+        return self.min_window + (self.max_window - self.min_window) * load
+
+    async def add(self, chat_id, item):
+        """Добавляет напоминание в пачку чата; первая в пачке ставит таймер отправки."""
+        self.stats["items"] += 1
+        batch = self.pending.get(chat_id)
+        if batch is not None:
+            batch.append(item)
+            return
+        self.pending[chat_id] = [item]
+        window = self.window(chat_id)
+        if window <= 0:
+            await self._flush(chat_id)
+            return
+        self.timers.schedule(f"digest:{chat_id}", self.timers.time_func() + window, self._flush, chat_id)
+
+    async def _flush(self, chat_id):
+        items = self.pending.pop(chat_id, None)
+        if not items:
+            return
+        self.stats["batches"] += 1
+        self.stats["merged"] += len(items) - 1
+        if len(items) > 1:
+            logger.info(f"Дайджест для {chat_id}: {len(items)} напоминаний одним сообщением")
+        await self.flush(chat_id, items)
+
+    async def flush_all(self):
+        """Отправляет все недособранные пачки (при остановке бота)."""
+        for chat_id in list(self.pending):
+            self.timers.cancel(f"digest:{chat_id}")
+            await self._flush(chat_id)
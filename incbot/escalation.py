@@ -0,0 +1,124 @@
+"""Политика эскалации: какие напоминания, когда и кому слать по приоритету.
+
+Политика описывается в escalation.json:
+
+    {
+      "targets": ["@monitoring_cbk", ...],          # адресаты по умолчанию
+      "ladders": {
+        "standard": [
+          {"id": "50", "after": "50m", "text": "Прошло 50 минут... {targets}"},
+          ...
+        ]
+      },
+      "priorities": {"критичный": "standard", "высокий": "standard",
+                     "средний": null, "низкий": null}
+    }
+
+"after" — смещение от времени выявления: "30s", "50m", "3h" или "1h30m".
+В text доступны {targets}, {incident_id}, {name}, {priority} и {after};
+шаблоны проверяются при загрузке, поэтому опечатка в плейсхолдере или
+повтор id шага в лестнице — ошибка /reload_escalation, а не потерянные
+напоминания. Шаг может переопределить адресатов своим "targets".
+"""
+import datetime
+import json
+import os
+import re
+from dataclasses import dataclass
+
+from incbot.parser import extract_key
+
+DURATION_RE = re.compile(r'^(?:(\d+)h)?(?:(\d+)m)?(?:(\d+)s)?$')
+
+DEFAULT_POLICY = {
+    "targets": ["@monitoring_cbk", "@lord312", "@WikiKarpenko"],
+    "ladders": {
+        "standard": [
+            {"id": "50", "after": "50m", "text": "Прошло 50 минут. Через 10 минут необходимо оповестить! {targets}"},
+            {"id": "60", "after": "60m", "text": "Прошло 60 минут! {targets}"},
+            {"id": "3h", "after": "3h", "text": "Прошло 3 часа! Проверьте статус. {targets}"},
+        ]
+    },
+    "priorities": {"критичный": "standard", "высокий": "standard", "средний": None, "низкий": None},
+}
+
+
+def parse_duration(value):
+    match = DURATION_RE.match(str(value).strip())
+    if not match or not any(match.groups()):
+        raise ValueError(f"Неверная длительность в политике эскалации: {value!r}")
+    hours, minutes, seconds = (int(g or 0) for g in match.groups())
+    return datetime.timedelta(hours=hours, minutes=minutes, seconds=seconds)
+
+
+@dataclass(frozen=True)
+class Step:
+    id: str
+    after: datetime.timedelta
+    targets: tuple
+    text: str
+
+    def render(self, incident_id, incident, targets=None):
+        """Текст напоминания; targets=() — без адресатов (для строки дайджеста)."""
+        return self.text.format(
+            targets=", ".join(self.targets if targets is None else targets),
+            incident_id=incident_id,
+            name=extract_key(incident["text"]) or incident_id,
+            priority=incident.get("priority", ""),
+            after=self.after,
+        )
+
+
+def _check_template(ladder, step):
+    """Пробно подставляет в text шага поля напоминания, как render() при отправке."""
+    try:
+        step.render("ITSMJIRA-0", {"text": "", "priority": ""})
+    except (KeyError, IndexError, AttributeError, ValueError) as e:
+        raise ValueError(f"Ошибка в шаблоне шага '{step.id}' лестницы '{ladder}': {e!r}. "
+                         f"Доступны {{targets}}, {{incident_id}}, {{name}}, {{priority}} и {{after}}")
+
+
+class EscalationPolicy:
+    def __init__(self, config, time_scale=1.0):
+        """time_scale < 1 сжимает все смещения (например, 1/60 — минуты в секунды для TEST_MODE)."""
+        default_targets = tuple(config.get("targets", ()))
+        ladders = {}
+        for name, steps in config.get("ladders", {}).items():
+            compiled = []
+            for step in steps:
+                if "id" not in step or "after" not in step or "text" not in step:
+                    raise ValueError(f"Шаг лестницы '{name}' должен содержать id, after и text: {step}")
+                compiled.append(Step(str(step["id"]), parse_duration(step["after"]) * time_scale,
+                                     tuple(step.get("targets", default_targets)), step["text"]))
+                # по id шага хранятся отметки об отправке — в лестнице он должен быть один
+                if any(other.id == compiled[-1].id for other in compiled[:-1]):
+                    raise ValueError(f"Повторяется id шага '{compiled[-1].id}' в лестнице '{name}'")
+                _check_template(name, compiled[-1])
+            ladders[name] = tuple(sorted(compiled, key=lambda s: s.after))
+        self.ladders = ladders
+        self.priorities = {}
+        for priority, ladder in config.get("priorities", {}).items():
+            if ladder is not None and ladder not in ladders:
+                raise ValueError(f"Приоритет '{priority}' ссылается на неизвестную лестницу '{ladder}'")
+            self.priorities[priority.lower()] = ladders[ladder] if ladder else ()
+
+    def steps_for(self, priority):
+        return self.priorities.get((priority or "").lower(), ())
+
+    def step(self, priority, step_id):
+        for step in self.steps_for(priority):
+            if step.id == step_id:
+                return step
+        return None
+
+    def plan(self, incident_id, start_time, priority):
+        """[(ключ таймера, срок, шаг), ...] для инцидента."""
+        return [(f"{incident_id}_{step.id}", start_time + step.after, step) for step in self.steps_for(priority)]
+
+
+def load_policy(path, time_scale=1.0):
+    """Читает политику из JSON; без файла — встроенная политика 50 мин / 60 мин / 3 ч."""
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return EscalationPolicy(json.load(f), time_scale)
+    return EscalationPolicy(DEFAULT_POLICY, time_scale)
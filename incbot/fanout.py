@@ -0,0 +1,162 @@
+"""Доставка сообщений в Telegram с учётом лимитов.
+
+Параллельность рассылки по группам даёт outbox (incbot/outbox.py): его
+обработчики одновременно отправляют в разные чаты через Broadcaster.deliver.
+"""
+import asyncio
+import datetime
+import logging
+import time
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+
+logger = logging.getLogger("incident_bot")
+
+# Лимиты Telegram: ~30 сообщений/с на бота и ~20 сообщений/мин в одну группу
+GLOBAL_RATE = 30.0
+GLOBAL_BURST = 30
+CHAT_RATE = 20 / 60
+CHAT_BURST = 20
+
+MAX_ATTEMPTS = 4
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# переездов чата за одну отправку; больше — ошибочная цепочка ChatMigrated (например, цикл)
+MAX_MIGRATIONS = 3
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds):
+        """Останавливает выдачу токенов (после RetryAfter от Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class Broadcaster:
+    """Отправляет одно сообщение с лимитами и повторами.
+
+    Каждая отправка проходит через общий и поканальный token bucket,
+    RetryAfter и сетевые ошибки повторяются с backoff, а переезды
+    групп (ChatMigrated) запоминаются, чтобы следующие отправки сразу
+    шли по новому chat_id.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, global_burst=GLOBAL_BURST,
+                 chat_rate=CHAT_RATE, chat_burst=CHAT_BURST, max_attempts=MAX_ATTEMPTS):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.chat_buckets = {}
+        self.migrated = {}
+        # вызываются как observer(chat_id, elapsed, ok) после каждой отправки
+        self.send_observers = []
+
+    def resolve_chat(self, chat_id):
+        seen = {chat_id}
+        while chat_id in self.migrated and self.migrated[chat_id] not in seen:
+            chat_id = self.migrated[chat_id]
+            seen.add(chat_id)
+        return chat_id
+
+    def _bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def deliver(self, bot, chat_info, text, edit_message_id=None):
+        """Отправляет одно сообщение; возвращает (Message или None, permanent).
+
+        permanent=True — повторять бессмысленно (бот удалён из чата, неверный
+        запрос); иначе неудача временная (flood-лимит, сеть) и отправку можно
+        повторить позже. С edit_message_id сообщение не отправляется, а
+        редактируется; если текст не изменился, вместо Message возвращается True.
+        """
+        origin_id = chat_info["chat_id"]
+        thread_id = chat_info.get("thread_id")
+        started = time.monotonic()
+        message = None
+        permanent = False
+        attempt = 0
+        migrations = 0
+        while attempt < self.max_attempts:
+            attempt += 1
+            chat_id = self.resolve_chat(origin_id)
+            # после переезда группы в супергруппу старый thread_id недействителен
+            thread = thread_id if chat_id == origin_id else None
+            bucket = self._bucket(chat_id)
+            await bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                if edit_message_id is not None:
+                    message = await bot.edit_message_text(text=text, chat_id=chat_id, message_id=edit_message_id)
+                else:
+                    message = await bot.send_message(chat_id=chat_id, text=text, message_thread_id=thread)
+                break
+            except ChatMigrated as e:
+                migrations += 1
+                if migrations > MAX_MIGRATIONS:
+                    logger.warning(f"Сообщение в {origin_id} не отправлено: больше {MAX_MIGRATIONS} переездов "
+                                   f"подряд (последний {chat_id} -> {e.new_chat_id})")
+                    permanent = True
+                    break
+                logger.warning(f"Чат {chat_id} переехал в {e.new_chat_id} — обновите BROADCAST_GROUPS")
+                self.migrated[chat_id] = e.new_chat_id
+                # переезд не считается попыткой
+                attempt -= 1
+            except RetryAfter as e:
+                if isinstance(e.retry_after, datetime.timedelta):
+                    delay = e.retry_after.total_seconds()
+                else:
+                    delay = float(e.retry_after)
+                logger.warning(f"Flood-лимит для {chat_id}: повтор через {delay} с (попытка {attempt})")
+                bucket.block(delay)
+            except (Forbidden, BadRequest) as e:
+                if edit_message_id is not None and "not modified" in str(e).lower():
+                    message = True
+                    break
+                logger.warning(f"Не удалось отправить сообщение в {chat_id}: {e}")
+                permanent = True
+                break
+            except NetworkError as e:
+                delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+                logger.warning(f"Сетевая ошибка при отправке в {chat_id}: {e}, повтор через {delay} с")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delay)
+            except Exception as e:
+                logger.warning(f"Не удалось отправить сообщение в {chat_id}: {e}")
+                permanent = True
+                break
+        else:
+            logger.warning(f"Сообщение в {origin_id} не отправлено после {self.max_attempts} попыток")
+
+        for observer in self.send_observers:
+            observer(self.resolve_chat(origin_id), time.monotonic() - started, message is not None)
+        return message, permanent
@@ -0,0 +1,310 @@
+"""Журнал инцидентов: append-only лог событий + снапшот incidents.json.
+
+Каждое событие (создание, смена приоритета, решение, отклонение) дописывается
+одной строкой JSON в журнал, поэтому стоимость записи не зависит от числа
+открытых инцидентов. Когда журнал вырастает, он ротируется, а фоновый поток
+сворачивает его в новый снапшот (атомарно, через временный файл и os.replace).
+При старте загружается снапшот и проигрывается хвост журнала.
+
+Служебные значения (set_meta: last_update_id, статистика) тоже пишутся
+записями журнала, а в incidents.meta.json попадают при сжатии — иначе
+каждое событие переписывало бы этот файл целиком с fsync.
+"""
+import contextlib
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("incident_bot")
+
+FSYNC_BATCH = 16  # fsync после стольких записей...
+FSYNC_INTERVAL = 1.0  # ...или если с прошлого fsync прошло столько секунд
+COMPACT_EVERY = 500  # записей в журнале до фонового сжатия
+
+# op -> удаляет ли событие инцидент из открытых
+OPS = {"create": False, "update": False, "resolve": True, "reject": True}
+
+# сколько последних сообщений (chat_id, message_id) помнить на инцидент для ответов
+MAX_INCIDENT_MESSAGES = 100
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime.datetime) else value
+
+
+def _parse_time(value):
+    if isinstance(value, str):
+        # fromisoformat поддерживает смещение, получаем aware datetime
+        return datetime.datetime.fromisoformat(value.replace(" ", "T"))
+    return value
+
+
+def serialize_reminders(reminders):
+    if not reminders:
+        return None
+    return {
+        "start": _iso(reminders["start"]),
+        "steps": {step_id: {"due": _iso(step["due"]), "fired": step["fired"]}
+                  for step_id, step in reminders["steps"].items()},
+    }
+
+
+def deserialize_reminders(data):
+    if not data:
+        return None
+    return {
+        "start": _parse_time(data["start"]),
+        "steps": {step_id: {"due": _parse_time(step["due"]), "fired": step["fired"]}
+                  for step_id, step in data["steps"].items()},
+    }
+
+
+def serialize_incident(incident):
+    data = {
+        "text": incident["text"],
+        "chat_id": incident["chat_id"],
+        "time": _iso(incident["time"]),
+        "jobs": incident["jobs"],
+        "priority": incident.get("priority", "средний")
+    }
+    reminders = serialize_reminders(incident.get("reminders"))
+    if reminders:
+        data["reminders"] = reminders
+    if incident.get("messages"):
+        data["messages"] = incident["messages"]
+    return data
+
+
+def deserialize_incident(data):
+    data["time"] = _parse_time(data["time"])
+    if "reminders" in data:
+        data["reminders"] = deserialize_reminders(data["reminders"])
+    return data
+
+
+def _read_snapshot(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _replay(path, state, meta):
+    """Применяет записи журнала path к state (сериализованные инциденты) и meta (служебные значения).
+
+    Возвращает (число записей, длина корректной части файла в байтах).
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    applied = 0
+    valid_end = 0
+    with open(path, "rb") as f:
+        for line_no, raw in enumerate(f, 1):
+            try:
+                record = json.loads(raw.decode("utf-8")) if raw.strip() else None
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                record = None
+            if record is None or not raw.endswith(b"\n"):
+                if raw.strip():
+                    # оборванная последняя строка после падения — всё, что дальше, не записано
+                    logger.warning(f"Повреждённая запись журнала {path}:{line_no}, остаток пропущен")
+                    break
+                valid_end += len(raw)
+                continue
+            if record["op"] == "meta":
+                meta[record["key"]] = record["value"]
+            elif record["op"] == "fired":
+                steps = (state.get(record["id"], {}).get("reminders") or {}).get("steps", {})
+                if record["step"] in steps:
+                    steps[record["step"]]["fired"] = True
+            elif record["op"] == "messages":
+                if record["id"] in state:
+                    messages = state[record["id"]].get("messages", []) + record["items"]
+                    state[record["id"]]["messages"] = messages[-MAX_INCIDENT_MESSAGES:]
+            elif OPS.get(record["op"]):
+                state.pop(record["id"], None)
+            else:
+                state[record["id"]] = record["data"]
+            applied += 1
+            valid_end += len(raw)
+    return applied, valid_end
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class IncidentJournal:
+    def __init__(self, snapshot_path, fsync_batch=FSYNC_BATCH, fsync_interval=FSYNC_INTERVAL,
+                 compact_every=COMPACT_EVERY):
+        self.snapshot_path = snapshot_path
+        self.journal_path = os.path.splitext(snapshot_path)[0] + ".journal"
+        self.rotated_path = self.journal_path + ".1"
+        self.meta_path = os.path.splitext(snapshot_path)[0] + ".meta.json"
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.bytes_written = 0
+        self._file = None
+        self._records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._lock = threading.RLock()
+        self._batch_depth = 0
+        self._compactor = None
+        self._meta = None
+
+    def read(self):
+        """Снапшот + проигрывание журнала без открытия журнала на запись."""
+        incidents, valid_end, replayed = self._read()
+        if replayed:
+            logger.info(f"Из журнала восстановлено {replayed} событий поверх снапшота")
+        return incidents, valid_end
+
+    def _read(self):
+        state = _read_snapshot(self.snapshot_path)
+        meta = _read_snapshot(self.meta_path)
+        # незавершённое сжатие: сначала ротированный журнал, потом текущий
+        replayed, _ = _replay(self.rotated_path, state, meta)
+        self._records, valid_end = _replay(self.journal_path, state, meta)
+        replayed += self._records
+        self._meta = meta
+        return {incident_id: deserialize_incident(data) for incident_id, data in state.items()}, valid_end, replayed
+
+    def load(self):
+        """Загружает открытые инциденты и открывает журнал на запись."""
+        incidents, valid_end = self.read()
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        # отрезаем оборванный хвост, чтобы новые записи не склеились с ним
+        if self._file.tell() > valid_end:
+            self._file.truncate(valid_end)
+        if os.path.exists(self.rotated_path):
+            self._start_compaction()
+        return incidents
+
+    def append(self, op, incident_id, incident=None, closed_at=None):
+        """Дописывает одно событие по инциденту; op — один из OPS.
+
+        closed_at принимается для совместимости с SqliteStore: история
+        закрытых инцидентов в журнале не хранится.
+        """
+        if op not in OPS:
+            raise ValueError(f"Неизвестная операция журнала: {op}")
+        record = {"op": op, "id": incident_id}
+        if not OPS[op]:
+            record["data"] = serialize_incident(incident)
+        self._write(record)
+
+    def mark_fired(self, incident_id, step_id, fired_at=None):
+        """Отмечает шаг эскалации как отправленный — после рестарта он не повторится."""
+        self._write({"op": "fired", "id": incident_id, "step": step_id})
+
+    def add_messages(self, incident_id, messages):
+        """Запоминает сообщения инцидента [(chat_id, message_id), ...] для маршрутизации ответов."""
+        self._write({"op": "messages", "id": incident_id, "items": [list(m) for m in messages]})
+
+    def history(self):
+        """Журнал хранит только открытые инциденты — истории закрытых у него нет (см. SqliteStore.history)."""
+        return iter(())
+
+    def get_meta(self, key):
+        if self._meta is None:
+            self._read()
+        return self._meta.get(key)
+
+    def set_meta(self, key, value):
+        """Служебные значения бота (например, last_update_id для догона) — записью журнала, см. _compact."""
+        with self._lock:
+            self._meta[key] = str(value)
+            self._write({"op": "meta", "key": key, "value": str(value)})
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Записи внутри блока — без промежуточных fsync, решение о fsync принимается в конце (см. StoreWriter)."""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._file:
+                    self._maybe_sync()
+
+    def _write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.bytes_written += len(line.encode("utf-8"))
+            self._records += 1
+            self._unsynced += 1
+            if not self._batch_depth:
+                self._maybe_sync()
+            if self._records >= self.compact_every:
+                self._rotate()
+
+    def _maybe_sync(self):
+        if self._unsynced >= self.fsync_batch or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self._sync()
+
+    def flush(self):
+        with self._lock:
+            if self._file and self._unsynced:
+                self._sync()
+
+    def close(self):
+        self.flush()
+        if self._compactor:
+            self._compactor.join()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _rotate(self):
+        # предыдущее сжатие ещё идёт — журнал просто растёт дальше
+        if self._compactor and self._compactor.is_alive():
+            return
+        # прошлое сжатие упало — повторяем его, не затирая ротированный журнал
+        if os.path.exists(self.rotated_path):
+            self._start_compaction()
+            return
+        self._sync()
+        self._file.close()
+        os.replace(self.journal_path, self.rotated_path)
+        self._file = open(self.journal_path, "a", encoding="utf-8")
+        self._records = 0
+        self._start_compaction()
+
+    def _start_compaction(self):
+        self._compactor = threading.Thread(target=self._compact, name="journal-compactor", daemon=True)
+        self._compactor.start()
+
+    def _compact(self):
+        started = time.monotonic()
+        try:
+            state = _read_snapshot(self.snapshot_path)
+            meta = _read_snapshot(self.meta_path)
+            applied, _ = _replay(self.rotated_path, state, meta)
+            # до удаления ротированного журнала: при падении между записями он проиграется ещё раз
+            _write_atomic(self.meta_path, meta)
+            _write_atomic(self.snapshot_path, state)
+            os.remove(self.rotated_path)
+        except Exception as e:
+            logger.error(f"Не удалось сжать журнал инцидентов: {e}")
+            return
+        logger.info(f"Журнал сжат: {applied} событий, {len(state)} открытых инцидентов, "
+                    f"{(time.monotonic() - started) * 1000:.0f} мс")
@@ -0,0 +1,124 @@
+"""Горячий резерв: выбор ведущего экземпляра через аренду в SQLite.
+
+Несколько экземпляров бота на одном хосте (или с общим томом) делят файл
+HA_LEASE_DB. В нём одна строка: кто держит аренду, до какого момента и
+номер срока (term). Работает только держатель аренды: опрашивает Telegram,
+пишет инциденты и шлёт напоминания. Он продлевает аренду каждые ttl/3
+секунд; если продлить не удалось до истечения — он больше не лидер и
+останавливается.
+
+Резервный экземпляр уже запущен (процесс, хранилище, политика, HTTP-клиенты)
+и раз в POLL_INTERVAL пытается взять аренду; состояние лидера он читает из
+хранилища один раз — после захвата. Аренду можно взять, только когда она
+истекла (лидер не продлил её ttl секунд) или отпущена при штатной
+остановке, поэтому переключение занимает не больше ttl + POLL_INTERVAL
+плюс одно чтение хранилища. Отметки об отправленных
+напоминаниях лидер пишет в хранилище, а ключи дедупликации — в outbox,
+поэтому новый лидер не повторяет уже ушедшие напоминания.
+
+Захват — BEGIN IMMEDIATE: проверка и запись одной транзакцией, двое
+одновременно аренду не получат. Время — time.time() (общие часы хоста).
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger("incident_bot")
+
+LEASE_TTL = 10.0  # секунд
+POLL_INTERVAL = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lease (
+    name        TEXT PRIMARY KEY,
+    holder      TEXT NOT NULL,
+    term        INTEGER NOT NULL,              -- растёт при каждой смене держателя
+    expires_ts  REAL NOT NULL,
+    renewed_ts  REAL NOT NULL
+);
+"""
+
+
+class Lease:
+    def __init__(self, path, holder, ttl=LEASE_TTL, name="incident_bot", time_func=time.time):
+        self.path = path
+        self.holder = holder
+        self.ttl = ttl
+        self.name = name
+        self.time_func = time_func
+        self.term = None  # номер нашего срока, пока аренда наша
+        self.expires = 0.0
+        self._conn = sqlite3.connect(path, timeout=ttl / 2, check_same_thread=False, isolation_level=None)
+        self._conn.executescript(SCHEMA)
+
+    def acquire(self):
+        """Берёт или продлевает аренду; True — этот экземпляр лидер до self.expires."""
+        return self._claim(take=True)
+
+    def renew(self):
+        """Продлевает аренду, только если она всё ещё наша (тот же term)."""
+        return self._claim(take=False)
+
+    def _claim(self, take):
+        now = self.time_func()
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._conn.execute("SELECT holder, term, expires_ts FROM lease WHERE name = ?",
+                                     (self.name,)).fetchone()
+            ours = row is not None and row[0] == self.holder and row[1] == self.term
+            if not ours and (not take or (row is not None and row[2] > now)):
+                self._conn.execute("COMMIT")
+                self.term = None
+                return False
+            term = row[1] if ours else (row[1] + 1 if row else 1)
+            self._conn.execute(
+                """INSERT INTO lease(name, holder, term, expires_ts, renewed_ts) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, term = excluded.term,
+                       expires_ts = excluded.expires_ts, renewed_ts = excluded.renewed_ts""",
+                (self.name, self.holder, term, now + self.ttl, now))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        if not ours:
+            logger.info(f"Аренда {self.name}: держатель {self.holder}, срок #{term}")
+        self.term = term
+        self.expires = now + self.ttl
+        return True
+
+    def release(self):
+        """Отпускает аренду при штатной остановке — резерв забирает её сразу, не дожидаясь ttl."""
+        if self.term is None:
+            return
+        self._conn.execute("UPDATE lease SET expires_ts = 0 WHERE name = ? AND holder = ? AND term = ?",
+                           (self.name, self.holder, self.term))
+        self.term = None
+
+    def holder_info(self):
+        """(holder, term, expires_ts) текущего держателя или None."""
+        return self._conn.execute("SELECT holder, term, expires_ts FROM lease WHERE name = ?",
+                                  (self.name,)).fetchone()
+
+    def wait(self, poll_interval=POLL_INTERVAL):
+        """Блокирует до получения аренды."""
+        while not self.acquire():
+            time.sleep(poll_interval)
+
+    async def hold(self, on_lost):
+        """Продлевает аренду каждые ttl/3 секунд; потеряв её, вызывает await on_lost() и завершается."""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                held = await asyncio.to_thread(self.renew)
+            except sqlite3.Error as e:
+                # база занята или недоступна — аренда наша, пока не истекла
+                logger.warning(f"Аренда {self.name}: не удалось продлить: {e}")
+                held = self.time_func() < self.expires
+            if not held:
+                logger.error(f"Аренда {self.name} потеряна экземпляром {self.holder} — останавливаюсь")
+                await on_lost()
+                return
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,117 @@
+"""Логирование без блокировки event loop.
+
+Логгер бота пишет только в QueueHandler — запись кладётся в очередь, а
+форматирование, вывод на диск и в консоль, ротация и сжатие идут в потоке
+QueueListener. Файл ротируется и по размеру (max_bytes), и по времени
+(interval); старые части сжимаются gzip, хранятся последние backups штук.
+
+Форматы:
+- "text" — привычные строки "время [уровень] сообщение";
+- "json" — JSON Lines: ts, level, message и структурные поля из extra
+  (incident_id, kind, chat_id, latency_ms) — для загрузки в системы анализа логов.
+"""
+import datetime
+import glob
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+
+STRUCTURED_FIELDS = ("incident_id", "kind", "chat_id", "latency_ms")
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+MAX_BYTES = 10 * 1024 * 1024
+INTERVAL = 24 * 3600  # секунд
+BACKUPS = 14
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+                  .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+class RotatingLogHandler(logging.handlers.BaseRotatingHandler):
+    """Файл, который ротируется по размеру и по времени: <файл>.<ГГГГММДД-ЧЧММСС>[.N][.gz]."""
+
+    def __init__(self, filename, max_bytes=MAX_BYTES, interval=INTERVAL, backups=BACKUPS, compress=True,
+                 encoding="utf-8"):
+        super().__init__(filename, "a", encoding=encoding)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backups = backups
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = _gzip_rotator
+        # как TimedRotatingFileHandler: отсчёт от последней записи в существующий файл
+        started = os.stat(self.baseFilename).st_mtime if os.path.exists(self.baseFilename) else time.time()
+        self.rollover_at = started + interval if interval else None
+
+    def shouldRollover(self, record):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes and self.stream.tell():
+            return self.stream.tell() + len(self.format(record)) + 1 >= self.max_bytes
+        return False
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename):
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            dest = self.rotation_filename(f"{self.baseFilename}.{stamp}")
+            n = 1
+            while os.path.exists(dest):
+                dest = self.rotation_filename(f"{self.baseFilename}.{stamp}.{n}")
+                n += 1
+            self.rotate(self.baseFilename, dest)
+            self._prune()
+        self.stream = self._open()
+        if self.interval:
+            self.rollover_at = time.time() + self.interval
+
+    def _prune(self):
+        parts = sorted(glob.glob(glob.escape(self.baseFilename) + ".*"), key=os.path.getmtime)
+        for path in parts[:-self.backups] if self.backups else ():
+            os.remove(path)
+
+
+def setup_logging(logger, path, json_lines=False, max_bytes=MAX_BYTES, interval=INTERVAL, backups=BACKUPS,
+                  compress=True, console=True):
+    """Подключает к logger очередь и запускает поток записи; возвращает QueueListener (stop() при выходе)."""
+    formatter = JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    handlers = [RotatingLogHandler(path, max_bytes, interval, backups, compress)]
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,217 @@
+"""Метрики бота в формате Prometheus.
+
+Без внешних зависимостей: счётчики, gauge и гистограммы с метками живут в
+памяти процесса, запись — словарь + bisect по границам корзин, так что их
+можно не выключать в бою. Отдаются двумя путями:
+- HTTP: MetricsServer (aiohttp) на METRICS_PORT, путь /metrics; aiohttp
+  импортируется при запуске сервера, а не вместе с модулем;
+- команда /metrics в боте — короткая сводка (Registry.summary).
+
+Gauge может считаться в момент чтения (collect), например число открытых
+инцидентов по приоритетам.
+"""
+import bisect
+import logging
+
+logger = logging.getLogger("incident_bot")
+
+# секунды: от долей миллисекунды (разбор сообщения) до десятков секунд (RetryAfter)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.001, 0.01, 0.1, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 900.0)
+BYTES_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _key(self, values):
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name}: ожидались метки {self.labels}, получено {values}")
+        return tuple(str(v) for v in values)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(self._values.items())]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        """collect() -> {(значения меток): число} вызывается при каждом чтении."""
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def set(self, value, *labels):
+        self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.collect is not None:
+            self._values = {self._key(k if isinstance(k, tuple) else (k,)): v for k, v in self.collect().items()}
+        return super()._samples()
+
+
+class _HistogramState:
+    __slots__ = ("buckets", "count", "sum")
+
+    def __init__(self, size):
+        self.buckets = [0] * size
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.bounds = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = _HistogramState(len(self.bounds) + 1)
+        # корзины хранятся не накопительно, сумма считается при выводе
+        state.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        state.count += 1
+        state.sum += value
+
+    def quantile(self, q, *labels):
+        """Оценка квантиля сверху — граница корзины, в которую он попал."""
+        state = self._values.get(self._key(labels))
+        if state is None or not state.count:
+            return None
+        rank = q * state.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float("inf"),), state.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def _samples(self):
+        lines = []
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), state.buckets):
+                cumulative += count
+                labels = _format_labels(self.labels, key, (("le", _format_value(bound)),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state.sum)}")
+            lines.append(f"{self.name}_count{labels} {state.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._add(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self._add(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus 0.0.4."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Короткая сводка для чата: счётчики и gauge как есть, гистограммы — число/среднее/p99."""
+        lines = []
+        for metric in self.metrics.values():
+            if isinstance(metric, Histogram):
+                if not metric._values:
+                    continue
+                lines.append(f"{metric.name}:")
+                for key, state in sorted(metric._values.items()):
+                    p99 = metric.quantile(0.99, *key)
+                    label = ",".join(key) or "всего"
+                    lines.append(f"  {label}: {state.count} шт, ср. {state.sum / state.count:.4g}, p99 ≤ {p99:g}")
+            else:
+                samples = metric._samples()
+                if samples:
+                    lines.append(f"{metric.name}:")
+                    lines.extend("  " + sample[len(metric.name):].strip() for sample in samples)
+        return "\n".join(lines) or "Метрик пока нет."
+
+
+class MetricsServer:
+    """GET /metrics на отдельном порту для Prometheus."""
+
+    def __init__(self, registry, listen="127.0.0.1", port=9108, path="/metrics"):
+        self.registry = registry
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+        return web.Response(text=self.registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"Метрики доступны на http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
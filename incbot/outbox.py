@@ -0,0 +1,376 @@
+"""Надёжная очередь исходящих сообщений (outbox).
+
+Каждое исходящее сообщение (рассылки, решения, напоминания, сводки) сначала
+записывается в outbox.db (SQLite, WAL) и только потом отправляется пулом
+обработчиков через Broadcaster. Так сообщение не теряется, если Telegram
+ответил flood-лимитом, сеть пропала или бот перезапустился:
+- порядок сохраняется внутри чата (очередь на каждый chat_id/thread_id),
+  разные чаты отправляются параллельно;
+- временная ошибка — повтор с экспоненциальной паузой, чат ждёт, пока не
+  уйдёт его первое сообщение; постоянная (бот удалён из чата) — failed;
+- dedup_key уникален: повторная постановка того же события (например,
+  при догоне после падения) ничего не отправит второй раз;
+- при остановке очередь дорабатывается (stop), неотправленное остаётся в
+  базе и уходит после следующего старта.
+
+Запись в outbox.db идёт не в event loop, а в потоке StoreWriter (как у
+хранилища инцидентов) с групповым коммитом. Решения, которым нужна база
+(дубль ли ключ, есть ли карточка, id записи), принимаются по её копии в
+памяти, а обработчик не отправляет сообщение, пока его строка не записана.
+
+Карточки статуса (card): первое сообщение с данным ключом карточки в чат
+отправляется, его message_id запоминается в таблице cards, а следующие
+редактируют его (edit_message_text). Несколько ещё не отправленных правок
+одной карточки схлопываются в последнюю.
+"""
+import asyncio
+import collections
+import contextlib
+import logging
+import sqlite3
+import time
+
+from incbot.storage import StoreWriter
+
+logger = logging.getLogger("incident_bot")
+
+WORKERS = 4
+RETRY_BASE = 5.0  # секунд до первого повтора
+RETRY_MAX = 300.0
+MAX_AGE = 24 * 3600  # дольше не пытаемся: сообщение помечается failed
+RETENTION = 24 * 3600  # столько хранятся отправленные — на это время действует dedup_key
+CARD_RETENTION = 7 * 24 * 3600  # карточки, которые столько не менялись, забываются
+CLEANUP_EVERY = 500
+RATE_PERIOD = 60.0
+# ключи дедупликации в памяти живут дольше строк в базе: до отметки failed проходит не больше MAX_AGE
+KEY_RETENTION = RETENTION + MAX_AGE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key   TEXT UNIQUE,
+    chat_id     INTEGER NOT NULL,
+    thread_id   INTEGER,
+    text        TEXT NOT NULL,
+    kind        TEXT NOT NULL,                 -- broadcast / reminder / summary ...
+    incident_id TEXT,
+    status      TEXT NOT NULL DEFAULT 'pending',  -- pending / sent / failed
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    created_ts  REAL NOT NULL,
+    next_ts     REAL NOT NULL,                 -- не раньше этого времени (повторы)
+    done_ts     REAL,
+    message_id  INTEGER,
+    card        TEXT,                          -- ключ карточки статуса: incident_id:chat_id:thread_id
+    edit        INTEGER NOT NULL DEFAULT 0     -- 1 — отредактировать карточку, а не слать новое
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox(status, id);
+CREATE TABLE IF NOT EXISTS cards (
+    card        TEXT PRIMARY KEY,
+    chat_id     INTEGER NOT NULL,
+    message_id  INTEGER NOT NULL,
+    updated_ts  REAL NOT NULL
+);
+"""
+
+INSERT = """INSERT OR IGNORE INTO outbox(id, dedup_key, chat_id, thread_id, text, kind, incident_id, created_ts,
+                                         next_ts, card, edit)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+
+
+class _Entry:
+    __slots__ = ("id", "chat_id", "thread_id", "text", "kind", "incident_id", "attempts", "created", "next_ts",
+                 "card", "edit", "saved")
+
+    def __init__(self, id, chat_id, thread_id, text, kind, incident_id, attempts, created, next_ts,
+                 card=None, edit=False, saved=None):
+        self.id = id
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.text = text
+        self.kind = kind
+        self.incident_id = incident_id
+        self.attempts = attempts
+        self.created = created
+        self.next_ts = next_ts
+        self.card = card
+        self.edit = bool(edit)
+        self.saved = saved  # future записи строки в outbox.db; None — строка уже в базе
+
+
+def _log_fields(entry):
+    """Структурные поля записи лога (см. incbot/logs.py)."""
+    return {"incident_id": entry.incident_id, "kind": entry.kind, "chat_id": entry.chat_id}
+
+
+class Outbox:
+    def __init__(self, path, broadcaster, workers=WORKERS, time_func=time.time):
+        self.path = path
+        self.broadcaster = broadcaster
+        self.workers = workers
+        self.time_func = time_func
+        self.bot = None
+        # вызываются как observer(entry, message) после отправки нового сообщения (не правки)
+        self.sent_observers = []
+        self.stats = collections.Counter()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self.writer = StoreWriter(self)
+        self._inflight = set()
+        self._recent = {}  # chat_id -> deque времён постановки за последние RATE_PERIOD секунд
+        self._queues = {}  # (chat_id, thread_id) -> deque[_Entry]
+        self._scheduled = set()  # чаты, которые стоят в _ready или обрабатываются
+        self._ready = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._tasks = []
+        self._finished = 0
+        self._cleanup()
+        self._load()
+        self._resume()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(outbox)")}
+        if "card" not in columns:
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN card TEXT")
+            self._conn.execute("ALTER TABLE outbox ADD COLUMN edit INTEGER NOT NULL DEFAULT 0")
+
+    def _load(self):
+        # ключ карточки -> message_id (None — первая отправка ещё в очереди)
+        self._cards = dict(self._conn.execute("SELECT card, message_id FROM cards").fetchall())
+        # dedup_key -> время постановки, по возрастанию времени
+        self._keys = dict(self._conn.execute(
+            "SELECT dedup_key, created_ts FROM outbox WHERE dedup_key IS NOT NULL ORDER BY id").fetchall())
+        self._next_id = (self._conn.execute("SELECT MAX(id) FROM outbox").fetchone()[0] or 0) + 1
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Записи внутри блока уходят одной транзакцией (см. StoreWriter)."""
+        self._conn.execute("BEGIN")
+        try:
+            yield
+        finally:
+            self._conn.execute("COMMIT")
+
+    def _resume(self):
+        rows = self._conn.execute(
+            """SELECT id, chat_id, thread_id, text, kind, incident_id, attempts, created_ts, next_ts, card, edit
+               FROM outbox WHERE status = 'pending' ORDER BY id""").fetchall()
+        for row in rows:
+            entry = _Entry(*row)
+            if entry.card and not entry.edit:
+                self._cards.setdefault(entry.card, None)
+            self._push(entry)
+        if rows:
+            logger.info(f"Outbox: к отправке после перезапуска {len(rows)} сообщений")
+
+    def _cleanup(self):
+        now = self.time_func()
+        self._conn.execute("DELETE FROM outbox WHERE status != 'pending' AND done_ts < ?", (now - RETENTION,))
+        self._conn.execute("DELETE FROM cards WHERE updated_ts < ?", (now - CARD_RETENTION,))
+
+    def _forget_keys(self):
+        cutoff = self.time_func() - KEY_RETENTION
+        for key, created in list(self._keys.items()):
+            if created >= cutoff:
+                break
+            del self._keys[key]
+
+    def enqueue(self, destinations, text, kind="message", incident_id=None, key=None, card=None, edit_only=False):
+        """Ставит text в очередь для каждого адресата; возвращает число новых (не дублей) сообщений.
+
+        key — ключ события (например, update_id сообщения, вызвавшего рассылку);
+        dedup_key адресата — key:chat_id:thread_id. card — ключ карточки статуса
+        (обычно incident_id): в чат, где карточка уже есть, уходит правка;
+        с edit_only=True чаты без карточки пропускаются.
+        """
+        now = self.time_func()
+        entries = []
+        rows = []
+        for dest in destinations:
+            chat_id, thread_id = dest["chat_id"], dest.get("thread_id")
+            card_key = f"{card}:{chat_id}:{thread_id}" if card else None
+            edit = card_key in self._cards
+            if card_key and not edit and edit_only:
+                continue
+            if edit and self._coalesce(chat_id, thread_id, card_key, text):
+                continue
+            dedup_key = f"{key}:{chat_id}:{thread_id}" if key else None
+            if dedup_key in self._keys:
+                self.stats["deduplicated"] += 1
+                continue
+            if dedup_key:
+                self._keys[dedup_key] = now
+            entries.append(_Entry(self._next_id, chat_id, thread_id, text, kind, incident_id, 0, now, now,
+                                  card_key, edit))
+            rows.append((self._next_id, dedup_key, chat_id, thread_id, text, kind, incident_id, now, now, card_key,
+                         int(edit)))
+            self._next_id += 1
+            if card_key and not edit:
+                self._cards[card_key] = None
+        if not entries:
+            return 0
+        saved = self.writer.submit(self._conn.executemany, INSERT, rows)
+        for entry in entries:
+            entry.saved = saved
+            self._push(entry)
+            self._recent.setdefault(entry.chat_id, collections.deque()).append(now)
+        return len(entries)
+
+    def rate(self, chat_id):
+        """Сообщений, поставленных в чат за последнюю минуту."""
+        recent = self._recent.get(chat_id)
+        if not recent:
+            return 0.0
+        cutoff = self.time_func() - RATE_PERIOD
+        while recent and recent[0] < cutoff:
+            recent.popleft()
+        return len(recent) * 60.0 / RATE_PERIOD
+
+    def _coalesce(self, chat_id, thread_id, card_key, text):
+        """Заменяет текст ещё не начатой правки той же карточки; True, если такая нашлась."""
+        for entry in reversed(self._queues.get((chat_id, thread_id), ())):
+            if entry.card == card_key and entry.edit and entry.id not in self._inflight:
+                entry.text = text
+                self.writer.submit(self._conn.execute, "UPDATE outbox SET text = ? WHERE id = ?", (text, entry.id))
+                self.stats["coalesced"] += 1
+                return True
+        return False
+
+    def _push(self, entry):
+        chat = (entry.chat_id, entry.thread_id)
+        self._queues.setdefault(chat, collections.deque()).append(entry)
+        self._idle.clear()
+        self._schedule(chat)
+
+    def _schedule(self, chat):
+        if chat not in self._scheduled:
+            self._scheduled.add(chat)
+            self._ready.put_nowait(chat)
+
+    def start(self, bot):
+        """Запускает обработчики в текущем event loop."""
+        self.bot = bot
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(), name=f"outbox-worker-{i}")
+                           for i in range(self.workers)]
+        if not self._queues:
+            self._idle.set()
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            chat = await self._ready.get()
+            queue = self._queues[chat]
+            entry = queue[0]
+            wait = entry.next_ts - self.time_func()
+            if wait > 0:
+                # чат ждёт повтора своего первого сообщения — следующие не обгоняют его
+                loop.call_later(wait, self._ready.put_nowait, chat)
+                continue
+            self._inflight.add(entry.id)
+            try:
+                await self._deliver(entry)
+            except Exception as e:
+                logger.error(f"Outbox: ошибка при отправке {entry.id}: {e}")
+                self._retry(entry)
+            finally:
+                self._inflight.discard(entry.id)
+            if queue:
+                self._ready.put_nowait(chat)
+            else:
+                del self._queues[chat]
+                self._scheduled.discard(chat)
+                if not self._queues:
+                    self._idle.set()
+
+    async def _deliver(self, entry):
+        if entry.saved is not None:
+            try:
+                await entry.saved
+            except Exception as e:
+                # сообщение всё равно отправляется, но после перезапуска его в очереди не будет
+                logger.error(f"Outbox: не удалось записать {entry.id} в {self.path}: {e}", extra=_log_fields(entry))
+            entry.saved = None
+        chat_info = {"chat_id": entry.chat_id, "thread_id": entry.thread_id}
+        edit_id = self._cards.get(entry.card) if entry.edit else None
+        message, permanent = await self.broadcaster.deliver(self.bot, chat_info, entry.text, edit_message_id=edit_id)
+        if message is None and permanent and edit_id is not None:
+            # карточку удалили или её уже нельзя редактировать — присылаем новую
+            logger.warning(f"Outbox: карточка {entry.card} не редактируется, отправляю заново")
+            edit_id = None
+            message, permanent = await self.broadcaster.deliver(self.bot, chat_info, entry.text)
+        if message is not None:
+            message_id = getattr(message, "message_id", edit_id)
+            self._finish(entry, "sent", message_id)
+            if entry.card:
+                self._remember_card(entry, message_id)
+            if edit_id is not None:
+                self.stats["edited"] += 1
+                return
+            self.stats["sent"] += 1
+            self.stats[f"sent:{entry.kind}"] += 1
+            for observer in self.sent_observers:
+                try:
+                    observer(entry, message)
+                except Exception as e:
+                    logger.error(f"Outbox: ошибка обработчика отправки {entry.id}: {e}")
+        elif permanent or self.time_func() - entry.created > MAX_AGE:
+            self._finish(entry, "failed")
+            self.stats["failed"] += 1
+            logger.error(f"Outbox: сообщение {entry.id} ({entry.kind}) в {entry.chat_id} не доставлено "
+                         f"после {entry.attempts + 1} попыток", extra=_log_fields(entry))
+        else:
+            self._retry(entry)
+
+    def _remember_card(self, entry, message_id):
+        self._cards[entry.card] = message_id
+        self.writer.submit(self._conn.execute,
+                           "INSERT OR REPLACE INTO cards(card, chat_id, message_id, updated_ts) VALUES (?, ?, ?, ?)",
+                           (entry.card, entry.chat_id, message_id, self.time_func()))
+
+    def _retry(self, entry):
+        entry.attempts += 1
+        entry.next_ts = self.time_func() + min(RETRY_BASE * 2 ** (entry.attempts - 1), RETRY_MAX)
+        self.stats["retried"] += 1
+        self.writer.submit(self._conn.execute, "UPDATE outbox SET attempts = ?, next_ts = ? WHERE id = ?",
+                           (entry.attempts, entry.next_ts, entry.id))
+        logger.warning(f"Outbox: повтор сообщения {entry.id} в {entry.chat_id} "
+                       f"через {entry.next_ts - self.time_func():.0f} с (попытка {entry.attempts})",
+                       extra=_log_fields(entry))
+
+    def _finish(self, entry, status, message_id=None):
+        self._queues[(entry.chat_id, entry.thread_id)].popleft()
+        self.writer.submit(self._conn.execute,
+                           "UPDATE outbox SET status = ?, done_ts = ?, message_id = ?, attempts = ? WHERE id = ?",
+                           (status, self.time_func(), message_id, entry.attempts + 1, entry.id))
+        self._finished += 1
+        if self._finished % CLEANUP_EVERY == 0:
+            self.writer.submit(self._cleanup)
+            self._forget_keys()
+
+    async def join(self, timeout=None):
+        """Ждёт, пока очередь опустеет; False, если не успела за timeout."""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def stop(self, timeout=10):
+        """Дорабатывает очередь (не дольше timeout) и останавливает обработчики."""
+        if self._tasks and not await self.join(timeout):
+            logger.warning(f"Outbox: при остановке не отправлено {len(self)} сообщений, уйдут после старта")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+        self._conn.close()
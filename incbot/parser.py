@@ -0,0 +1,166 @@
+"""Разбор сообщений об инцидентах.
+
+Все выражения и списки слов скомпилированы один раз при импорте, текст
+приводится к нижнему регистру один раз на сообщение. Сначала сообщение
+проходит через RELEVANT_RE — одну альтернацию литеральных корней: если ни
+одного нет, это шум, и разбор на этом заканчивается (около микросекунды на
+короткое сообщение). Для остальных вид определяется по тем же правилам,
+что и раньше в handle_message, а ключ, название, приоритет и время
+извлекаются только те, что нужны этому виду. Результат — ParsedMessage.
+
+Одна большая регулярка с именованными группами (или Aho–Corasick на чистом
+Python) в CPython оказалась в разы медленнее: см. bench/bench_parser.py.
+"""
+import datetime
+import re
+from dataclasses import dataclass
+
+# Виды сообщений, в порядке, в котором их проверяет handle_message
+NEW = "new"
+RESOLUTION = "resolution"
+REJECTION = "rejection"
+PRIORITY = "priority"
+JIRA_UPDATE = "jira_update"
+NOISE = "noise"
+
+# Порядок важен: при нескольких словах побеждает первое по этому списку
+PRIORITY_WORDS = ("высокий", "критичный", "средний", "низкий")
+PRIORITY_NUMBERS = {"1": "критичный", "2": "высокий", "3": "средний", "4": "низкий", "5": "низкий"}
+RESOLUTION_WORDS = ("заработал", "устранено", "устранен", "устранён", "решено", "решён", "решен",
+                    "локализован", "восстановлен", "включили в", "стабилизировалось")
+REJECTION_WORDS = ("отклонен", "отклонён")
+# Сравниваются с исходным текстом с учётом регистра, как раньше
+PRIORITY_PHRASES = ("поднят до", "повышен до", "понижен до", "снижен до", "поднят на", "Приоритет:")
+RAISE_VERBS = ("поднят", "повышен")
+LOWER_VERBS = ("понижен", "снижен")
+
+
+def _alternation(words):
+    # длинные слова первыми, чтобы «устранено» не сматчилось как «устранен»
+    return "|".join(re.escape(w) for w in sorted(words, key=len, reverse=True))
+
+
+# Без хотя бы одного из этих корней (в нижнем регистре) сообщение — шум
+RELEVANT_RE = re.compile(_alternation(
+    ("itsmjira-", "инцидент:") + RESOLUTION_WORDS + REJECTION_WORDS
+    + tuple(p.lower() for p in PRIORITY_PHRASES)
+))
+RESOLUTION_RE = re.compile(_alternation(RESOLUTION_WORDS))
+REJECTION_RE = re.compile(_alternation(REJECTION_WORDS))
+PRIORITY_PHRASE_RE = re.compile(_alternation(PRIORITY_PHRASES))
+JIRA_PATTERN = re.compile(r'ITSMJIRA-\d+')
+NAME_RE = re.compile(r'Инцидент:\s*(.+?)(\n|$)')
+PRIORITY_NUMBER_RE = re.compile(r'(?:Приоритет[:\s]\s*|до\s+)(\d+)')
+TIME_RE = re.compile(r'\b(?:в\s*)?(\d{1,2}:\d{2})\b')
+DETECTION_RE = re.compile(r'Время выявления:\s*(?:(\d{2}\.\d{2}\.\d{4})\s+)?(\d{1,2}:\d{2})')
+
+
+@dataclass(frozen=True)
+class ParsedMessage:
+    kind: str
+    jira_key: str | None = None
+    incident_name: str | None = None
+    priority: str | None = None
+    # повышен / понижен / изменён — для сообщений о смене приоритета
+    action: str | None = None
+    detection_time: datetime.datetime | None = None
+    # первое время ЧЧ:ММ в тексте (время решения или нового отсчёта)
+    event_time: datetime.datetime | None = None
+
+
+NOISE_MESSAGE = ParsedMessage(NOISE)
+
+
+def _clock_before(clock, message_time):
+    """ЧЧ:ММ в тот же день, что message_time, но не позже него."""
+    try:
+        hour, minute = map(int, clock.split(':'))
+        result = message_time.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    except (ValueError, IndexError):
+        return None
+    if result > message_time:
+        result -= datetime.timedelta(days=1)
+    return result
+
+
+def _priority(text, low):
+    for word in PRIORITY_WORDS:
+        if word in low:
+            return word
+    # Ищем цифру приоритета: "Приоритет: 3", "поднят до 3", "понижен до 3 (Средний)" и т.д.
+    match = PRIORITY_NUMBER_RE.search(text)
+    return PRIORITY_NUMBERS.get(match.group(1)) if match else None
+
+
+def _action(text):
+    if any(verb in text for verb in RAISE_VERBS):
+        return "повышен"
+    if any(verb in text for verb in LOWER_VERBS):
+        return "понижен"
+    return "изменён"
+
+
+def parse_message(text, message_time, is_reply=False):
+    """Классифицирует сообщение и извлекает всё, что нужно handle_message."""
+    low = text.lower()
+    if not RELEVANT_RE.search(low):
+        return NOISE_MESSAGE
+
+    jira = JIRA_PATTERN.search(text)
+    jira_key = jira.group(0) if jira else None
+    if jira_key and "Инцидент:" in text and "Приоритет:" in text:
+        return ParsedMessage(NEW, jira_key, extract_key(text), _priority(text, low),
+                             detection_time=extract_detection_time(text, message_time))
+    if is_reply and RESOLUTION_RE.search(low):
+        return ParsedMessage(RESOLUTION, jira_key, event_time=extract_time_from_text(text, message_time))
+    if is_reply and REJECTION_RE.search(low):
+        return ParsedMessage(REJECTION, jira_key)
+    if PRIORITY_PHRASE_RE.search(text):
+        return ParsedMessage(PRIORITY, jira_key, priority=_priority(text, low), action=_action(text),
+                             event_time=extract_time_from_text(text, message_time))
+    if jira_key:
+        return ParsedMessage(JIRA_UPDATE, jira_key)
+    return NOISE_MESSAGE
+
+
+def extract_key(text):
+    match = NAME_RE.search(text)
+    return match.group(1).strip() if match else None
+
+
+def extract_jira_key(text):
+    match = JIRA_PATTERN.search(text)
+    return match.group(0) if match else None
+
+
+def get_priority(text):
+    """Определяет приоритет по ключевым словам или цифрам."""
+    return _priority(text, text.lower())
+
+
+def extract_time_from_text(text, message_time):
+    """Извлекает время из текста сообщения."""
+    match = TIME_RE.search(text)
+    return _clock_before(match.group(1), message_time) if match else None
+
+
+def extract_resolution_time(text, message_time):
+    return extract_time_from_text(text, message_time) or message_time
+
+
+def extract_detection_time(text, message_time):
+    """Извлекает время выявления из текста инцидента."""
+    # "Время выявления: ДД.ММ.ГГГГ ЧЧ:ММ" или просто "Время выявления: ЧЧ:ММ"
+    match = DETECTION_RE.search(text)
+    if not match:
+        return message_time
+    date_str, time_str = match.groups()
+    if date_str:
+        try:
+            day, month, year = map(int, date_str.split('.'))
+            hour, minute = map(int, time_str.split(':'))
+            return datetime.datetime(year, month, day, hour, minute, 0, 0, tzinfo=message_time.tzinfo)
+        except (ValueError, IndexError):
+            # несуществующая дата (31.02) — время сообщения, а не сегодняшние ЧЧ:ММ
+            return message_time
+    return _clock_before(time_str, message_time) or message_time
@@ -0,0 +1,421 @@
+"""Хранилища инцидентов.
+
+Оба бэкенда дают одинаковый интерфейс для бота (load/append/batch/flush/close):
+- "json"   — IncidentJournal (журнал + снапшот incidents.json);
+- "sqlite" — SqliteStore: WAL, индексы и история закрытых инцидентов.
+
+StoreWriter выносит записи из event loop в отдельный поток и коммитит их пачками.
+"""
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from incbot.journal import MAX_INCIDENT_MESSAGES, OPS, IncidentJournal, serialize_incident
+
+logger = logging.getLogger("incident_bot")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS incidents (
+    incident_id     TEXT PRIMARY KEY,          -- JIRA-ключ
+    text            TEXT NOT NULL,
+    chat_id         INTEGER NOT NULL,
+    priority        TEXT NOT NULL,
+    status          TEXT NOT NULL DEFAULT 'open',  -- open / resolved / rejected
+    detected_at     TEXT NOT NULL,             -- ISO со смещением, как в incidents.json
+    detected_ts     REAL NOT NULL,             -- то же в epoch, для диапазонных запросов
+    jobs            TEXT NOT NULL DEFAULT '[]',
+    closed_at       TEXT,
+    closed_ts       REAL,
+    time_to_resolve REAL                       -- секунды от выявления до закрытия
+);
+CREATE INDEX IF NOT EXISTS idx_incidents_chat ON incidents(chat_id);
+CREATE INDEX IF NOT EXISTS idx_incidents_status_priority ON incidents(status, priority);
+DROP INDEX IF EXISTS idx_incidents_priority;     -- покрывается idx_incidents_status_priority
+CREATE INDEX IF NOT EXISTS idx_incidents_detected ON incidents(detected_ts);
+CREATE TABLE IF NOT EXISTS closed_incidents (   -- прежние закрытия ключа, который открыли заново
+    incident_id     TEXT NOT NULL,
+    text            TEXT NOT NULL,
+    chat_id         INTEGER NOT NULL,
+    priority        TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    detected_at     TEXT NOT NULL,
+    detected_ts     REAL NOT NULL,
+    jobs            TEXT NOT NULL,
+    closed_at       TEXT,
+    closed_ts       REAL,
+    time_to_resolve REAL
+);
+CREATE INDEX IF NOT EXISTS idx_closed_incidents_id ON closed_incidents(incident_id);
+CREATE INDEX IF NOT EXISTS idx_closed_incidents_detected ON closed_incidents(detected_ts);
+CREATE TABLE IF NOT EXISTS reminders (
+    incident_id TEXT NOT NULL,
+    step        TEXT NOT NULL,
+    start_at    TEXT NOT NULL,                 -- от какого момента считается лестница
+    due_at      TEXT NOT NULL,
+    due_ts      REAL NOT NULL,
+    fired       INTEGER NOT NULL DEFAULT 0,
+    fired_ts    REAL,
+    PRIMARY KEY (incident_id, step)
+);
+CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders(fired, due_ts);
+CREATE TABLE IF NOT EXISTS messages (            -- сообщения инцидента, на которые могут ответить
+    chat_id     INTEGER NOT NULL,
+    message_id  INTEGER NOT NULL,
+    incident_id TEXT NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_incident ON messages(incident_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+CLOSE_STATUS = {"resolve": "resolved", "reject": "rejected"}
+
+INCIDENT_COLUMNS = ("incident_id, text, chat_id, priority, status, detected_at, detected_ts, jobs, "
+                    "closed_at, closed_ts, time_to_resolve")
+# incidents вместе с архивом прежних закрытий — для истории и диапазонных запросов
+ALL_INCIDENTS = f"(SELECT {INCIDENT_COLUMNS} FROM incidents UNION ALL SELECT {INCIDENT_COLUMNS} FROM closed_incidents)"
+
+WRITE_BATCH = 256  # максимум записей StoreWriter в одной транзакции
+
+
+def _row_to_incident(row):
+    incident = dict(row)
+    incident["time"] = datetime.datetime.fromisoformat(incident.pop("detected_at"))
+    incident["jobs"] = json.loads(incident["jobs"])
+    if incident["closed_at"]:
+        incident["closed_at"] = datetime.datetime.fromisoformat(incident["closed_at"])
+    return incident
+
+
+class SqliteStore:
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self.json_path = json_path
+        self.bytes_written = 0
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def load(self):
+        """Возвращает открытые инциденты; при первом запуске переносит incidents.json."""
+        self._migrate_json()
+        return self.snapshot()
+
+    def snapshot(self):
+        """Открытые инциденты с напоминаниями и сообщениями, только чтение."""
+        incidents = {incident["incident_id"]: incident for incident in self.open_incidents()}
+        rows = self._conn.execute(
+            """SELECT r.* FROM reminders r JOIN incidents i ON i.incident_id = r.incident_id
+               WHERE i.status = 'open'""")
+        for row in rows:
+            reminders = incidents[row["incident_id"]].setdefault(
+                "reminders", {"start": datetime.datetime.fromisoformat(row["start_at"]), "steps": {}})
+            reminders["steps"][row["step"]] = {"due": datetime.datetime.fromisoformat(row["due_at"]),
+                                               "fired": bool(row["fired"])}
+        rows = self._conn.execute(
+            """SELECT m.* FROM messages m JOIN incidents i ON i.incident_id = m.incident_id
+               WHERE i.status = 'open' ORDER BY m.rowid""")
+        for row in rows:
+            incidents[row["incident_id"]].setdefault("messages", []).append([row["chat_id"], row["message_id"]])
+        return incidents
+
+    def _migrate_json(self):
+        if not self.json_path or self._meta("json_migrated"):
+            return
+        data, _ = IncidentJournal(self.json_path).read()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            for incident_id, incident in data.items():
+                self._upsert_incident(incident_id, incident)
+                self._replace_reminders(incident_id, incident.get("reminders"))
+                self._insert_messages(incident_id, incident.get("messages") or ())
+            self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('json_migrated', ?)",
+                               (datetime.datetime.now(datetime.timezone.utc).isoformat(),))
+            self._conn.execute("COMMIT")
+        logger.info(f"Перенесено {len(data)} инцидентов из {self.json_path} в {self.path}")
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def get_meta(self, key):
+        return self._meta(key)
+
+    def set_meta(self, key, value):
+        """Служебные значения бота (например, last_update_id для догона)."""
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES (?, ?)", (key, str(value)))
+
+    @contextlib.contextmanager
+    def _atomic(self):
+        # SAVEPOINT вне транзакции начинает её, внутри batch() — вкладывается в общую
+        self._conn.execute("SAVEPOINT write")
+        try:
+            yield
+        except Exception:
+            self._conn.execute("ROLLBACK TO write")
+            self._conn.execute("RELEASE write")
+            raise
+        self._conn.execute("RELEASE write")
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Записи внутри блока уходят одной транзакцией — один коммит на пачку (см. StoreWriter)."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                yield
+            finally:
+                self._conn.execute("COMMIT")
+
+    def _upsert(self, incident_id, incident):
+        with self._atomic():
+            self._upsert_incident(incident_id, incident)
+            self._replace_reminders(incident_id, incident.get("reminders"))
+
+    def _replace_reminders(self, incident_id, reminders):
+        self._conn.execute("DELETE FROM reminders WHERE incident_id = ?", (incident_id,))
+        if not reminders:
+            return
+        start_at = reminders["start"].isoformat()
+        self._conn.executemany(
+            "INSERT INTO reminders(incident_id, step, start_at, due_at, due_ts, fired) VALUES (?, ?, ?, ?, ?, ?)",
+            [(incident_id, step_id, start_at, step["due"].isoformat(), step["due"].timestamp(), int(step["fired"]))
+             for step_id, step in reminders["steps"].items()],
+        )
+        self.bytes_written += 64 * len(reminders["steps"])
+
+    def _insert_messages(self, incident_id, messages):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO messages(chat_id, message_id, incident_id) VALUES (?, ?, ?)",
+            [(chat_id, message_id, incident_id) for chat_id, message_id in messages],
+        )
+        self._conn.execute(
+            """DELETE FROM messages WHERE incident_id = ? AND rowid NOT IN (
+                   SELECT rowid FROM messages WHERE incident_id = ? ORDER BY rowid DESC LIMIT ?)""",
+            (incident_id, incident_id, MAX_INCIDENT_MESSAGES),
+        )
+        self.bytes_written += 32 * len(messages)
+
+    def _upsert_incident(self, incident_id, incident):
+        data = serialize_incident(incident)
+        jobs = json.dumps(data["jobs"], ensure_ascii=False)
+        self.bytes_written += len(data["text"].encode("utf-8")) + len(jobs)
+        # закрытый инцидент, ключ которого прислали снова, уходит в архив, а не перезаписывается
+        self._conn.execute(
+            f"""INSERT INTO closed_incidents({INCIDENT_COLUMNS})
+                SELECT {INCIDENT_COLUMNS} FROM incidents WHERE incident_id = ? AND status != 'open'""",
+            (incident_id,),
+        )
+        self._conn.execute(
+            """INSERT INTO incidents(incident_id, text, chat_id, priority, status, detected_at, detected_ts, jobs)
+               VALUES (?, ?, ?, ?, 'open', ?, ?, ?)
+               ON CONFLICT(incident_id) DO UPDATE SET
+                   text = excluded.text, chat_id = excluded.chat_id, priority = excluded.priority,
+                   status = 'open', detected_at = excluded.detected_at, detected_ts = excluded.detected_ts,
+                   jobs = excluded.jobs, closed_at = NULL, closed_ts = NULL, time_to_resolve = NULL""",
+            (incident_id, data["text"], data["chat_id"], data["priority"], data["time"],
+             incident["time"].timestamp(), jobs),
+        )
+
+    def append(self, op, incident_id, incident=None, closed_at=None):
+        """Записывает событие по инциденту; для resolve/reject сохраняет время закрытия."""
+        if op not in OPS:
+            raise ValueError(f"Неизвестная операция хранилища: {op}")
+        with self._lock:
+            if not OPS[op]:
+                self._upsert(incident_id, incident)
+                return
+            closed_at = closed_at or datetime.datetime.now(datetime.timezone.utc)
+            self._conn.execute(
+                """UPDATE incidents SET status = ?, closed_at = ?, closed_ts = ?,
+                       time_to_resolve = MAX(? - detected_ts, 0)
+                   WHERE incident_id = ?""",
+                (CLOSE_STATUS[op], closed_at.isoformat(), closed_at.timestamp(), closed_at.timestamp(),
+                 incident_id),
+            )
+            # на закрытый инцидент ответы уже не маршрутизируются
+            self._conn.execute("DELETE FROM messages WHERE incident_id = ?", (incident_id,))
+            self.bytes_written += len(incident_id) + 64
+
+    def mark_fired(self, incident_id, step_id, fired_at=None):
+        """Отмечает шаг эскалации как отправленный — после рестарта он не повторится."""
+        fired_at = fired_at or datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            self._conn.execute("UPDATE reminders SET fired = 1, fired_ts = ? WHERE incident_id = ? AND step = ?",
+                               (fired_at.timestamp(), incident_id, step_id))
+            self.bytes_written += len(incident_id) + len(step_id) + 16
+
+    def add_messages(self, incident_id, messages):
+        """Запоминает сообщения инцидента [(chat_id, message_id), ...] для маршрутизации ответов."""
+        with self._lock, self._atomic():
+            self._insert_messages(incident_id, messages)
+
+    def get(self, incident_id):
+        """Инцидент по JIRA-ключу (поиск по первичному ключу) или None."""
+        row = self._conn.execute("SELECT * FROM incidents WHERE incident_id = ?", (incident_id,)).fetchone()
+        return _row_to_incident(row) if row else None
+
+    def open_incidents(self, priority=None):
+        """Открытые инциденты, опционально одного приоритета (например, все открытые критичные)."""
+        if priority:
+            rows = self._conn.execute(
+                "SELECT * FROM incidents WHERE status = 'open' AND priority = ? ORDER BY detected_ts", (priority,))
+        else:
+            rows = self._conn.execute("SELECT * FROM incidents WHERE status = 'open' ORDER BY detected_ts")
+        return [_row_to_incident(row) for row in rows]
+
+    def incidents_since(self, since, until=None, status=None):
+        """Инциденты, выявленные в [since, until), например за последние 24 часа (индекс по detected_ts).
+
+        Включает прежние закрытия ключей, открытых заново (closed_incidents).
+        """
+        query = f"SELECT * FROM {ALL_INCIDENTS} WHERE detected_ts >= ?"
+        params = [since.timestamp()]
+        if until:
+            query += " AND detected_ts < ?"
+            params.append(until.timestamp())
+        if status:
+            query += " AND status = ?"
+            params.append(status)
+        rows = self._conn.execute(query + " ORDER BY detected_ts", params)
+        return [_row_to_incident(row) for row in rows]
+
+    def by_chat(self, chat_id, status="open"):
+        """Инциденты чата в заданном статусе (индекс по chat_id)."""
+        rows = self._conn.execute(
+            "SELECT * FROM incidents WHERE chat_id = ? AND status = ? ORDER BY detected_ts", (chat_id, status))
+        return [_row_to_incident(row) for row in rows]
+
+    def history(self):
+        """Все инциденты по порядку выявления: (priority, status, detected_at, closed_at), строки читаются по одной.
+
+        Повторно открытый ключ даёт по строке на каждое закрытие из closed_incidents.
+        """
+        rows = self._conn.execute(
+            f"SELECT priority, status, detected_at, closed_at FROM {ALL_INCIDENTS} ORDER BY detected_ts")
+        for row in rows:
+            closed_at = datetime.datetime.fromisoformat(row["closed_at"]) if row["closed_at"] else None
+            yield row["priority"], row["status"], datetime.datetime.fromisoformat(row["detected_at"]), closed_at
+
+    def flush(self):
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class StoreWriter:
+    """Записи в хранилище в одном фоновом потоке, с групповым коммитом.
+
+    Обработчик не держит event loop, пока пишется диск, — в это время
+    обрабатываются обновления других инцидентов. Всё, что накопилось в
+    очереди, пока шла предыдущая запись, уходит одной транзакцией
+    (store.batch), поэтому чем больше инцидентов пишется одновременно, тем
+    больше записей приходится на один коммит. Поток один: записи попадают
+    в хранилище в порядке постановки, как при синхронной записи. Future
+    завершается после коммита. Вне event loop (восстановление при старте)
+    запись выполняется сразу.
+    """
+
+    def __init__(self, store, max_batch=WRITE_BATCH):
+        self.store = store
+        self.max_batch = max_batch
+        self.stats = {"writes": 0, "batches": 0}
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+
+    def submit(self, func, *args):
+        """Ставит func(*args) в очередь записи; возвращает future с результатом."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(func(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="store-writer", daemon=True)
+            self._thread.start()
+        future = loop.create_future()
+        self._queue.put((loop, future, func, args))
+        return future
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            jobs = [job]
+            while len(jobs) < self.max_batch:
+                try:
+                    job = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._queue.put(None)  # остановка — после этой пачки
+                    break
+                jobs.append(job)
+            results = []
+            try:
+                with self.store.batch():
+                    for _, _, func, args in jobs:
+                        try:
+                            results.append((True, func(*args)))
+                        except Exception as e:
+                            results.append((False, e))
+            except Exception as e:
+                logger.error(f"Не удалось записать пачку из {len(jobs)} событий: {e}")
+                results = [(False, e)] * len(jobs)
+            self.stats["writes"] += len(jobs)
+            self.stats["batches"] += 1
+            for (loop, future, _, _), (ok, value) in zip(jobs, results):
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, ok, value)
+                except RuntimeError:
+                    pass  # event loop уже закрыт — результат никто не ждёт
+
+    async def drain(self):
+        """Дожидается всех поставленных записей."""
+        await self.submit(lambda: None)
+
+    def close(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+def _resolve(future, ok, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+def open_store(backend, json_path, db_path):
+    """Создаёт хранилище по имени бэкенда ("sqlite" или "json")."""
+    if backend == "json":
+        return IncidentJournal(json_path)
+    if backend == "sqlite":
+        return SqliteStore(db_path, json_path=json_path if os.path.exists(json_path) else None)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {backend}")
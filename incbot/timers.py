@@ -0,0 +1,200 @@
+"""Таймеры напоминаний внутри event loop бота.
+
+Куча (heapq) с ленивым удалением: schedule — O(log n), cancel — O(1)
+(запись помечается и выбрасывается, когда доходит до вершины кучи),
+cancel_tag снимает все таймеры инцидента разом. Один asyncio-таск спит до
+ближайшего срока и просыпается раньше, если поставлен более ранний таймер.
+
+Для каждого срабатывания считается задержка планировщика (lag):
+фактическое время запуска минус плановое.
+"""
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger("incident_bot")
+
+MISFIRE_GRACE = 3600  # секунд: таймер, опоздавший сильнее, не запускается
+
+
+class _Timer:
+    __slots__ = ("due", "seq", "key", "tag", "callback", "args", "cancelled")
+
+    def __init__(self, due, seq, key, tag, callback, args):
+        self.due = due
+        self.seq = seq
+        self.key = key
+        self.tag = tag
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+class TimerEngine:
+    def __init__(self, time_func=time.time, misfire_grace=MISFIRE_GRACE):
+        self.time_func = time_func
+        self.misfire_grace = misfire_grace
+        self._heap = []
+        self._timers = {}  # key -> _Timer
+        self._tags = {}  # tag -> {key, ...}
+        self._seq = itertools.count()
+        self._stale = 0
+        self._wakeup = None
+        self._task = None
+        self._running = set()
+        # lag в секундах
+        self.lag = {"count": 0, "last": 0.0, "max": 0.0, "total": 0.0}
+        self.lag_observers = []
+
+    def __len__(self):
+        return len(self._timers)
+
+    def __contains__(self, key):
+        return key in self._timers
+
+    def schedule(self, key, due, callback, *args, tag=None):
+        """Ставит callback(*args) (корутину) на время due; таймер с тем же key заменяется."""
+        if isinstance(due, datetime.datetime):
+            due = due.timestamp()
+        self.cancel(key)
+        timer = _Timer(due, next(self._seq), key, tag, callback, args)
+        self._timers[key] = timer
+        if tag is not None:
+            self._tags.setdefault(tag, set()).add(key)
+        heapq.heappush(self._heap, timer)
+        if self._wakeup is not None and self._heap[0] is timer:
+            self._wakeup.set()
+        return key
+
+    def cancel(self, key):
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        timer.cancelled = True
+        self._stale += 1
+        if timer.tag is not None:
+            keys = self._tags.get(timer.tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[timer.tag]
+        self._maybe_compact()
+        return True
+
+    def cancel_tag(self, tag):
+        """Снимает все таймеры с данным tag (например, все напоминания инцидента)."""
+        keys = self._tags.pop(tag, ())
+        for key in keys:
+            timer = self._timers.pop(key)
+            timer.cancelled = True
+            self._stale += 1
+        self._maybe_compact()
+        return len(keys)
+
+    def keys_for(self, tag):
+        return sorted(self._tags.get(tag, ()))
+
+    def next_due(self):
+        self._drop_cancelled()
+        return self._heap[0].due if self._heap else None
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0].cancelled:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+
+    def _maybe_compact(self):
+        # отменённых больше половины — перестраиваем кучу, чтобы она не росла
+        if self._stale > 64 and self._stale * 2 > len(self._heap):
+            self._heap = [t for t in self._heap if not t.cancelled]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def fire_due(self, now=None):
+        """Запускает все таймеры со сроком <= now; возвращает число запущенных."""
+        now = self.time_func() if now is None else now
+        fired = 0
+        while True:
+            self._drop_cancelled()
+            if not self._heap or self._heap[0].due > now:
+                return fired
+            timer = heapq.heappop(self._heap)
+            del self._timers[timer.key]
+            if timer.tag is not None:
+                keys = self._tags.get(timer.tag)
+                if keys is not None:
+                    keys.discard(timer.key)
+                    if not keys:
+                        del self._tags[timer.tag]
+            lag = now - timer.due
+            self._record_lag(lag)
+            if lag > self.misfire_grace:
+                logger.warning(f"Таймер {timer.key} пропущен: опоздание {lag:.0f} с")
+                continue
+            task = asyncio.ensure_future(self._invoke(timer))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+            fired += 1
+
+    async def advance(self, now):
+        """Для виртуальных часов: запускает всё, что созрело к now, и дожидается окончания."""
+        fired = 0
+        while True:
+            batch = self.fire_due(now)
+            if not batch:
+                break
+            fired += batch
+            # колбэки могли поставить новые таймеры на уже прошедшее время
+            await asyncio.gather(*self._running, return_exceptions=True)
+        return fired
+
+    async def _invoke(self, timer):
+        try:
+            await timer.callback(*timer.args)
+        except Exception as e:
+            logger.error(f"Ошибка в таймере {timer.key}: {e}")
+
+    def _record_lag(self, lag):
+        lag = max(lag, 0.0)
+        self.lag["count"] += 1
+        self.lag["last"] = lag
+        self.lag["max"] = max(self.lag["max"], lag)
+        self.lag["total"] += lag
+        for observer in self.lag_observers:
+            observer(lag)
+
+    def start(self):
+        """Запускает обработку таймеров в текущем event loop."""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run(), name="timer-engine")
+            logger.info(f"Планировщик напоминаний запущен, таймеров: {len(self._timers)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._wakeup = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self.fire_due()
+            due = self.next_due()
+            timeout = None if due is None else max(due - self.time_func(), 0)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,88 @@
+"""HTTP-транспорты Bot API с отдельными пулами соединений.
+
+Без настройки PTB ходит в Telegram через объекты запросов по умолчанию, и
+рассылки, напоминания и ответы обработчиков борются за соединения с
+long polling. Здесь два независимых PooledRequest:
+- "updates" — getUpdates: одно-два соединения, длинный read timeout;
+- "send" — все отправки и правки: пул на пачку рассылки (GLOBAL_BURST в
+  incbot/fanout.py), соединения держатся открытыми keepalive секунд, чтобы
+  следующая пачка не платила за TCP и TLS заново.
+
+У каждого свои размер пула, keep-alive, таймауты и версия HTTP. HTTP/2
+включается только при установленном пакете h2 (python-telegram-bot[http2]),
+иначе остаётся HTTP/1.1 с предупреждением в логе.
+
+Счётчики (stats) для метрик:
+- requests, new_connections, reused — сколько запросов, сколько из них
+  открыли новое соединение и сколько ушли по уже открытому;
+- pool_waits — запросы, пришедшие при занятом пуле (ждали соединения),
+  pool_timeouts — не дождавшиеся его за pool_timeout;
+- время ожидания соединения отдаётся wait_observers(name, seconds, reused).
+Момент получения соединения берётся из trace-событий httpcore: первое
+событие запроса приходит, когда соединение уже выдано пулом.
+"""
+import importlib.util
+import logging
+import time
+
+import httpx
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger("incident_bot")
+
+KEEPALIVE_EXPIRY = 30.0  # секунд простоя, после которых соединение закрывается
+
+
+class PooledRequest(HTTPXRequest):
+    def __init__(self, name, pool_size=1, keepalive=KEEPALIVE_EXPIRY, read_timeout=5.0, write_timeout=5.0,
+                 connect_timeout=5.0, pool_timeout=1.0, http2=False):
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning(f"Транспорт {name}: HTTP/2 недоступен (нет пакета h2), работаю по HTTP/1.1")
+            http2 = False
+        self.name = name
+        self.pool_size = pool_size
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                                   keepalive_expiry=keepalive)
+        self.in_flight = 0
+        self.stats = {"requests": 0, "new_connections": 0, "reused": 0, "pool_waits": 0, "pool_timeouts": 0}
+        # вызываются как observer(name, seconds, reused) после получения соединения
+        self.wait_observers = []
+        super().__init__(connection_pool_size=pool_size, read_timeout=read_timeout, write_timeout=write_timeout,
+                         connect_timeout=connect_timeout, pool_timeout=pool_timeout,
+                         http_version="2" if http2 else "1.1")
+
+    def _build_client(self):
+        kwargs = dict(self._client_kwargs, limits=self.limits, event_hooks={"request": [self._on_request]})
+        return httpx.AsyncClient(**kwargs)
+
+    async def _on_request(self, request):
+        started = time.perf_counter()
+        acquired = False
+
+        async def trace(event, info):
+            nonlocal acquired
+            if acquired:
+                return
+            acquired = True
+            # новое соединение начинается с connection.connect_tcp, открытое — сразу с отправки запроса
+            reused = not event.startswith("connection.")
+            self.stats["reused" if reused else "new_connections"] += 1
+            waited = time.perf_counter() - started
+            for observer in self.wait_observers:
+                observer(self.name, waited, reused)
+
+        request.extensions["trace"] = trace
+
+    async def do_request(self, *args, **kwargs):
+        self.stats["requests"] += 1
+        if self.in_flight >= self.pool_size:
+            self.stats["pool_waits"] += 1
+        self.in_flight += 1
+        try:
+            return await super().do_request(*args, **kwargs)
+        except Exception as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                self.stats["pool_timeouts"] += 1
+            raise
+        finally:
+            self.in_flight -= 1
@@ -0,0 +1,126 @@
+"""Приём обновлений через webhook на встроенном aiohttp-сервере.
+
+Telegram шлёт POST с обновлением; сервер проверяет секретный токен
+(заголовок X-Telegram-Bot-Api-Secret-Token), кладёт обновление в
+ограниченную очередь и сразу отвечает 200. Обработчики (workers) разбирают
+очередь и передают обновления в application.process_update через
+application.update_processor — тот же конвейер handle_message и тот же
+порядок по инцидентам, что и при polling. Если очередь переполнена,
+сервер отвечает 429, и Telegram повторит доставку позже.
+"""
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger("incident_bot")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    def __init__(self, application, listen="0.0.0.0", port=8443, path="/telegram", secret_token=None,
+                 queue_size=1000, workers=1):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.stats = {"received": 0, "rejected": 0, "dropped": 0, "processed": 0}
+        self._runner = None
+        self._tasks = []
+
+    async def _handle(self, request):
+        if self.secret_token is not None:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token, self.secret_token):
+                self.stats["rejected"] += 1
+                logger.warning(f"Webhook: неверный секретный токен от {request.remote}")
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.Response(status=400)
+        update = Update.de_json(data, self.application.bot)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"Webhook: очередь переполнена ({self.queue.maxsize}), обновление отклонено")
+            return web.Response(status=429)
+        self.stats["received"] += 1
+        return web.Response(status=200)
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.application.update_processor.process_update(
+                    update, self.application.process_update(update))
+            except Exception as e:
+                logger.error(f"Webhook: ошибка обработки обновления: {e}")
+            finally:
+                self.stats["processed"] += 1
+                self.queue.task_done()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        self._tasks = [asyncio.create_task(self._worker(), name=f"webhook-worker-{i}") for i in range(self.workers)]
+        logger.info(f"Webhook-сервер слушает {self.listen}:{self.port}{self.path}")
+
+    async def stop(self, drain_timeout=10):
+        """Перестаёт принимать запросы, дорабатывает очередь и останавливает обработчики."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook: не обработано {self.queue.qsize()} обновлений при остановке")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+async def serve_webhook(application, webhook_url, **server_options):
+    """Полный цикл работы бота в режиме webhook: до SIGINT/SIGTERM."""
+    server = WebhookServer(application, **server_options)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остановка по KeyboardInterrupt
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await server.start()
+        await application.bot.set_webhook(url=webhook_url + server.path, secret_token=server.secret_token,
+                                          allowed_updates=Update.ALL_TYPES)
+        try:
+            await stop.wait()
+        finally:
+            await server.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+        logger.info(f"Webhook-сервер остановлен: {server.stats}")
+
+
+def run_webhook(application, webhook_url, **server_options):
+    try:
+        asyncio.run(serve_webhook(application, webhook_url, **server_options))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,113 @@
+import asyncio
+import datetime
+import importlib
+import logging
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+from replay import ALLOWED_USER, INCIDENT_CHAT, START, FakeApplication, FakeBot, FakeContext, VirtualClock, \
+    run_timers_until
+
+
+class RecordingBot(FakeBot):
+    """FakeBot, который помнит тексты: messages — [(chat_id, text)], edits — то же для правок."""
+
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.edits = []
+
+    async def send_message(self, chat_id, text, message_thread_id=None, **kwargs):
+        self.messages.append((chat_id, text))
+        return await super().send_message(chat_id, text, message_thread_id, **kwargs)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append((chat_id, text))
+        return await super().edit_message_text(text, chat_id, message_id, **kwargs)
+
+
+class Harness:
+    """Incident.py с хранилищем во временном каталоге, FakeBot и виртуальными часами (как bench/replay.py)."""
+
+    def __init__(self, module, clock):
+        self.module = module
+        self.clock = clock
+        self.bot = RecordingBot()
+        self.context = FakeContext(FakeApplication(self.bot))
+        module.application = self.context.application
+        self.update_id = 0
+        self.message_id = 0
+
+    def message(self, text, reply_to=None, chat_id=INCIDENT_CHAT):
+        """Сообщение пользователя в формате Bot API; reply_to — такое же сообщение, на которое отвечают."""
+        self.message_id += 1
+        message = {"message_id": self.message_id, "date": int(self.clock.now), "text": text,
+                   "chat": {"id": chat_id, "type": "supergroup"},
+                   "from": {"id": ALLOWED_USER, "is_bot": False, "first_name": "Test"}}
+        if reply_to:
+            message["reply_to_message"] = reply_to
+        return message
+
+    async def deliver(self, message):
+        """Прогоняет message через handle_message отдельным обновлением."""
+        from telegram import Update
+
+        self.update_id += 1
+        await self.module.handle_message(Update.de_json({"update_id": self.update_id, "message": message}, None),
+                                         self.context)
+
+    async def send(self, text, reply_to=None):
+        message = self.message(text, reply_to)
+        await self.deliver(message)
+        return message
+
+    async def advance(self, seconds):
+        """Проматывает часы, запуская напоминания, сроки которых наступили."""
+        await run_timers_until(self.module.timers, self.clock, self.clock.now + seconds)
+
+    def run(self, coro):
+        """Выполняет сценарий с работающим outbox и дожидается всех отправок."""
+        async def main():
+            self.module.outbox.start(self.bot)
+            try:
+                return await coro
+            finally:
+                await self.module.outbox.stop(timeout=None)
+
+        return asyncio.run(main())
+
+
+@pytest.fixture
+def incident_bot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for name, value in {"LOG_DIR": str(tmp_path), "STORAGE_BACKEND": "sqlite", "METRICS_PORT": "0",
+                        "ESCALATION_CONFIG": os.path.join(ROOT, "escalation.json")}.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.delenv("HA_LEASE_DB", raising=False)
+    sys.modules.pop("Incident", None)
+    module = importlib.import_module("Incident")
+    from incbot.timers import TimerEngine
+
+    module.build_runtime()
+    clock = VirtualClock(START.timestamp())
+    module.timers = TimerEngine(time_func=clock.time)
+    module.coalescer.timers = module.timers
+    module.outbox.time_func = clock.time
+    module.BOT_START_TIME = START - datetime.timedelta(days=1)
+    try:
+        yield Harness(module, clock)
+    finally:
+        module.writer.close()
+        module.store.close()
+        module.outbox.close()
+        module.log_listener.stop()
+        logger = logging.getLogger("incident_bot")
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        sys.modules.pop("Incident", None)
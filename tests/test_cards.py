@@ -0,0 +1,59 @@
+from replay import INCIDENT_CHAT
+
+NEW_INCIDENT = ("Инцидент: Недоступен интернет-банкинг\nПриоритет: 1\nВремя выявления: 12.01.2026 09:00\n\n"
+                "Описание: тест")
+LINK = "JIRA: https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/ITSMJIRA-200"
+
+
+def closed_cards(bot, marker):
+    return [(chat, text) for chat, text in bot.bot.messages + bot.bot.edits if marker in text]
+
+
+def test_resolution_card_has_jira_link(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        original = await bot.send(NEW_INCIDENT + "\nITSMJIRA-200")
+        await bot.advance(600)
+        await bot.send("Устранено", reply_to=original)
+
+    bot.run(scenario())
+    cards = closed_cards(bot, "Статус: решён")
+    assert {chat for chat, _ in cards} == {INCIDENT_CHAT} | {g["chat_id"] for g in bot.module.BROADCAST_GROUPS}
+    assert all(LINK in text for _, text in cards)
+
+
+def test_rejection_card_has_jira_link(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        original = await bot.send(NEW_INCIDENT + "\nITSMJIRA-200")
+        await bot.send("Инцидент отклонен", reply_to=original)
+
+    bot.run(scenario())
+    cards = closed_cards(bot, "Статус: отклонён")
+    assert cards and all(LINK in text for _, text in cards)
+
+
+def test_open_card_has_no_jira_footer(incident_bot):
+    bot = incident_bot
+    bot.run(bot.send(NEW_INCIDENT + "\nITSMJIRA-200"))
+    assert bot.bot.messages and not any(LINK in text for _, text in bot.bot.messages)
+
+
+def test_open_card_elapsed_time_refreshes_without_reminders(incident_bot):
+    bot = incident_bot
+    medium = NEW_INCIDENT.replace("Приоритет: 1", "Приоритет: 3") + "\nITSMJIRA-300"
+
+    async def scenario():
+        original = await bot.send(medium)
+        assert not bot.module.timers.keys_for("ITSMJIRA-300")
+        await bot.advance(25 * 60)
+        await bot.module.outbox.join()
+        await bot.send("Устранено", reply_to=original)
+        assert "card:ITSMJIRA-300" not in bot.module.timers
+
+    bot.run(scenario())
+    group = bot.module.BROADCAST_GROUPS[0]["chat_id"]
+    open_edits = [text for chat, text in bot.bot.edits if chat == group and "Статус: открыт" in text]
+    assert open_edits and "Прошло с выявления: 20 мин" in open_edits[-1]
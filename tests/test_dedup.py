@@ -0,0 +1,37 @@
+from incbot.catchup import CatchUp
+
+NEW_INCIDENT = ("Инцидент: Медленная работа АБС\nПриоритет: 3\nВремя выявления: 12.01.2026 09:00\n\n"
+                "https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/ITSMJIRA-100")
+
+
+def test_same_priority_reply_twice_is_not_dropped(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        original = await bot.send(NEW_INCIDENT)
+        await bot.send("Приоритет инцидента повышен до 2", reply_to=original)
+        await bot.send("Приоритет инцидента понижен до 3", reply_to=original)
+        assert not bot.module.timers.keys_for("ITSMJIRA-100")
+        # тот же текст ответа на то же сообщение — новое событие, а не повтор
+        await bot.send("Приоритет инцидента повышен до 2", reply_to=original)
+
+    bot.run(scenario())
+    assert bot.module.incidents["ITSMJIRA-100"]["priority"] == "высокий"
+    assert bot.module.timers.keys_for("ITSMJIRA-100")
+
+
+def test_redelivered_message_skipped_during_catchup(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        original = await bot.send(NEW_INCIDENT)
+        reply = bot.message("Приоритет инцидента повышен до 2", reply_to=original)
+        bot.module.catchup = CatchUp()
+        await bot.deliver(reply)
+        bot.module.incidents["ITSMJIRA-100"]["priority"] = "низкий"
+        # то же сообщение под другим update_id (повторный догон) не применяется второй раз
+        await bot.deliver(reply)
+        bot.module.catchup = None
+
+    bot.run(scenario())
+    assert bot.module.incidents["ITSMJIRA-100"]["priority"] == "низкий"
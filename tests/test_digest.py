@@ -0,0 +1,46 @@
+from replay import INCIDENT_CHAT
+
+
+def incident(n, detected):
+    return (f"Инцидент: Сбой обмена с ГНС #{n}\nПриоритет: 1\nВремя выявления: 12.01.2026 {detected}\n\n"
+            f"https://jiraportal.cbk.kg/projects/ITSMJIRA/queues/issue/ITSMJIRA-77{n}")
+
+
+def reminders(bot):
+    return [text for chat, text in bot.bot.messages if chat == INCIDENT_CHAT and text.startswith("Прошло")]
+
+
+def test_steps_of_one_incident_fire_as_one_reminder(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        # выявлен 70 минут назад: шаги «50» и «60» наступили сразу
+        await bot.send(incident(8, "07:50"))
+        await bot.advance(120)
+
+    bot.run(scenario())
+    sent = reminders(bot)
+    assert len(sent) == 1
+    assert sent[0].startswith("Прошло 60 минут!")
+    steps = bot.module.incidents["ITSMJIRA-778"]["reminders"]["steps"]
+    assert steps["50"]["fired"] and steps["60"]["fired"] and not steps["3h"]["fired"]
+
+
+def test_digest_counts_each_incident_once(incident_bot):
+    bot = incident_bot
+
+    async def scenario():
+        await bot.send(incident(8, "07:50"))
+        await bot.send(incident(9, "07:55"))
+        await bot.advance(120)
+
+    bot.run(scenario())
+    digests = [text for chat, text in bot.bot.messages if text.startswith("Напоминание по")]
+    assert len(digests) == 1
+    digest = digests[0]
+    assert digest.startswith("Напоминание по 2 открытым инцидентам:")
+    assert digest.count("ITSMJIRA-778") == 1 and digest.count("ITSMJIRA-779") == 1
+    # у каждого инцидента — текст его последнего шага, без адресатов в строке
+    lines = [line for line in digest.splitlines() if line.startswith("• ")]
+    assert all(line.endswith("Прошло 60 минут!") for line in lines)
+    assert not reminders(bot)
@@ -0,0 +1,35 @@
+import json
+import os
+
+import pytest
+
+from incbot.escalation import DEFAULT_POLICY, EscalationPolicy
+
+
+def ladder(*steps):
+    return {"targets": ["@duty"], "ladders": {"standard": list(steps)}, "priorities": {"критичный": "standard"}}
+
+
+def test_shipped_policies_load():
+    EscalationPolicy(DEFAULT_POLICY)
+    with open(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "escalation.json"), encoding="utf-8") as f:
+        EscalationPolicy(json.load(f))
+
+
+def test_all_placeholders_render():
+    policy = EscalationPolicy(ladder({"id": "50", "after": "50m",
+                                      "text": "{incident_id} {name} {priority} {after} {targets}"}))
+    step = policy.step("критичный", "50")
+    text = step.render("ITSMJIRA-1", {"text": "Инцидент: Сбой АБС\nПриоритет: 1", "priority": "критичный"})
+    assert text == "ITSMJIRA-1 Сбой АБС критичный 0:50:00 @duty"
+
+
+@pytest.mark.parametrize("template", ["Прошло 50 минут {target}", "{0}", "{after.minutes}", "{name", "50}"])
+def test_bad_template_rejected_at_load(template):
+    with pytest.raises(ValueError, match="шаблоне шага '50'"):
+        EscalationPolicy(ladder({"id": "50", "after": "50m", "text": template}))
+
+
+def test_duplicate_step_id_rejected():
+    with pytest.raises(ValueError, match="Повторяется id шага '50'"):
+        EscalationPolicy(ladder({"id": "50", "after": "50m", "text": "a"}, {"id": 50, "after": "60m", "text": "b"}))
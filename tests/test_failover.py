@@ -0,0 +1,78 @@
+import importlib
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import failover
+from incbot.leader import Lease
+from incbot.outbox import RETENTION, SCHEMA
+
+
+def seed_outbox(path):
+    """Лидерский outbox.db: давно отправленная строка (её чистит _cleanup) и одна неотправленная."""
+    now = time.time()
+    with sqlite3.connect(path) as conn:
+        conn.executescript(SCHEMA)
+        conn.execute("""INSERT INTO outbox(dedup_key, chat_id, text, kind, status, created_ts, next_ts, done_ts)
+                        VALUES ('update:1:1:None', 1, 'старое', 'broadcast', 'sent', ?, ?, ?)""",
+                     (now - 2 * RETENTION, now - 2 * RETENTION, now - 2 * RETENTION))
+        conn.execute("""INSERT INTO outbox(dedup_key, chat_id, text, kind, created_ts, next_ts)
+                        VALUES ('update:2:1:None', 1, 'в очереди', 'broadcast', ?, ?)""", (now, now))
+    conn.close()
+
+
+def outbox_rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT text FROM outbox ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def test_standby_does_not_touch_leader_outbox(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    lease_db = str(tmp_path / "leader.db")
+    for name, value in {"LOG_DIR": str(tmp_path), "STORAGE_BACKEND": "sqlite", "METRICS_PORT": "0",
+                        "HA_LEASE_DB": lease_db, "HA_INSTANCE": "B", "HA_LEASE_TTL": "1"}.items():
+        monkeypatch.setenv(name, value)
+    seed_outbox("outbox.db")
+    leader = Lease(lease_db, "A", ttl=60)
+    assert leader.acquire()
+
+    sys.modules.pop("Incident", None)
+    Incident = importlib.import_module("Incident")
+    try:
+        Incident.build_runtime()
+        assert Incident.outbox is None
+        # резерв не читает состояние лидера, пока ждёт аренду
+        assert Incident.incidents == {} and Incident.analytics is None
+        assert outbox_rows("outbox.db") == [("старое",), ("в очереди",)]
+        assert os.path.basename(Incident.LOG_FILE) == "incident.B.log"
+
+        leader.release()
+        Incident.wait_for_leadership()
+        # после захвата аренды outbox открыт, очередь лидера подхвачена
+        assert len(Incident.outbox) == 1
+        assert Incident.analytics is not None
+        assert outbox_rows("outbox.db") == [("в очереди",)]
+    finally:
+        leader.close()
+        Incident.writer.close()
+        Incident.store.close()
+        if Incident.outbox:
+            Incident.outbox.close()
+        Incident.lease.close()
+        Incident.log_listener.stop()
+        logger = logging.getLogger("incident_bot")
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        sys.modules.pop("Incident", None)
+
+
+def test_failover_sends_each_reminder_once():
+    """Лидера убивают SIGKILL: резерв шлёт «60 минут» ровно один раз и не повторяет «50 минут»."""
+    run = failover.run_once(ttl=2.0)
+    assert run["reminders_60"] == 1
+    assert run["reminders_50"] == 0
@@ -0,0 +1,49 @@
+import asyncio
+import datetime
+
+from telegram.error import ChatMigrated, RetryAfter
+
+from incbot.fanout import MAX_MIGRATIONS, Broadcaster
+
+UNLIMITED = float("inf")
+
+
+class CyclingBot:
+    """Бот, у которого чаты 1 и 2 бесконечно «переезжают» друг в друга."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, message_thread_id=None):
+        self.calls += 1
+        raise ChatMigrated(2 if chat_id == 1 else 1)
+
+
+class FloodedBot:
+    """Первая отправка упирается во flood-лимит с retry_after в виде timedelta."""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def send_message(self, chat_id, text, message_thread_id=None):
+        self.calls += 1
+        if self.calls == 1:
+            raise RetryAfter(datetime.timedelta(seconds=0))
+        return True
+
+
+def test_migration_cycle_gives_up():
+    broadcaster = Broadcaster(UNLIMITED, UNLIMITED, UNLIMITED, UNLIMITED)
+    bot = CyclingBot()
+    message, permanent = asyncio.run(broadcaster.deliver(bot, {"chat_id": 1}, "Инцидент"))
+    assert message is None and permanent
+    assert bot.calls == MAX_MIGRATIONS + 1
+    assert broadcaster.resolve_chat(1) in (1, 2)
+
+
+def test_retry_after_timedelta():
+    broadcaster = Broadcaster(UNLIMITED, UNLIMITED, UNLIMITED, UNLIMITED)
+    bot = FloodedBot()
+    message, permanent = asyncio.run(broadcaster.deliver(bot, {"chat_id": 1}, "Инцидент"))
+    assert message is True and not permanent
+    assert bot.calls == 2
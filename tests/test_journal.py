@@ -0,0 +1,32 @@
+import datetime
+import json
+
+from incbot.journal import IncidentJournal
+
+INCIDENT = {"text": "Инцидент", "chat_id": -100, "jobs": [], "priority": "средний",
+            "time": datetime.datetime(2026, 1, 12, 9, 0, tzinfo=datetime.timezone.utc)}
+
+
+def test_meta_goes_to_journal_and_survives_compaction(tmp_path):
+    path = str(tmp_path / "incidents.json")
+    journal = IncidentJournal(path, compact_every=10)
+    journal.load()
+    for update_id in range(5):
+        journal.set_meta("last_update_id", update_id)
+    # пока нет сжатия, meta.json не переписывается на каждое значение
+    assert not (tmp_path / "incidents.meta.json").exists()
+    assert journal.get_meta("last_update_id") == "4"
+    journal.close()
+
+    reopened = IncidentJournal(path, compact_every=10)
+    reopened.load()
+    assert reopened.get_meta("last_update_id") == "4"
+    reopened.set_meta("analytics", "{}")
+    for i in range(10):
+        reopened.append("create", f"ITSMJIRA-{i}", INCIDENT)
+    reopened.close()
+
+    meta = json.loads((tmp_path / "incidents.meta.json").read_text(encoding="utf-8"))
+    assert meta == {"last_update_id": "4", "analytics": "{}"}
+    assert not (tmp_path / "incidents.journal.1").exists()
+    assert IncidentJournal(path).get_meta("analytics") == "{}"
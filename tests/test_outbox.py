@@ -0,0 +1,62 @@
+import asyncio
+import threading
+
+from incbot.fanout import Broadcaster
+from incbot.outbox import Outbox
+from replay import FakeBot
+
+UNLIMITED = float("inf")
+
+
+def open_outbox(path):
+    return Outbox(str(path), Broadcaster(UNLIMITED, UNLIMITED, UNLIMITED, UNLIMITED))
+
+
+def test_enqueue_writes_off_loop_and_dedups_across_restart(tmp_path):
+    path = tmp_path / "outbox.db"
+    outbox = open_outbox(path)
+    # в каком потоке выполняется каждый SQL-запрос после открытия
+    threads = set()
+    outbox._conn.set_trace_callback(lambda sql: threads.add(threading.current_thread().name))
+    bot = FakeBot()
+
+    async def scenario():
+        outbox.start(bot)
+        assert outbox.enqueue([{"chat_id": 1}, {"chat_id": 2}], "Инцидент", key="update:1") == 2
+        assert outbox.enqueue([{"chat_id": 1}], "Инцидент", key="update:1") == 0
+        await outbox.stop()
+
+    asyncio.run(scenario())
+    outbox.close()
+    assert bot.sent == 2
+    assert threads == {"store-writer"}
+
+    reopened = open_outbox(path)
+    assert len(reopened) == 0
+    assert reopened.enqueue([{"chat_id": 2}], "Инцидент", key="update:1") == 0
+    assert reopened.enqueue([{"chat_id": 2}], "Решён", key="update:2") == 1
+    reopened.close()
+
+
+def test_pending_messages_survive_restart(tmp_path):
+    path = tmp_path / "outbox.db"
+    outbox = open_outbox(path)
+
+    async def enqueue_only():
+        outbox.enqueue([{"chat_id": 1}], "Напоминание", kind="reminder", key="reminder:1")
+        await outbox.writer.drain()
+
+    asyncio.run(enqueue_only())
+    outbox.close()
+
+    reopened = open_outbox(path)
+    bot = FakeBot()
+
+    async def deliver():
+        reopened.start(bot)
+        await reopened.stop()
+
+    asyncio.run(deliver())
+    reopened.close()
+    assert bot.sent == 1
+    assert reopened.stats["sent:reminder"] == 1
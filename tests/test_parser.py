@@ -0,0 +1,21 @@
+import datetime
+
+from incbot.parser import extract_detection_time
+
+TZ = datetime.timezone(datetime.timedelta(hours=6))
+MESSAGE_TIME = datetime.datetime(2026, 3, 2, 12, 30, tzinfo=TZ)
+
+
+def test_detection_time_with_date():
+    text = "Инцидент: АБС\nВремя выявления: 01.03.2026 10:00"
+    assert extract_detection_time(text, MESSAGE_TIME) == datetime.datetime(2026, 3, 1, 10, 0, tzinfo=TZ)
+
+
+def test_invalid_detection_date_falls_back_to_message_time():
+    text = "Инцидент: АБС\nВремя выявления: 31.02.2026 10:00"
+    assert extract_detection_time(text, MESSAGE_TIME) == MESSAGE_TIME
+
+
+def test_detection_time_without_date():
+    text = "Инцидент: АБС\nВремя выявления: 10:00"
+    assert extract_detection_time(text, MESSAGE_TIME) == datetime.datetime(2026, 3, 2, 10, 0, tzinfo=TZ)
@@ -0,0 +1,55 @@
+import datetime
+
+from incbot.storage import SqliteStore
+
+TZ = datetime.timezone(datetime.timedelta(hours=6))
+NOW = datetime.datetime(2026, 1, 12, 12, 0, tzinfo=TZ)
+
+
+def incident(hours_ago, chat_id=-100, priority="средний"):
+    return {"text": "Инцидент", "chat_id": chat_id, "time": NOW - datetime.timedelta(hours=hours_ago),
+            "jobs": [], "priority": priority}
+
+
+def test_point_range_and_index_lookups(tmp_path):
+    store = SqliteStore(str(tmp_path / "incidents.db"))
+    store.append("create", "ITSMJIRA-1", incident(30))
+    store.append("create", "ITSMJIRA-2", incident(5, priority="критичный"))
+    store.append("create", "ITSMJIRA-3", incident(2, chat_id=-200))
+    store.append("create", "ITSMJIRA-4", incident(1, priority="критичный"))
+    store.append("resolve", "ITSMJIRA-4", closed_at=NOW)
+
+    assert store.get("ITSMJIRA-2")["priority"] == "критичный"
+    assert store.get("ITSMJIRA-4")["status"] == "resolved"
+    assert store.get("ITSMJIRA-404") is None
+
+    last_day = store.incidents_since(NOW - datetime.timedelta(hours=24))
+    assert [i["incident_id"] for i in last_day] == ["ITSMJIRA-2", "ITSMJIRA-3", "ITSMJIRA-4"]
+    window = store.incidents_since(NOW - datetime.timedelta(hours=24), until=NOW - datetime.timedelta(hours=2))
+    assert [i["incident_id"] for i in window] == ["ITSMJIRA-2"]
+    assert [i["incident_id"] for i in store.incidents_since(NOW - datetime.timedelta(hours=24), status="open")] \
+        == ["ITSMJIRA-2", "ITSMJIRA-3"]
+
+    assert [i["incident_id"] for i in store.by_chat(-200)] == ["ITSMJIRA-3"]
+    assert [i["incident_id"] for i in store.by_chat(-100)] == ["ITSMJIRA-1", "ITSMJIRA-2"]
+    assert [i["incident_id"] for i in store.by_chat(-100, status="resolved")] == ["ITSMJIRA-4"]
+    assert [i["incident_id"] for i in store.open_incidents(priority="критичный")] == ["ITSMJIRA-2"]
+    store.close()
+
+
+def test_reopened_key_keeps_closed_history(tmp_path):
+    store = SqliteStore(str(tmp_path / "incidents.db"))
+    store.append("create", "ITSMJIRA-1", incident(10, priority="критичный"))
+    store.append("resolve", "ITSMJIRA-1", closed_at=NOW - datetime.timedelta(hours=9))
+    store.append("create", "ITSMJIRA-1", incident(2))
+    # повторный upsert открытого инцидента (смена приоритета) архив не множит
+    store.append("update", "ITSMJIRA-1", incident(2, priority="высокий"))
+
+    assert store.get("ITSMJIRA-1")["status"] == "open"
+    history = list(store.history())
+    assert [(priority, status) for priority, status, _, _ in history] == [("критичный", "resolved"),
+                                                                          ("высокий", "open")]
+    assert history[0][3] == NOW - datetime.timedelta(hours=9)
+    closed = store.incidents_since(NOW - datetime.timedelta(hours=24), status="resolved")
+    assert [(i["incident_id"], i["time_to_resolve"]) for i in closed] == [("ITSMJIRA-1", 3600)]
+    store.close()